@@ -43,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'pulogger.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -80,6 +81,25 @@ WSGI_APPLICATION = 'deadleavesclub.wsgi.application'
 DATABASES = secret_config.DATABASES
 
 
+# Caches
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+# 'history' holds bucketed getHistory results; locmem culls least-recently-used entries beyond MAX_ENTRIES
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'history': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'pulogger-history',
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 256,
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -113,6 +133,71 @@ USE_L10N = True
 USE_TZ = True
 
 
+# Raw data retention
+# SensorDatum rows older than PULOGGER_RAW_DATA_MAX_AGE_DAYS are moved to monthly gzip CSV files under
+# PULOGGER_ARCHIVE_DIR by `manage.py compact_sensor_data`; their rollups stay in the database
+
+PULOGGER_RAW_DATA_MAX_AGE_DAYS = 365
+if platform == 'linux':
+    PULOGGER_ARCHIVE_DIR = '/srv/django/deadleavesclub/archive/'
+else:
+    PULOGGER_ARCHIVE_DIR = os.path.join(BASE_DIR, 'archive')
+
+# Ingest mode
+# 'direct' writes submissions to the database within the request; 'queued' spools them to the SQLite file at
+# PULOGGER_INGEST_QUEUE_PATH for `manage.py drain_ingest_queue` to write in batches. Submissions are refused with a 503
+# once PULOGGER_INGEST_QUEUE_MAX_DEPTH readings are waiting.
+
+PULOGGER_INGEST_MODE = 'direct'
+PULOGGER_INGEST_QUEUE_MAX_DEPTH = 500000
+if platform == 'linux':
+    PULOGGER_INGEST_QUEUE_PATH = '/srv/django/deadleavesclub/ingest_queue.sqlite3'
+else:
+    PULOGGER_INGEST_QUEUE_PATH = os.path.join(BASE_DIR, 'ingest_queue.sqlite3')
+
+# Recent readings ring buffer
+# The last PULOGGER_RING_BUFFER_HOURS of readings are kept in a memory-mapped file in PULOGGER_RING_BUFFER_DIR, shared
+# by every worker, and raw-resolution charts within that window are drawn from it rather than SensorDatum. Off while
+# None; point it at tmpfs, e.g. '/dev/shm', and run `manage.py rebuild_ring_buffer` on deploy to enable it. The file
+# grows with the number of sensor+type series, by 64KB each, up to PULOGGER_RING_BUFFER_MAX_SERIES; charts of a
+# datalogger with a series beyond that are drawn from the database instead.
+
+PULOGGER_RING_BUFFER_DIR = None
+PULOGGER_RING_BUFFER_HOURS = 48
+PULOGGER_RING_BUFFER_MAX_SERIES = 4096
+
+# Metadata cache
+# Each process keeps a snapshot of the admin-managed tables; a change made by any process is picked up by the others
+# within PULOGGER_METADATA_CHECK_SECONDS
+
+PULOGGER_METADATA_CHECK_SECONDS = 5
+
+# Request metrics
+# RequestMetricsMiddleware measures this fraction of requests; /pulogger/metrics serves them to staff users and to
+# scrapers sending "Authorization: Bearer <METRICS_TOKEN>"
+
+PULOGGER_METRICS_SAMPLE_RATE = 1.0
+PULOGGER_METRICS_TOKEN = getattr(secret_config, 'METRICS_TOKEN', '')
+
+# Alerts
+# AlertRules are checked as readings are written, and no-data rules by `manage.py check_alerts` run every minute from
+# cron. Each time an alert starts or stops firing, every notifier in PULOGGER_ALERT_NOTIFIERS is called:
+# 'pulogger.alerts.LogFileNotifier' appends to PULOGGER_ALERT_LOG_PATH and 'pulogger.alerts.WebhookNotifier' POSTs
+# JSON to PULOGGER_ALERT_WEBHOOK_URL.
+
+PULOGGER_ALERT_NOTIFIERS = ['pulogger.alerts.LogFileNotifier']
+if platform == 'linux':
+    PULOGGER_ALERT_LOG_PATH = '/srv/django/deadleavesclub/alerts.log'
+else:
+    PULOGGER_ALERT_LOG_PATH = os.path.join(BASE_DIR, 'alerts.log')
+PULOGGER_ALERT_WEBHOOK_URL = 'http://127.0.0.1:8081/alerts'
+
+# Outages
+# A datalogger silent for more than PULOGGER_OUTAGE_THRESHOLD_MINUTES between two transmissions is recorded as down
+# for the gap, which /pulogger/getUptime reports and the history chart doesn't draw a line across
+
+PULOGGER_OUTAGE_THRESHOLD_MINUTES = 10
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/2.2/howto/static-files/
 # app_name/static/app_name is searched by default (need to check, but 99% sure this is true)
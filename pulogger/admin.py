@@ -1,9 +1,13 @@
 from django.contrib import admin
 
-from .models import Datalogger, SensorModel, Sensor, DatumType, SensorModelDatumType
+from .models import Datalogger, SensorModel, Sensor, DatumType, SensorModelDatumType, AlertRule, AlertState, \
+    DataloggerOutage
 
 admin.site.register(Datalogger)
 admin.site.register(SensorModel)
 admin.site.register(Sensor)
 admin.site.register(DatumType)
 admin.site.register(SensorModelDatumType)
+admin.site.register(AlertRule)
+admin.site.register(AlertState)
+admin.site.register(DataloggerOutage)
@@ -0,0 +1,191 @@
+import logging
+import queue
+import threading
+from collections import namedtuple
+from datetime import timedelta
+from json import dumps as json_dumps
+from urllib.request import Request, urlopen
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils.module_loading import import_string
+from django.utils.timezone import now
+
+from .metadata import get_metadata
+from .models import Datalogger, AlertState
+
+# AlertRules are checked against readings as they're written, in O(rules for the reading's series), and no-data
+# rules by sweep_no_data_alerts() in O(no-data rules). Only changes of state are notified, once the change has been
+# committed, to every notifier in PULOGGER_ALERT_NOTIFIERS. Notifications from ingest are sent by a background thread
+# per process, so a slow or unreachable webhook never holds up a submission.
+
+WEBHOOK_TIMEOUT = 5
+NOTIFICATION_QUEUE_SIZE = 1000  # batches of notifications waiting for the notifier thread
+
+logger = logging.getLogger(__name__)
+
+_notification_queue = queue.Queue(maxsize=NOTIFICATION_QUEUE_SIZE)
+_notification_thread = None
+_notification_thread_lock = threading.Lock()
+
+AlertNotification = namedtuple('AlertNotification', ['rule', 'device_name', 'sensor_name', 'is_firing', 'value',
+                                                     'timestamp'])
+
+
+class LogFileNotifier:
+    # Appends a line per notification to PULOGGER_ALERT_LOG_PATH
+    def notify(self, notifications):
+        with open(settings.PULOGGER_ALERT_LOG_PATH, 'a') as log_file:
+            log_file.writelines(f'{notification.timestamp.isoformat()} '
+                                f'{"FIRING" if notification.is_firing else "RESOLVED"} {notification.device_name} '
+                                f'{notification.sensor_name}: {notification.rule} (value {notification.value})\n'
+                                for notification in notifications)
+
+
+class WebhookNotifier:
+    # POSTs the notifications as a JSON list to PULOGGER_ALERT_WEBHOOK_URL
+    def notify(self, notifications):
+        body = json_dumps([{
+            'rule_id': notification.rule.id,
+            'rule': str(notification.rule),
+            'condition': notification.rule.condition,
+            'device_name': notification.device_name,
+            'sensor_name': notification.sensor_name,
+            'state': 'firing' if notification.is_firing else 'resolved',
+            'value': None if notification.value is None else float(notification.value),
+            'timestamp': int(notification.timestamp.timestamp()),
+        } for notification in notifications]).encode()
+
+        request = Request(settings.PULOGGER_ALERT_WEBHOOK_URL, data=body,
+                          headers={'Content-Type': 'application/json'})
+        with urlopen(request, timeout=WEBHOOK_TIMEOUT):
+            pass
+
+
+def send_notifications(notifications):
+    # A failing notifier mustn't stop the others, nor fail the request that wrote the readings
+    for notifier_path in settings.PULOGGER_ALERT_NOTIFIERS:
+        try:
+            import_string(notifier_path)().notify(notifications)
+        except Exception:
+            logger.exception('Alert notifier %s failed', notifier_path)
+
+
+def send_notifications_in_background(notifications):
+    # Queues the notifications for this process's notifier thread, started on first use (and again after a fork).
+    # If the notifiers have fallen that far behind, the batch is dropped rather than waited for.
+    global _notification_thread
+    with _notification_thread_lock:
+        if _notification_thread is None or not _notification_thread.is_alive():
+            _notification_thread = threading.Thread(target=run_notification_thread, name='pulogger-alert-notifier',
+                                                    daemon=True)
+            _notification_thread.start()
+
+    try:
+        _notification_queue.put_nowait(notifications)
+    except queue.Full:
+        logger.error('Alert notification queue full, dropped %d notifications', len(notifications))
+
+
+def run_notification_thread():
+    while True:
+        notifications = _notification_queue.get()
+        try:
+            send_notifications(notifications)
+        finally:
+            connections.close_all()  # any this thread's notifiers opened
+            _notification_queue.task_done()
+
+
+def get_alert_states(keys):
+    # {(rule id, sensor id): AlertState} for the keys that have a state, locked until the transaction ends
+    rule_ids = {rule_id for rule_id, _ in keys}
+    sensor_ids = {sensor_id for _, sensor_id in keys}
+    return {(state.rule_id, state.sensor_id): state for state in
+            AlertState.objects.select_for_update().filter(rule_id__in=rule_ids, sensor_id__in=sensor_ids)}
+
+
+def set_alert_state(states, changed, rule, sensor, is_firing, value, timestamp):
+    # Records a rule's state for a sensor, returning a notification if it has changed
+    state = states.get((rule.id, sensor.id))
+    if state is None:
+        if not is_firing:
+            return None
+        state = states[rule.id, sensor.id] = AlertState(rule=rule, sensor=sensor)
+    elif state.is_firing == is_firing:
+        return None
+
+    state.is_firing = is_firing
+    state.changed_at = timestamp
+    state.value = value
+    changed[rule.id, sensor.id] = state
+    return AlertNotification(rule, sensor.datalogger.device_name, sensor.sensor_name, is_firing, value, timestamp)
+
+
+def save_alert_states(changed, notifications, in_background=True):
+    # Writes the changed states and sends their notifications once the transaction commits
+    if not changed:
+        return
+
+    AlertState.objects.bulk_update([state for state in changed.values() if state.pk], ['is_firing', 'changed_at',
+                                                                                        'value'])
+    # A state created concurrently by another process loses to that one
+    AlertState.objects.bulk_create([state for state in changed.values() if not state.pk], ignore_conflicts=True)
+    send = send_notifications_in_background if in_background else send_notifications
+    transaction.on_commit(lambda: send(notifications))
+
+
+def check_alert_rules(checks):
+    # checks: (SensorDatum, previous timestamp, previous value) for newly written readings, in time order per series,
+    # with the series' reading before each if any. Must run in the same transaction as the writes.
+    metadata = get_metadata()
+    checks = [(datum, previous_timestamp, previous_value, metadata.get_alert_rules(datum.sensor_id, datum.type_id))
+              for datum, previous_timestamp, previous_value in checks]
+    keys = {(rule.id, datum.sensor_id) for datum, _, _, rules in checks for rule in rules}
+    if not keys:
+        return
+
+    with transaction.atomic():
+        states = get_alert_states(keys)
+        changed = {}
+        notifications = []
+        for datum, previous_timestamp, previous_value, rules in checks:
+            sensor = metadata.get_sensor_by_id(datum.sensor_id)
+            for rule in rules:
+                notification = set_alert_state(
+                    states, changed, rule, sensor,
+                    rule.is_breached(datum.value, datum.timestamp, previous_value, previous_timestamp),
+                    datum.value, datum.timestamp)
+                if notification:
+                    notifications.append(notification)
+
+        save_alert_states(changed, notifications)
+
+
+def sweep_no_data_alerts(swept_at=None):
+    # Fires no-data rules whose sensor's logger hasn't transmitted within the rule's minutes, and resolves those
+    # whose logger has since. Costs two queries however much data there is. Returns the notifications.
+    swept_at = swept_at or now()
+    rules = get_metadata().get_no_data_alert_rules()
+    if not rules:
+        return []
+
+    # Read fresh, since transmissions don't invalidate the metadata cache
+    last_transmissions = dict(Datalogger.objects.filter(id__in={sensor.datalogger_id for _, sensor in rules})
+                              .values_list('id', 'last_transmission'))
+
+    with transaction.atomic():
+        states = get_alert_states({(rule.id, sensor.id) for rule, sensor in rules})
+        changed = {}
+        notifications = []
+        for rule, sensor in rules:
+            last_transmission = last_transmissions.get(sensor.datalogger_id)
+            is_firing = last_transmission is None or last_transmission < swept_at - timedelta(minutes=rule.minutes)
+            notification = set_alert_state(states, changed, rule, sensor, is_firing, None, swept_at)
+            if notification:
+                notifications.append(notification)
+
+        # Sent before returning, as the sweep runs from cron in a process that exits when it's done
+        save_alert_states(changed, notifications, in_background=False)
+
+    return notifications
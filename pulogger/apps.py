@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class PuloggerConfig(AppConfig):
     name = 'pulogger'
+
+    def ready(self):
+        from . import signals  # noqa: F401 - connects the metadata cache invalidation receivers
@@ -0,0 +1,228 @@
+import platform
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from json import dumps as json_dumps
+from statistics import median
+from time import perf_counter
+
+import django
+import numpy as np
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Max
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from .history_cache import HISTORY_CACHE_ALIAS
+from .metadata import invalidate_metadata
+from .models import Datalogger, SensorModel, Sensor, DatumType, SensorModelDatumType, SensorDatum
+
+BENCHMARK_DEVICE_PREFIX = 'bench-'
+BENCHMARK_SENSOR_MODEL = 'DHT22'
+BENCHMARK_DATUM_TYPES = {
+    # description: (starting value, random walk step standard deviation)
+    'temperature': (20.0, 0.05),
+    'humidity': (65.0, 0.2),
+}
+BENCHMARK_SUBMISSION_IP = '127.0.0.1'
+BENCHMARK_INSERT_BATCH_SIZE = 5000
+HISTORY_WINDOWS = {
+    'day': timedelta(days=1),
+    'week': timedelta(weeks=1),
+    'month': timedelta(days=30),
+    'year': timedelta(days=365),
+}
+HISTORY_FORMATS = ('canvas_js', 'compact')
+
+
+def get_benchmark_device_name(idx):
+    return f'{BENCHMARK_DEVICE_PREFIX}{idx}'
+
+
+def create_benchmark_loggers(loggers, sensors):
+    # Dataloggers bench-0..bench-N, each with sensors s0..sM able to measure every benchmark datum type
+    sensor_model, _ = SensorModel.objects.get_or_create(type=BENCHMARK_SENSOR_MODEL)
+    for description in BENCHMARK_DATUM_TYPES:
+        datum_type, _ = DatumType.objects.get_or_create(description=description)
+        SensorModelDatumType.objects.get_or_create(sensor=sensor_model, datum_type=datum_type)
+
+    created = []
+    for logger_idx in range(loggers):
+        datalogger, _ = Datalogger.objects.get_or_create(device_name=get_benchmark_device_name(logger_idx),
+                                                         defaults={'passcode': 'BENCH'})
+        for sensor_idx in range(sensors):
+            sensor, _ = Sensor.objects.get_or_create(datalogger=datalogger, sensor_name=f's{sensor_idx}',
+                                                     defaults={'type': sensor_model})
+            created.append(sensor)
+
+    invalidate_metadata()
+    return created
+
+
+def generate_benchmark_data(loggers, sensors, days, interval_minutes, seed=0, log=None):
+    # Fills SensorDatum with a random walk per sensor and datum type, one reading every interval_minutes for the
+    # `days` days up to the start of today (UTC), then rebuilds the derived tables from it. Bypasses the hysteresis
+    # rules, so every generated reading is stored. Returns the number of readings written.
+    rng = np.random.RandomState(seed)
+    sensors = create_benchmark_loggers(loggers, sensors)
+    datum_types = {datum_type.description: datum_type for datum_type in
+                   DatumType.objects.filter(description__in=BENCHMARK_DATUM_TYPES)}
+    end = datetime.now(tz=timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    timestamps = [end - timedelta(days=days) + timedelta(minutes=interval_minutes * idx)
+                  for idx in range(days * 24 * 60 // interval_minutes)]
+
+    total = 0
+    for sensor in sensors:
+        for description, (start_value, step) in BENCHMARK_DATUM_TYPES.items():
+            datum_type = datum_types[description]
+            values = np.round(np.clip(start_value + np.cumsum(rng.normal(0, step, len(timestamps))), 0, 99.99), 2)
+            unique_sensor_name = SensorDatum.build_unique_sensor_name(sensor.sensor_name, sensor.id, datum_type.id)
+
+            for idx in range(0, len(timestamps), BENCHMARK_INSERT_BATCH_SIZE):
+                with transaction.atomic():
+                    SensorDatum.objects.bulk_create(
+                        SensorDatum(sensor=sensor, datalogger_id=sensor.datalogger_id, type=datum_type,
+                                    unique_sensor_name=unique_sensor_name, submission_ip=BENCHMARK_SUBMISSION_IP,
+                                    timestamp=timestamp, value=Decimal(str(value)))
+                        for timestamp, value in zip(timestamps[idx:idx + BENCHMARK_INSERT_BATCH_SIZE],
+                                                    values[idx:idx + BENCHMARK_INSERT_BATCH_SIZE].tolist()))
+
+            total += len(timestamps)
+            if log:
+                log(f'{sensor.datalogger.device_name} {sensor.sensor_name} {description}: {len(timestamps)} readings')
+
+    call_command('backfill_rollups')
+    call_command('rebuild_daily_statistics')
+    call_command('rebuild_latest_readings')
+
+    return total
+
+
+def get_history_query(device_name, history_start, history_end, requested_format):
+    # getHistory's query string for a range given in UTC, in DatetimeRangePicker's 12-hour fields
+    query = {'device': device_name, 'clientTzOffset': 0, 'format': requested_format}
+    for prefix, dt in (('from', history_start), ('to', history_end)):
+        query.update({
+            f'{prefix}_date': f'{dt:%Y-%m-%d}',
+            f'{prefix}_hours': dt.hour % 12 or 12,
+            f'{prefix}_minutes': dt.minute,
+            f'{prefix}_is_pm': dt.hour >= 12,
+        })
+
+    return query
+
+
+def get_latency_summary(latencies):
+    latencies = sorted(latencies)
+    return {
+        'median_ms': median(latencies) * 1000,
+        'p95_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+        'max_ms': latencies[-1] * 1000,
+    }
+
+
+def run_submit_benchmark(client, device_name, requests):
+    # submitdata throughput with every sensor reporting every datum type per request. Each request is a minute after
+    # the last and alternates values by more than the hysteresis band, so every reading is written.
+    sensors = list(Sensor.objects.filter(datalogger__device_name=device_name).values_list('sensor_name', flat=True))
+    latest = SensorDatum.objects.filter(datalogger__device_name=device_name).aggregate(latest=Max('timestamp'))
+    start = int((latest['latest'] or datetime.now(tz=timezone.utc)).timestamp()) + 60
+
+    latencies = []
+    queries = []
+    started = perf_counter()
+    for idx in range(requests):
+        readings = [(sensor_name, description, f'{start_value + (5 if idx % 2 else 0):.2f}')
+                    for sensor_name in sensors for description, (start_value, _) in BENCHMARK_DATUM_TYPES.items()]
+        query = {
+            'device': device_name,
+            'sensors': ','.join(sensor_name for sensor_name, _, _ in readings),
+            'types': ','.join(description for _, description, _ in readings),
+            'values': ','.join(value for _, _, value in readings),
+            'timestamp': start + 60 * idx,
+        }
+
+        request_started = perf_counter()
+        with CaptureQueriesContext(connection) as captured:
+            client.get(reverse('pulogger:submitdata'), query)
+        latencies.append(perf_counter() - request_started)
+        queries.append(len(captured))
+
+    elapsed = perf_counter() - started
+    return {
+        'requests': requests,
+        'readings_per_request': len(sensors) * len(BENCHMARK_DATUM_TYPES),
+        'requests_per_second': requests / elapsed,
+        'queries_per_request': sum(queries) / requests,
+        'max_queries_per_request': max(queries),
+        **get_latency_summary(latencies),
+    }
+
+
+def run_history_benchmark(client, device_name, window, requested_format, repeats):
+    # getHistory for the window ending at the latest reading, with the history cache cleared before each cold run
+    history_end = SensorDatum.objects.filter(datalogger__device_name=device_name) \
+        .aggregate(latest=Max('timestamp'))['latest'].replace(second=0, microsecond=0)
+    query = get_history_query(device_name, history_end - window, history_end, requested_format)
+    history_cache = caches[HISTORY_CACHE_ALIAS]
+
+    def get_history():
+        with CaptureQueriesContext(connection) as captured:
+            request_started = perf_counter()
+            response = client.get(reverse('pulogger:gethistory'), query)
+            content = b''.join(response.streaming_content) if response.streaming else response.content
+            return perf_counter() - request_started, len(captured), len(content)
+
+    cold = []
+    for _ in range(repeats):
+        history_cache.clear()
+        cold.append(get_history())
+    warm = [get_history() for _ in range(repeats)]
+
+    # Allocation tracing slows everything down, so memory is measured on a separate, untimed request
+    history_cache.clear()
+    tracemalloc.start()
+    get_history()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'cold': {'queries': cold[-1][1], **get_latency_summary([latency for latency, _, _ in cold])},
+        'warm': {'queries': warm[0][1], **get_latency_summary([latency for latency, _, _ in warm])},
+        'response_bytes': cold[0][2],
+        'peak_memory_bytes': peak_memory,
+    }
+
+
+def run_benchmarks(device_name, submit_requests, history_repeats, log=None):
+    # All scenarios against an existing benchmark dataset, as a JSON-serialisable dict
+    client = Client()
+    results = {
+        'environment': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'readings': SensorDatum.objects.count(),
+            'run_at': datetime.now(tz=timezone.utc).isoformat(),
+        },
+        'history': {},
+    }
+
+    with override_settings(ALLOWED_HOSTS=['testserver']):
+        for window_name, window in HISTORY_WINDOWS.items():
+            for requested_format in HISTORY_FORMATS:
+                results['history'][f'{window_name}_{requested_format}'] = run_history_benchmark(
+                    client, device_name, window, requested_format, history_repeats)
+                if log:
+                    log(f'getHistory {window_name} ({requested_format}): '
+                        f'{json_dumps(results["history"][f"{window_name}_{requested_format}"])}')
+
+        # Last, since it adds readings to the device
+        results['submit_data'] = run_submit_benchmark(client, device_name, submit_requests)
+        if log:
+            log(f'submitdata: {json_dumps(results["submit_data"])}')
+
+    return results
@@ -0,0 +1,194 @@
+import csv
+import gzip
+from collections import Counter, namedtuple
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .ingest import Reading, is_update_due, parse_batch_sample, similar_value_update_lockout
+from .metadata import get_metadata
+from .models import SensorDatum
+
+IMPORT_CHUNK_SIZE = 20000
+IMPORT_FORMATS = ('csv', 'ndjson')
+IMPORT_SUBMISSION_IP = '127.0.0.1'
+
+ImportResult = namedtuple('ImportResult', ['read', 'imported', 'duplicates', 'ignored', 'rejected'])
+
+
+class BulkImportError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+
+def get_import_format(path):
+    # From the file name, e.g. readings.csv or readings.ndjson.gz
+    name = path[:-len('.gz')] if path.endswith('.gz') else path
+    extension = name.rsplit('.', 1)[-1].lower()
+    return 'ndjson' if extension in ('ndjson', 'jsonl') else extension
+
+
+def open_import_file(path):
+    return gzip.open(path, 'rt', newline='') if path.endswith('.gz') else open(path, newline='')
+
+
+def parse_import_timestamp(value):
+    # Epoch seconds as sent by the loggers, or ISO 8601 as written by the CSV export; naive times are taken as UTC
+    try:
+        return datetime.fromtimestamp(int(value), tz=timezone.utc)
+    except ValueError:
+        timestamp = datetime.fromisoformat(value)
+        return timestamp if timestamp.tzinfo else timestamp.replace(tzinfo=timezone.utc)
+
+
+def iter_csv_readings(lines):
+    # Rows of timestamp, sensor_name, type, value, as written by the CSV export; a header row is skipped
+    for line_number, row in enumerate(csv.reader(lines), 1):
+        if not row or line_number == 1 and row[0] == 'timestamp':
+            continue
+
+        try:
+            timestamp, sensor_name, datum_type, value = row
+            yield Reading(sensor_name, datum_type, Decimal(value), parse_import_timestamp(timestamp))
+        except (ValueError, OverflowError, InvalidOperation):
+            yield line_number
+
+
+def iter_ndjson_readings(lines):
+    # Lines in the batch submission format
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+
+        try:
+            yield from parse_batch_sample(line)
+        except ValueError:
+            yield line_number
+
+
+def get_series_lookup(device_name):
+    # {(sensor_name, type description): (sensor, datum type, unique_sensor_name)} for every series the device's
+    # sensors are able to record
+    metadata = get_metadata()
+    return {(sensor.sensor_name, datum_type.description):
+            (sensor, datum_type, SensorDatum.build_unique_sensor_name(sensor.sensor_name, sensor.id, datum_type.id))
+            for sensor in metadata.get_device_sensors(device_name)
+            for (sensor_model_id, _), datum_type in metadata.model_datum_types.items()
+            if sensor_model_id == sensor.type_id}
+
+
+def get_stored_readings(datalogger, chunk_start, chunk_end):
+    # The device's readings the chunk's hysteresis checks and duplicate checks depend on: those within the lockout
+    # before the chunk, since any older reading can't hold back the next one, and those during it
+    return SensorDatum.objects.filter(datalogger=datalogger,
+                                      timestamp__gte=chunk_start - similar_value_update_lockout,
+                                      timestamp__lte=chunk_end) \
+        .order_by('timestamp') \
+        .values_list('unique_sensor_name', 'timestamp', 'value')
+
+
+def is_valid_value(value):
+    if not value.is_finite():
+        return False
+
+    try:
+        SensorDatum._meta.get_field('value').clean(value, None)
+    except ValidationError:
+        return False
+    return True
+
+
+def import_chunk(datalogger, chunk, most_recent_readings, submission_ip, outcomes, log=None):
+    # Applies submitdata's hysteresis rules and validation to a time-ordered chunk of resolved readings, interleaved
+    # with the readings already stored, and writes the accepted ones with their derived tables in one transaction.
+    # Counts each reading's outcome in outcomes.
+    stored = list(get_stored_readings(datalogger, chunk[0][0].timestamp, chunk[-1][0].timestamp))
+    stored_keys = {(unique_sensor_name, timestamp) for unique_sensor_name, timestamp, _ in stored}
+
+    def advance(unique_sensor_name, timestamp, value):
+        if unique_sensor_name not in most_recent_readings or timestamp > most_recent_readings[unique_sensor_name][0]:
+            most_recent_readings[unique_sensor_name] = (timestamp, value)
+
+    metadata = get_metadata()
+    new_data = []
+    stored_idx = 0
+    for reading, (sensor, datum_type, unique_sensor_name) in chunk:
+        while stored_idx < len(stored) and stored[stored_idx][1] <= reading.timestamp:
+            advance(*stored[stored_idx])
+            stored_idx += 1
+
+        if (unique_sensor_name, reading.timestamp) in stored_keys:
+            outcomes['duplicates'] += 1
+            continue
+
+        most_recent_timestamp, most_recent_value = most_recent_readings.get(unique_sensor_name, (None, None))
+        if not is_update_due(reading.value, reading.timestamp, metadata.get_update_hysteresis(datum_type.id),
+                             most_recent_value, most_recent_timestamp):
+            outcomes['ignored'] += 1
+            continue
+
+        # As in submitdata, only readings that would be written are validated
+        if not is_valid_value(reading.value):
+            outcomes['rejected'] += 1
+            if log:
+                log(f'Rejected {reading.sensor_name} {reading.type} at {reading.timestamp}: invalid value '
+                    f'{reading.value}')
+            continue
+
+        new_data.append(SensorDatum(submission_ip=submission_ip, timestamp=reading.timestamp, value=reading.value,
+                                    sensor=sensor, datalogger_id=datalogger.id, type=datum_type,
+                                    unique_sensor_name=unique_sensor_name))
+        advance(unique_sensor_name, reading.timestamp, reading.value)
+
+    if new_data:
+        with transaction.atomic():
+            SensorDatum.objects.bulk_create(new_data)
+            SensorDatum.record_derived(new_data)
+    outcomes['imported'] += len(new_data)
+
+
+def import_readings(device_name, readings, submission_ip=IMPORT_SUBMISSION_IP, chunk_size=IMPORT_CHUNK_SIZE,
+                    log=None):
+    # Writes a dump of a device's readings as if each had been sent to submitdata in time order, skipping those
+    # already stored, so an interrupted import can simply be run again. readings yields Reading tuples, or the line
+    # number of a line that couldn't be parsed. Each chunk is committed separately.
+    datalogger = get_metadata().get_datalogger(device_name)
+    if datalogger is None:
+        raise BulkImportError(f'No such device {device_name}.')
+    series_lookup = get_series_lookup(device_name)
+
+    most_recent_readings = {}
+    outcomes = Counter()
+    readings = iter(readings)
+    while True:
+        batch = list(islice(readings, chunk_size))
+        if not batch:
+            break
+        outcomes['read'] += len(batch)
+
+        chunk = []
+        for reading in batch:
+            if isinstance(reading, int):
+                outcomes['rejected'] += 1
+                if log:
+                    log(f'Rejected line {reading}: malformed')
+            elif (reading.sensor_name, reading.type) not in series_lookup:
+                outcomes['rejected'] += 1
+                if log:
+                    log(f'Rejected {reading.sensor_name} {reading.type} at {reading.timestamp}: no such sensor and '
+                        f'type on {device_name}')
+            else:
+                chunk.append((reading, series_lookup[reading.sensor_name, reading.type]))
+
+        # SD card dumps are in time order, but a chunk mustn't depend on it
+        chunk.sort(key=lambda item: item[0].timestamp)
+        if chunk:
+            import_chunk(datalogger, chunk, most_recent_readings, submission_ip, outcomes, log)
+
+        if log:
+            log(f'{outcomes["read"]} read, {outcomes["imported"]} imported')
+
+    return ImportResult(*(outcomes[outcome] for outcome in ImportResult._fields))
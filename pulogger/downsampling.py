@@ -0,0 +1,137 @@
+from math import ceil
+
+from django.db.models import Func, IntegerField, FloatField, Min, Avg, Sum, F, ExpressionWrapper
+
+from .metadata import get_metadata
+from .models import SensorDatum, SensorDatumRollup
+
+DEFAULT_POINTS_PER_TRACE = 1000
+MAX_POINTS_PER_TRACE = 10000
+LTTB_OVERSAMPLING = 4
+
+
+class EpochBucket(Func):
+    # Index of the fixed-width time bucket a datetime column falls into, i.e. floor(epoch seconds / bucket_seconds)
+    output_field = IntegerField()
+
+    def __init__(self, expression, bucket_seconds, **extra):
+        self.bucket_seconds = int(bucket_seconds)
+        super().__init__(expression, **extra)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection,
+                              template=f'FLOOR(EXTRACT(EPOCH FROM %(expressions)s) / {self.bucket_seconds})',
+                              **extra_context)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        # DATETIME columns hold UTC; UNIX_TIMESTAMP() would read them in the session time zone instead
+        return super().as_sql(compiler, connection,
+                              template="FLOOR(TIMESTAMPDIFF(SECOND, '1970-01-01 00:00:00', %(expressions)s) / "
+                                       f'{self.bucket_seconds})',
+                              **extra_context)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection,
+                              template=f"(CAST(STRFTIME('%%%%s', %(expressions)s) AS INTEGER) / {self.bucket_seconds})",
+                              **extra_context)
+
+
+def get_points_per_trace(request):
+    try:
+        points = int(request.GET.get('points', DEFAULT_POINTS_PER_TRACE))
+    except ValueError:
+        points = DEFAULT_POINTS_PER_TRACE
+
+    return max(2, min(points, MAX_POINTS_PER_TRACE))
+
+
+def get_bucket_seconds(duration, points):
+    return max(1, ceil(duration.total_seconds() / points))
+
+
+def get_history_resolution(duration, points):
+    # Rollup resolution to read (None for raw data) and bucket width giving up to `points` points per trace
+    return SensorDatumRollup.get_coarsest_resolution(duration, points), get_bucket_seconds(duration, points)
+
+
+def get_history_values(device_name, history_start, history_end, points):
+    # Up to `points` time-bucketed averages per trace, read from the coarsest rollup that can still provide them
+    rollup_resolution, bucket_seconds = get_history_resolution(history_end - history_start, points)
+    return get_history_bucket_values(device_name, history_start, history_end, rollup_resolution, bucket_seconds)
+
+
+def get_history_bucket_values(device_name, history_start, history_end, rollup_resolution, bucket_seconds):
+    return get_devices_history_bucket_values([device_name], history_start, history_end, rollup_resolution,
+                                             bucket_seconds)
+
+
+def get_devices_history_bucket_values(device_names, history_start, history_end, rollup_resolution, bucket_seconds):
+    # Bucketed rows for every trace of all the given devices, in one query
+    metadata = get_metadata()
+
+    if rollup_resolution:
+        queryset = SensorDatumRollup.objects.filter(sensor__in=[sensor for device_name in device_names
+                                                                for sensor in metadata.get_device_sensors(device_name)],
+                                                    resolution=rollup_resolution,
+                                                    bucket_start__gte=history_start,
+                                                    bucket_start__lte=history_end)
+        timestamp_field = 'bucket_start'
+        value_expression = ExpressionWrapper(
+            Sum(ExpressionWrapper(F('mean') * F('count'), output_field=FloatField())) / Sum('count'),
+            output_field=FloatField())
+    else:
+        dataloggers = [metadata.get_datalogger(device_name) for device_name in device_names]
+        queryset = SensorDatum.objects.filter(datalogger__in=[datalogger for datalogger in dataloggers if datalogger],
+                                              timestamp__gte=history_start,
+                                              timestamp__lte=history_end)
+        timestamp_field = 'timestamp'
+        value_expression = Avg('value')
+
+    return bucket_downsample(queryset, timestamp_field, value_expression, bucket_seconds)
+
+
+def bucket_downsample(queryset, timestamp_field, value_expression, bucket_seconds):
+    # Groups rows per trace into fixed-width time buckets in the database, returning one averaged row per bucket
+    # with the keys 'unique_sensor_name', 'type_id', 'timestamp' and 'value'
+    return queryset \
+        .values('unique_sensor_name', 'type_id', bucket=EpochBucket(timestamp_field, bucket_seconds)) \
+        .annotate(timestamp=Min(timestamp_field), value=value_expression) \
+        .values('unique_sensor_name', 'type_id', 'timestamp', 'value') \
+        .order_by('timestamp', 'unique_sensor_name')
+
+
+def largest_triangle_three_buckets(data, threshold):
+    # Shape-preserving downsampling of a trace's [{'x': ..., 'y': ...}] points to threshold points (Steinarsson, 2013)
+    if threshold >= len(data) or threshold < 3:
+        return data
+
+    sampled = [data[0]]
+    bucket_size = (len(data) - 2) / (threshold - 2)
+    selected = 0
+
+    for bucket_idx in range(threshold - 2):
+        bucket_start = int(bucket_idx * bucket_size) + 1
+        bucket_end = int((bucket_idx + 1) * bucket_size) + 1
+
+        # Average of the next bucket is the third vertex of each candidate triangle
+        next_bucket = data[bucket_end:min(int((bucket_idx + 2) * bucket_size) + 1, len(data))] or [data[-1]]
+        next_x = sum(point['x'] for point in next_bucket) / len(next_bucket)
+        next_y = sum(point['y'] for point in next_bucket) / len(next_bucket)
+
+        selected_x = data[selected]['x']
+        selected_y = data[selected]['y']
+
+        largest_area = -1
+        for idx in range(bucket_start, bucket_end):
+            area = abs((selected_x - next_x) * (data[idx]['y'] - selected_y)
+                       - (selected_x - data[idx]['x']) * (next_y - selected_y))
+            if area > largest_area:
+                largest_area = area
+                candidate = idx
+
+        sampled.append(data[candidate])
+        selected = candidate
+
+    sampled.append(data[-1])
+
+    return sampled
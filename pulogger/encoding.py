@@ -0,0 +1,111 @@
+import struct
+from itertools import groupby
+from json import dumps as json_dumps
+from operator import itemgetter
+
+import numpy as np
+
+from .smoothing import get_smoothing_mask
+
+COMPACT_VALUE_SCALE = 100  # values are stored to 2 decimal places, so this fixed-point scale is lossless
+COMPACT_BINARY_MAGIC = b'DLC1'
+
+
+class TraceColumns:
+    # One trace's readings as parallel arrays of epoch seconds and values, rather than a dict per point
+    def __init__(self, unique_sensor_name, type_id, timestamps, values):
+        self.unique_sensor_name = unique_sensor_name
+        self.sensor_name = unique_sensor_name.split(';')[0]
+        self.type_id = type_id
+        self.timestamps = timestamps
+        self.values = values
+        self.gap_indexes = ()  # points the line isn't drawn to from the point before, across an outage
+        self.last_timestamp = None  # epoch seconds of the trace's latest raw reading, which its last bucket may average
+
+
+def get_trace_columns(history_values):
+    rows = history_values.order_by('unique_sensor_name', 'timestamp') \
+        .values_list('unique_sensor_name', 'type_id', 'timestamp', 'value') \
+        .iterator()
+
+    traces = []
+    for unique_sensor_name, trace_rows in groupby(rows, key=itemgetter(0)):
+        _, type_ids, timestamps, values = zip(*trace_rows)
+        traces.append(TraceColumns(
+            unique_sensor_name,
+            type_ids[0],
+            np.fromiter((timestamp.timestamp() for timestamp in timestamps), dtype=np.float64,
+                        count=len(timestamps)).astype(np.int64),
+            np.array(values, dtype=np.float64),
+        ))
+
+    return traces
+
+
+def bucket_trace_columns(unique_sensor_name, type_id, timestamps, values, bucket_seconds):
+    # Time-ordered raw readings bucketed the same way as bucket_downsample(): mean value and earliest timestamp per
+    # bucket
+    _, first_idx, bucket_idx = np.unique(timestamps // bucket_seconds, return_index=True, return_inverse=True)
+    return TraceColumns(unique_sensor_name, type_id, timestamps[first_idx],
+                        np.bincount(bucket_idx, weights=values) / np.bincount(bucket_idx))
+
+
+def smooth_trace_columns(trace, threshold):
+    keep = get_smoothing_mask(trace.timestamps, trace.values, threshold)
+    trace.timestamps = trace.timestamps[keep]
+    trace.values = trace.values[keep]
+
+
+def set_gap_indexes(trace, gap_timestamps):
+    # Binary searches for the points just after each gap, rather than looking for gaps point by point
+    indexes = np.unique(np.searchsorted(trace.timestamps, gap_timestamps))
+    trace.gap_indexes = indexes[(indexes > 0) & (indexes < len(trace.timestamps))]
+
+
+def get_delta_encoded_timestamps(timestamps):
+    return np.diff(timestamps, prepend=timestamps[:1]).astype(np.int32)
+
+
+def get_fixed_point_values(values):
+    return np.rint(values * COMPACT_VALUE_SCALE).astype(np.int32)
+
+
+def encode_compact_json(traces, type_mappings, get_trace_definition):
+    return json_dumps(get_compact_traces(traces, type_mappings, get_trace_definition))
+
+
+def get_compact_traces(traces, type_mappings, get_trace_definition):
+    # Per trace: base epoch seconds 't0', per-point second deltas 'dt' (first is 0), values scaled by 'scale', the
+    # indexes of points not to be joined to the point before 'gaps', and 'last_timestamp', the epoch seconds live
+    # updates carry on from (null if unknown)
+    return [{
+        'definition': get_trace_definition(trace.sensor_name, type_mappings[trace.type_id]),
+        'unique_sensor_name': trace.unique_sensor_name,
+        'sensor_name': trace.sensor_name,
+        'type': type_mappings[trace.type_id],
+        't0': int(trace.timestamps[0]),
+        'scale': COMPACT_VALUE_SCALE,
+        'dt': get_delta_encoded_timestamps(trace.timestamps).tolist(),
+        'v': get_fixed_point_values(trace.values).tolist(),
+        'gaps': [int(idx) for idx in trace.gap_indexes],
+        'last_timestamp': trace.last_timestamp,
+    } for trace in traces]
+
+
+def encode_compact_binary(traces, type_mappings):
+    # Little-endian layout:
+    #   magic 'DLC1', uint16 trace count, uint16 value scale, then per trace:
+    #   uint16 sensor name length, sensor name (utf-8), uint16 type length, type (utf-8),
+    #   int64 base epoch seconds, uint32 point count, int32[count] second deltas, int32[count] fixed-point values
+    parts = [COMPACT_BINARY_MAGIC, struct.pack('<HH', len(traces), COMPACT_VALUE_SCALE)]
+
+    for trace in traces:
+        sensor_name = trace.sensor_name.encode()
+        datum_type = type_mappings[trace.type_id].encode()
+        parts.append(struct.pack('<H', len(sensor_name)) + sensor_name)
+        parts.append(struct.pack('<H', len(datum_type)) + datum_type)
+        parts.append(struct.pack('<qI', int(trace.timestamps[0]), len(trace.timestamps)))
+        parts.append(get_delta_encoded_timestamps(trace.timestamps).astype('<i4').tobytes())
+        parts.append(get_fixed_point_values(trace.values).astype('<i4').tobytes())
+
+    return b''.join(parts)
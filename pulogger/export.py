@@ -0,0 +1,72 @@
+import csv
+import zlib
+from itertools import islice
+
+from django.db.models import Q
+
+from .metadata import get_metadata
+from .metrics import record_rows
+from .models import SensorDatum
+from .retention import iter_archived_rows
+
+CSV_EXPORT_CHUNK_SIZE = 5000
+CSV_COLUMN_HEADINGS = ('timestamp', 'sensor_name', 'type', 'value')
+
+
+class Echo:
+    # File-like object for csv.writer that hands each written row straight back instead of buffering it
+    def write(self, value):
+        return value
+
+
+def iter_sensor_data_chunks(datalogger, history_start, history_end, chunk_size=CSV_EXPORT_CHUNK_SIZE):
+    # Keyset pagination on (timestamp, id), so every chunk is an index range scan no matter how deep into the export
+    queryset = SensorDatum.objects.filter(datalogger=datalogger,
+                                          timestamp__gte=history_start,
+                                          timestamp__lte=history_end) \
+        .order_by('timestamp', 'id') \
+        .values_list('id', 'timestamp', 'unique_sensor_name', 'type_id', 'value')
+
+    chunk = list(queryset[:chunk_size])
+    while chunk:
+        record_rows(len(chunk))
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+
+        last_id, last_timestamp = chunk[-1][0], chunk[-1][1]
+        chunk = list(queryset.filter(Q(timestamp__gt=last_timestamp) | Q(timestamp=last_timestamp, id__gt=last_id))
+                     [:chunk_size])
+
+
+def iter_csv_chunks(device_name, history_start, history_end):
+    # One CSV-encoded string per chunk of rows
+    type_mappings = get_metadata().get_type_mappings()
+    writer = csv.writer(Echo())
+
+    yield writer.writerow(CSV_COLUMN_HEADINGS)
+
+    # Archived months always precede the readings still in SensorDatum
+    datalogger = get_metadata().get_datalogger(device_name)
+    archived_rows = iter_archived_rows(datalogger, history_start, history_end)
+    while True:
+        chunk = list(islice(archived_rows, CSV_EXPORT_CHUNK_SIZE))
+        if not chunk:
+            break
+        yield ''.join(writer.writerow((timestamp.isoformat(), unique_sensor_name.split(';')[0],
+                                       type_mappings[type_id], value))
+                      for timestamp, unique_sensor_name, type_id, value in chunk)
+
+    for chunk in iter_sensor_data_chunks(datalogger, history_start, history_end):
+        yield ''.join(writer.writerow((timestamp.isoformat(), unique_sensor_name.split(';')[0],
+                                       type_mappings[type_id], value))
+                      for _, timestamp, unique_sensor_name, type_id, value in chunk)
+
+
+def iter_gzipped(chunks):
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)  # gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk.encode())
+        if compressed:
+            yield compressed
+    yield compressor.flush()
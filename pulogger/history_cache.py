@@ -0,0 +1,137 @@
+from datetime import datetime, timezone
+from time import time
+
+import numpy as np
+from django.core.cache import caches
+
+from .downsampling import get_history_resolution, get_devices_history_bucket_values
+from .encoding import TraceColumns, get_trace_columns
+from .metadata import get_metadata
+from .metrics import record_rows
+from .models import Datalogger, SETTLED_DATA_AGE
+from .retention import get_archived_trace_columns, merge_trace_columns
+from .ring_buffer import get_ring_buffer_trace_columns
+
+HISTORY_CACHE_ALIAS = 'history'
+
+
+def get_history_cache_key(device_name, history_version, rollup_resolution, bucket_seconds):
+    # Buckets are aligned to the epoch, so any two ranges with the same bucket width share their buckets. Backfilled
+    # readings bump the device's history version, leaving the entries holding the buckets they changed behind.
+    return f'pulogger:history:{device_name}:{history_version}:{rollup_resolution}:{bucket_seconds}'
+
+
+def get_cached_trace_columns(device_name, history_start, history_end, points):
+    # Bucketed trace columns for the range, with its start snapped down to a bucket boundary. Buckets that have
+    # settled are cached, so a rolling window only queries the buckets after the last cached one. A bucket has
+    # settled once the requested end and SETTLED_DATA_AGE ago are both past it and the last rollup bucket starting
+    # within it, which may still be filling until then; any reading written into it later is a backfill.
+    return get_devices_cached_trace_columns([device_name], history_start, history_end, points)[device_name]
+
+
+def get_devices_cached_trace_columns(device_names, history_start, history_end, points):
+    # {device name: trace columns} as get_cached_trace_columns() gives them, with the versions, cache entries and
+    # uncached buckets of all the devices each read at once, so the queries don't grow with the number of devices
+    rollup_resolution, bucket_seconds = get_history_resolution(history_end - history_start, points)
+    start = int(history_start.timestamp()) // bucket_seconds * bucket_seconds
+    end = history_end.timestamp()
+    settled_until = time() - SETTLED_DATA_AGE.total_seconds() - (rollup_resolution or 0)
+    complete_until = int(min(end, settled_until)) // bucket_seconds * bucket_seconds
+
+    metadata = get_metadata()
+    cache = caches[HISTORY_CACHE_ALIAS]
+    history_versions = dict(Datalogger.objects.filter(device_name__in=device_names)
+                            .values_list('device_name', 'history_version'))
+    cache_keys = {device_name: get_history_cache_key(device_name, history_versions.get(device_name),
+                                                     rollup_resolution, bucket_seconds)
+                  for device_name in device_names}
+    cached_entries = cache.get_many(list(cache_keys.values()))
+
+    cached_by_device = {}
+    fresh_by_device = {}
+    queried_device_names = []
+    for device_name in device_names:
+        cached = cached_entries.get(cache_keys[device_name])
+        if not cached or not cached['start'] <= start < cached['complete_until']:
+            cached = {'start': start, 'complete_until': start, 'traces': {}}
+        cached_by_device[device_name] = cached
+        fetch_from = cached['complete_until']
+
+        fresh_by_device[device_name] = {}
+        if fetch_from > end:
+            continue
+
+        if rollup_resolution is None:
+            # Recent raw readings are kept in memory by every worker, so a window inside it needs no query at all
+            ring_buffer_traces = get_ring_buffer_trace_columns(metadata.get_datalogger(device_name),
+                                                               datetime.fromtimestamp(fetch_from, tz=timezone.utc),
+                                                               history_end, bucket_seconds)
+            if ring_buffer_traces is not None:
+                fresh_by_device[device_name] = {trace.unique_sensor_name: trace for trace in ring_buffer_traces}
+                continue
+        queried_device_names.append(device_name)
+
+    if queried_device_names:
+        # One query from the earliest uncached bucket; buckets are aligned, so each device's are then cut at its own
+        query_from = min(cached_by_device[device_name]['complete_until'] for device_name in queried_device_names)
+        history_values = get_devices_history_bucket_values(
+            queried_device_names, datetime.fromtimestamp(query_from, tz=timezone.utc), history_end,
+            rollup_resolution, bucket_seconds)
+        fresh_traces = get_trace_columns(history_values)
+        record_rows(sum(len(trace.timestamps) for trace in fresh_traces))
+
+        device_by_sensor_id = {sensor.id: device_name for device_name in queried_device_names
+                               for sensor in metadata.get_device_sensors(device_name)}
+        traces_by_device = {device_name: [] for device_name in queried_device_names}
+        for trace in fresh_traces:
+            traces_by_device[device_by_sensor_id[int(trace.unique_sensor_name.split(';')[1])]].append(trace)
+
+        for device_name, device_traces in traces_by_device.items():
+            fetch_from = cached_by_device[device_name]['complete_until']
+            for trace in device_traces:
+                after_fetch_from = trace.timestamps >= fetch_from
+                trace.timestamps, trace.values = trace.timestamps[after_fetch_from], trace.values[after_fetch_from]
+            if rollup_resolution is None:
+                # Raw readings past the retention age live in the monthly archives rather than SensorDatum
+                device_traces = merge_trace_columns(
+                    get_archived_trace_columns(metadata.get_datalogger(device_name),
+                                               datetime.fromtimestamp(fetch_from, tz=timezone.utc), history_end,
+                                               bucket_seconds),
+                    device_traces)
+            fresh_by_device[device_name] = {trace.unique_sensor_name: trace for trace in device_traces
+                                            if len(trace.timestamps)}
+
+    traces_by_device = {}
+    updated_entries = {}
+    for device_name in device_names:
+        cached, fresh = cached_by_device[device_name], fresh_by_device[device_name]
+        traces = []
+        for unique_sensor_name in sorted(set(cached['traces']) | set(fresh)):
+            type_id, timestamps, values = cached['traces'].get(unique_sensor_name, (None, [], []))
+            in_range = (np.asarray(timestamps) >= start) & (np.asarray(timestamps) <= end)
+            timestamps, values = np.asarray(timestamps, dtype=np.int64)[in_range], np.asarray(values)[in_range]
+
+            if unique_sensor_name in fresh:
+                type_id = fresh[unique_sensor_name].type_id
+                timestamps = np.concatenate((timestamps, fresh[unique_sensor_name].timestamps))
+                values = np.concatenate((values, fresh[unique_sensor_name].values))
+
+            if len(timestamps):
+                traces.append(TraceColumns(unique_sensor_name, type_id, timestamps, values))
+        traces_by_device[device_name] = traces
+
+        if complete_until > cached['complete_until']:
+            # Keep only this range's finished buckets, so the entry follows a rolling window rather than growing
+            updated_entries[cache_keys[device_name]] = {
+                'start': start,
+                'complete_until': complete_until,
+                'traces': {trace.unique_sensor_name: (trace.type_id,
+                                                      trace.timestamps[trace.timestamps < complete_until],
+                                                      trace.values[trace.timestamps < complete_until])
+                           for trace in traces},
+            }
+
+    if updated_entries:
+        cache.set_many(updated_entries)
+
+    return traces_by_device
@@ -0,0 +1,181 @@
+import zlib
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal, InvalidOperation
+from json import loads as json_loads
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils.timezone import now
+
+from .alerts import check_alert_rules
+from .metadata import get_metadata
+from .metrics import record_rows
+from .models import Sensor, SensorDatum, LatestReading
+from .outages import record_transmission
+
+
+class DataTypeMismatchError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+
+class MalformedSubmissionError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+
+similar_value_update_lockout = timedelta(minutes=29, seconds=50)
+different_value_update_lockout = timedelta(seconds=50)
+
+# Decompressed size limit for batch submissions, so a small gzip body can't expand without bound
+MAX_BATCH_SUBMISSION_SIZE = 16 * 1024 * 1024
+
+Reading = namedtuple('Reading', ['sensor_name', 'type', 'value', 'timestamp'])
+IngestResult = namedtuple('IngestResult', ['success', 'message'])
+
+
+def is_update_due(value, timestamp, hysteresis, most_recent_value, most_recent_timestamp):
+    # if the difference from last logged value exceeds hysteresis (the type's, from the metadata), or last log
+    # happened sufficiently long ago
+    if most_recent_timestamp is None:
+        return True
+
+    return abs(value - most_recent_value) > hysteresis \
+        and timestamp > (most_recent_timestamp + different_value_update_lockout) \
+        or timestamp > (most_recent_timestamp + similar_value_update_lockout)
+
+
+def decompress_submission(body):
+    decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)  # gzip container
+    try:
+        decompressed = decompressor.decompress(body, MAX_BATCH_SUBMISSION_SIZE)
+    except zlib.error:
+        raise MalformedSubmissionError('invalid gzip body')
+    if decompressor.unconsumed_tail:
+        raise MalformedSubmissionError('body too large')
+
+    return decompressed
+
+
+def parse_batch_sample(line):
+    # One line of a batch submission, in the same shape as submitdata's query string:
+    #   {"timestamp": 1600000000, "sensors": ["s0", "s0"], "types": ["temperature", "humidity"], "values": [21.5, 40]}
+    # Raises ValueError if it's malformed.
+    try:
+        sample = json_loads(line)
+        timestamp = datetime.fromtimestamp(int(sample['timestamp']), tz=timezone.utc)
+        sensor_names, datum_types, datum_values = sample['sensors'], sample['types'], sample['values']
+        if not len(sensor_names) == len(datum_types) == len(datum_values):
+            raise ValueError
+        readings = [Reading(sensor_name, datum_type, Decimal(str(value)), timestamp)
+                    for sensor_name, datum_type, value in zip(sensor_names, datum_types, datum_values)]
+        if not all(reading.value.is_finite() for reading in readings):
+            raise ValueError  # JSON's NaN and Infinity, which no reading can be
+        return readings
+    except (ValueError, TypeError, KeyError, OverflowError, InvalidOperation):
+        raise ValueError('malformed sample')
+
+
+def parse_batch_submission(body):
+    # Newline-delimited JSON, one object per sample time (see parse_batch_sample()). Returns the readings in time
+    # order, so buffered samples pass through the hysteresis rules as if sent live.
+    readings = []
+    for line_number, line in enumerate(body.splitlines(), 1):
+        if not line.strip():
+            continue
+
+        try:
+            readings.extend(parse_batch_sample(line))
+        except ValueError:
+            raise MalformedSubmissionError(f'malformed line {line_number}')
+
+    return sorted(readings, key=lambda reading: reading.timestamp)
+
+
+def get_most_recent_readings(unique_sensor_names):
+    # Returns {unique_sensor_name: (timestamp, value)} from the latest-reading table in a single query
+    return {name: (timestamp, value) for name, timestamp, value in
+            LatestReading.objects.filter(unique_sensor_name__in=set(unique_sensor_names))
+                .values_list('unique_sensor_name', 'timestamp', 'value')}
+
+
+def ingest_readings(device_name, readings, submission_ip, received_at=None):
+    # Resolves every sensor, datum type and most recent reading for the whole submission up front, applies the
+    # hysteresis/lockout rules in memory and writes all accepted readings with a single bulk_create. received_at is
+    # when the logger transmitted them, if not now (e.g. readings drained from the ingest queue).
+    metadata = get_metadata()
+
+    resolved = []
+    for reading in readings:
+        sensor = metadata.get_sensor(device_name, reading.sensor_name)
+        datum_type = metadata.get_datum_type(sensor, reading.type) if sensor else None
+        unique_sensor_name = SensorDatum.build_unique_sensor_name(sensor.sensor_name, sensor.id, datum_type.id) \
+            if datum_type else None
+        resolved.append((reading, sensor, datum_type, unique_sensor_name))
+
+    most_recent_readings = get_most_recent_readings(name for _, _, _, name in resolved if name)
+
+    results = []
+    new_data = []
+    alert_checks = []
+    for reading, sensor, datum_type, unique_sensor_name in resolved:
+        try:
+            if not sensor:
+                raise Sensor.DoesNotExist
+
+            # Check that the sensor's model is able to measure the submitted type, else throw exception
+            if not datum_type:
+                raise DataTypeMismatchError('Sensor type {} cannot measure {}.'.format(sensor.type.type, reading.type))
+
+            most_recent_timestamp, most_recent_value = most_recent_readings.get(unique_sensor_name, (None, None))
+
+            if is_update_due(reading.value, reading.timestamp, metadata.get_update_hysteresis(datum_type.id),
+                             most_recent_value, most_recent_timestamp):
+                new_datum = SensorDatum(
+                    submission_ip=submission_ip,
+                    timestamp=reading.timestamp,
+                    value=reading.value,
+                    sensor=sensor,
+                    datalogger_id=sensor.datalogger_id,
+                    type=datum_type,
+                    unique_sensor_name=unique_sensor_name,
+                )
+
+                # FK validation would cost a query per field; all FKs were resolved above
+                new_datum.clean_fields(exclude=['sensor', 'datalogger', 'type'])
+                new_data.append(new_datum)
+                alert_checks.append((new_datum, most_recent_timestamp, most_recent_value))
+
+                # Later readings for the same sensor in this submission are compared against this one
+                most_recent_readings[unique_sensor_name] = (reading.timestamp, reading.value)
+
+                # Same text as str(new_datum), without the FK lookups it would make
+                results.append(IngestResult(True, f'Successfully logged {datum_type.description}: {reading.value} '
+                                                  f'({device_name}, {sensor.sensor_name}, submitted at '
+                                                  f'{reading.timestamp} from {submission_ip} )'))
+            else:
+                results.append(
+                    IngestResult(False, 'Datum ignored: Value similar to recently-logged previous datum.'))
+
+        except ValidationError:
+            results.append(IngestResult(False, 'Error: Submitted datum failed validation.'))
+
+        except Sensor.DoesNotExist:
+            results.append(IngestResult(
+                False,
+                'Error: No such device, or no such sensor named {} attached to device.'.format(reading.sensor_name)))
+
+        except DataTypeMismatchError as err:
+            results.append(IngestResult(False, err.message))
+
+    record_transmission(device_name, received_at or now())
+
+    if new_data:
+        with transaction.atomic():
+            SensorDatum.objects.bulk_create(new_data)
+            SensorDatum.record_derived(new_data)
+            check_alert_rules(alert_checks)
+    record_rows(len(new_data))
+
+    return results
@@ -0,0 +1,196 @@
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from decimal import Decimal
+from time import time
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import InterfaceError, OperationalError
+
+from .ingest import IngestResult, Reading, ingest_readings
+from .metadata import get_metadata
+from .models import SensorDatum
+from .outages import record_transmission
+
+# The spool is a standalone SQLite file (not the Django database), so enqueueing never waits on MySQL. WAL mode lets
+# any number of web workers append while the drainer reads.
+QUEUE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS queued_reading (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        device_name TEXT NOT NULL,
+        sensor_name TEXT NOT NULL,
+        type TEXT NOT NULL,
+        value TEXT NOT NULL,
+        timestamp INTEGER NOT NULL,
+        submission_ip TEXT NOT NULL,
+        enqueued_at REAL NOT NULL
+    )
+'''
+# Readings of a submission whose ingest failed for a reason replaying it won't fix, kept for inspection rather than
+# left at the head of the queue
+PARKED_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS parked_reading (
+        id INTEGER PRIMARY KEY,
+        device_name TEXT NOT NULL,
+        sensor_name TEXT NOT NULL,
+        type TEXT NOT NULL,
+        value TEXT NOT NULL,
+        timestamp INTEGER NOT NULL,
+        submission_ip TEXT NOT NULL,
+        enqueued_at REAL NOT NULL,
+        error TEXT NOT NULL,
+        parked_at REAL NOT NULL
+    )
+'''
+QUEUE_BUSY_TIMEOUT_MS = 5000
+DRAIN_BATCH_SIZE = 5000
+
+_local = threading.local()
+
+logger = logging.getLogger(__name__)
+
+
+class IngestQueueFullError(Exception):
+    pass
+
+
+def is_queued_ingest_enabled():
+    return settings.PULOGGER_INGEST_MODE == 'queued'
+
+
+def get_queue_connection():
+    # One connection per thread, opened lazily and kept for the life of the worker
+    connection = getattr(_local, 'connection', None)
+    if connection is None:
+        connection = sqlite3.connect(settings.PULOGGER_INGEST_QUEUE_PATH, isolation_level=None)
+        connection.execute(f'PRAGMA busy_timeout = {QUEUE_BUSY_TIMEOUT_MS}')
+        connection.execute('PRAGMA journal_mode = WAL')
+        connection.execute('PRAGMA synchronous = NORMAL')
+        connection.execute(QUEUE_SCHEMA)
+        connection.execute(PARKED_SCHEMA)
+        _local.connection = connection
+
+    return connection
+
+
+def get_queue_stats():
+    # Backpressure metrics: readings waiting, and how long the oldest of them has been waiting (seconds)
+    connection = get_queue_connection()
+    depth, oldest_enqueued_at = connection.execute('SELECT COUNT(*), MIN(enqueued_at) FROM queued_reading').fetchone()
+    parked, = connection.execute('SELECT COUNT(*) FROM parked_reading').fetchone()
+
+    return {
+        'depth': depth,
+        'drain_lag': time() - oldest_enqueued_at if oldest_enqueued_at is not None else 0.0,
+        'max_depth': settings.PULOGGER_INGEST_QUEUE_MAX_DEPTH,
+        'parked': parked,
+    }
+
+
+def validate_reading(device_name, reading, metadata=None):
+    # The checks ingest_readings() would fail a reading on that need no database access, returning the failure or
+    # None. Hysteresis is left to the drainer, the only place that knows the latest logged values.
+    metadata = metadata or get_metadata()
+    sensor = metadata.get_sensor(device_name, reading.sensor_name)
+    if not sensor:
+        return IngestResult(
+            False, 'Error: No such device, or no such sensor named {} attached to device.'.format(reading.sensor_name))
+
+    if not metadata.get_datum_type(sensor, reading.type):
+        return IngestResult(False, 'Sensor type {} cannot measure {}.'.format(sensor.type.type, reading.type))
+
+    try:
+        SensorDatum._meta.get_field('value').clean(reading.value, None)
+    except ValidationError:
+        return IngestResult(False, 'Error: Submitted datum failed validation.')
+
+    return None
+
+
+def enqueue_readings(device_name, readings, submission_ip):
+    results = []
+    queued = []
+    enqueued_at = time()
+    for reading in readings:
+        failure = validate_reading(device_name, reading)
+        if failure:
+            results.append(failure)
+            continue
+
+        queued.append((device_name, reading.sensor_name, reading.type, str(reading.value),
+                       int(reading.timestamp.timestamp()), submission_ip, enqueued_at))
+        results.append(IngestResult(True, f'Queued {reading.type}: {reading.value} ({device_name}, '
+                                          f'{reading.sensor_name}, submitted at {reading.timestamp} from '
+                                          f'{submission_ip} )'))
+
+    if queued:
+        connection = get_queue_connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            depth, = connection.execute('SELECT COUNT(*) FROM queued_reading').fetchone()
+            if depth + len(queued) > settings.PULOGGER_INGEST_QUEUE_MAX_DEPTH:
+                raise IngestQueueFullError
+            connection.executemany('INSERT INTO queued_reading (device_name, sensor_name, type, value, timestamp, '
+                                   'submission_ip, enqueued_at) VALUES (?, ?, ?, ?, ?, ?, ?)', queued)
+
+    return results
+
+
+def submit_readings(device_name, readings, submission_ip):
+    # Entry point for the submission views: writes through, or spools for drain_ingest_queue, per PULOGGER_INGEST_MODE
+    if is_queued_ingest_enabled():
+        return enqueue_readings(device_name, readings, submission_ip)
+    return ingest_readings(device_name, readings, submission_ip)
+
+
+def drain_queue(batch_size=DRAIN_BATCH_SIZE):
+    # Moves up to batch_size of the oldest queued readings into SensorDatum, returning how many were taken. Rows
+    # are only deleted once ingested, so a crash replays them; the hysteresis rules ignore the replayed duplicates.
+    # A submission that fails to ingest is logged and its rows parked, so it can't hold up every device's behind it;
+    # losing the database connection stops the drain instead, leaving the batch to be replayed.
+    connection = get_queue_connection()
+    rows = connection.execute('SELECT id, device_name, sensor_name, type, value, timestamp, submission_ip, enqueued_at '
+                              'FROM queued_reading ORDER BY id LIMIT ?', (batch_size,)).fetchall()
+    if not rows:
+        return 0
+
+    # One ingest per device and address, each keeping its readings in arrival order for the hysteresis rules
+    submissions = {}
+    transmissions = {}  # device name: the times its queued submissions were received, in order
+    for row in rows:
+        _, device_name, sensor_name, datum_type, value, timestamp, submission_ip, enqueued_at = row
+        readings, _, submission_rows = submissions.get((device_name, submission_ip), ([], None, []))
+        readings.append(Reading(sensor_name, datum_type, Decimal(value),
+                                datetime.fromtimestamp(timestamp, tz=timezone.utc)))
+        submission_rows.append(row)
+        submissions[device_name, submission_ip] = (readings, enqueued_at, submission_rows)
+        if transmissions.setdefault(device_name, [None])[-1] != enqueued_at:
+            transmissions[device_name].append(enqueued_at)
+
+    # Each queued submission was a transmission, for the outage records; ingest_readings() records the last
+    for device_name, received_ats in transmissions.items():
+        for enqueued_at in received_ats[1:-1]:
+            record_transmission(device_name, datetime.fromtimestamp(enqueued_at, tz=timezone.utc))
+
+    parked = []
+    for (device_name, submission_ip), (readings, enqueued_at, submission_rows) in submissions.items():
+        try:
+            ingest_readings(device_name, readings, submission_ip,
+                            received_at=datetime.fromtimestamp(enqueued_at, tz=timezone.utc))
+        except (OperationalError, InterfaceError):
+            raise
+        except Exception as err:
+            logger.exception('Parked %d queued readings from %s (%s) that failed to ingest', len(submission_rows),
+                             device_name, submission_ip)
+            parked.extend(submission_row + (repr(err), time()) for submission_row in submission_rows)
+
+    with connection:
+        connection.execute('BEGIN IMMEDIATE')
+        connection.executemany('INSERT OR REPLACE INTO parked_reading (id, device_name, sensor_name, type, value, '
+                               'timestamp, submission_ip, enqueued_at, error, parked_at) '
+                               'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', parked)
+        connection.execute('DELETE FROM queued_reading WHERE id <= ?', (rows[-1][0],))
+
+    return len(rows)
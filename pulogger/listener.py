@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation
+from hmac import compare_digest
+from time import perf_counter
+
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, close_old_connections
+from django.utils.timezone import now
+
+from .ingest import MalformedSubmissionError, Reading, ingest_readings
+from .ingest_queue import validate_reading
+from .metadata import get_metadata
+
+# A lightweight alternative to submitdata for loggers that can open a socket: one line per sample, over UDP (one or
+# more lines per datagram, unacknowledged) or TCP (each line answered), e.g.
+#   logger1 ABC123 1600000000 s0,temperature,21.50 s0,humidity,65.20
+# i.e. device name, passcode, epoch seconds, then a sensor,type,value triple per reading. Lines are checked against
+# the cached metadata as they arrive and their readings written by ingest_readings() in timed micro-batches, on a
+# single worker thread so the event loop never waits on the database.
+
+LISTENER_PORT = 8765
+LISTENER_FLUSH_INTERVAL = 1.0
+LISTENER_MAX_BATCH = 5000  # readings pending before a flush is started early
+LISTENER_MAX_PENDING = 100000  # readings pending before lines are refused
+MAX_LINE_LENGTH = 64 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+def parse_line(line):
+    # Returns (device name, passcode, readings)
+    fields = line.split()
+    if len(fields) < 4:
+        raise MalformedSubmissionError('expected device, passcode, timestamp and readings')
+
+    device_name, passcode, timestamp = fields[:3]
+    try:
+        timestamp = datetime.fromtimestamp(int(timestamp), tz=timezone.utc)
+        readings = []
+        for triple in fields[3:]:
+            sensor_name, datum_type, value = triple.split(',')
+            value = Decimal(value)
+            if not value.is_finite():
+                raise ValueError
+            readings.append(Reading(sensor_name, datum_type, value, timestamp))
+    except (ValueError, OverflowError, InvalidOperation):
+        raise MalformedSubmissionError('malformed timestamp or reading')
+
+    return device_name, passcode, readings
+
+
+class Listener:
+    def __init__(self, flush_interval=LISTENER_FLUSH_INTERVAL, max_batch=LISTENER_MAX_BATCH,
+                 max_pending=LISTENER_MAX_PENDING, log=None):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.log = log
+
+        # (device name, submission IP): (readings in arrival order, when the last of them was received)
+        self.pending = {}
+        self.pending_count = 0
+        self.flush_requested = None
+        self.executor = ThreadPoolExecutor(max_workers=1)  # one thread, so one database connection
+
+    def handle_line(self, line, submission_ip):
+        # Queues a line's valid readings for the next flush, returning the response for the sender
+        try:
+            device_name, passcode, readings = parse_line(line.decode())
+        except UnicodeDecodeError:
+            return 'error invalid encoding'
+        except MalformedSubmissionError as err:
+            return f'error {err.message}'
+
+        # The snapshot as last refreshed by run_metadata_refresher(), so the event loop never queries the database
+        metadata = get_metadata(check_version=False)
+        datalogger = metadata.get_datalogger(device_name)
+        if datalogger is None or not compare_digest(passcode, datalogger.passcode):
+            return 'error unknown device or wrong passcode'
+
+        accepted = [reading for reading in readings if validate_reading(device_name, reading, metadata) is None]
+        if self.pending_count + len(accepted) > self.max_pending:
+            return 'error busy'
+
+        pending_readings, _ = self.pending.get((device_name, submission_ip), ([], None))
+        pending_readings.extend(accepted)
+        self.pending[device_name, submission_ip] = (pending_readings, now())
+        self.pending_count += len(accepted)
+        if self.pending_count >= self.max_batch and self.flush_requested:
+            self.flush_requested.set()
+
+        return f'ok {len(accepted)} {len(readings) - len(accepted)}'
+
+    def take_pending(self):
+        pending, self.pending, self.pending_count = self.pending, {}, 0
+        return pending
+
+    def restore_pending(self, pending):
+        # Puts back readings a flush couldn't write for want of the database, ahead of any received since
+        for key, (readings, received_at) in self.pending.items():
+            previous_readings, _ = pending.get(key, ([], None))
+            pending[key] = (previous_readings + readings, received_at)
+        self.pending = pending
+        self.pending_count = sum(len(readings) for readings, _ in pending.values())
+
+    def write(self, pending):
+        # Runs on the worker thread; returns the number of readings logged and the submissions left to retry. Each
+        # submission is written on its own: one that fails to ingest is logged and dropped, so it can't be retried
+        # forever along with everything received after it, while those the database couldn't be reached for are
+        # returned to be retried (refusing new lines once LISTENER_MAX_PENDING is reached, until it's back)
+        close_old_connections()
+        logged = 0
+        unwritten = {}
+        for (device_name, submission_ip), (readings, received_at) in pending.items():
+            try:
+                results = ingest_readings(device_name, readings, submission_ip, received_at)
+            except (OperationalError, InterfaceError):
+                unwritten[device_name, submission_ip] = (readings, received_at)
+                continue
+            except Exception:
+                logger.exception('Listener dropped %d readings from %s (%s) that failed to ingest', len(readings),
+                                 device_name, submission_ip)
+                continue
+            logged += sum(result.success for result in results)
+        return logged, unwritten
+
+    async def flush(self):
+        pending = self.take_pending()
+        if not pending:
+            return
+
+        started = perf_counter()
+        try:
+            logged, unwritten = await asyncio.get_event_loop().run_in_executor(self.executor, self.write, pending)
+        except (OperationalError, InterfaceError):
+            logger.exception('Listener flush failed; retrying with the next one')
+            self.restore_pending(pending)
+            return
+
+        if unwritten:
+            logger.error('Database unavailable; retrying %d listener readings with the next flush',
+                         sum(len(readings) for readings, _ in unwritten.values()))
+            self.restore_pending(unwritten)
+
+        if self.log:
+            self.log(f'Flushed {sum(len(readings) for readings, _ in pending.values())} readings ({logged} logged) '
+                     f'in {perf_counter() - started:.3f}s')
+
+    async def run_flusher(self, stopping):
+        while not stopping.is_set():
+            try:
+                await asyncio.wait_for(self.flush_requested.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.flush_requested.clear()
+            await self.flush()
+
+    async def run_metadata_refresher(self, stopping):
+        # On the worker thread, get_metadata() checks for changes made by other processes and, if there are any,
+        # builds a new snapshot there and swaps it in; handle_line() keeps using the old one until then
+        while not stopping.is_set():
+            await asyncio.sleep(settings.PULOGGER_METADATA_CHECK_SECONDS)
+            await asyncio.get_event_loop().run_in_executor(self.executor, get_metadata)
+
+    async def handle_tcp_client(self, reader, writer):
+        submission_ip = writer.get_extra_info('peername')[0]
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    writer.write(f'{self.handle_line(line, submission_ip)}\n'.encode())
+                    await writer.drain()
+        except (ValueError, ConnectionError):
+            pass  # line over MAX_LINE_LENGTH, or the logger went away
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        # Until SIGINT or SIGTERM, after which pending readings are flushed
+        loop = asyncio.get_event_loop()
+        self.flush_requested = asyncio.Event()
+        stopping = asyncio.Event()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signal_number, stopping.set)
+
+        listener = self
+        await loop.run_in_executor(self.executor, get_metadata)
+
+        class DatagramProtocol(asyncio.DatagramProtocol):
+            def datagram_received(self, data, address):
+                for line in data.splitlines():
+                    if line.strip():
+                        listener.handle_line(line, address[0])
+
+        transport, _ = await loop.create_datagram_endpoint(DatagramProtocol, local_addr=(host, port))
+        server = await asyncio.start_server(self.handle_tcp_client, host, port, limit=MAX_LINE_LENGTH)
+        flusher = loop.create_task(self.run_flusher(stopping))
+        refresher = loop.create_task(self.run_metadata_refresher(stopping))
+        if self.log:
+            self.log(f'Listening on {host}:{port} (UDP and TCP)')
+
+        await stopping.wait()
+        transport.close()
+        server.close()
+        await server.wait_closed()
+        refresher.cancel()
+        self.flush_requested.set()
+        await flusher
+        await self.flush()  # anything received while the flusher was finishing
+        self.executor.shutdown()
@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from pulogger.models import SensorDatum, SensorDatumRollup
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the 5-minute, hourly and daily rollups from the SensorDatum history still in the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Number of rollup rows written per bulk insert')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        unique_sensor_names = SensorDatum.objects.values_list('unique_sensor_name', flat=True).distinct()
+
+        total = 0
+        for unique_sensor_name in unique_sensor_names:
+            # Rollups of days already moved to the archive by compact_sensor_data have no raw rows left to rebuild from
+            oldest = SensorDatum.objects.filter(unique_sensor_name=unique_sensor_name).order_by('timestamp') \
+                .values_list('timestamp', flat=True).first()
+            with transaction.atomic():
+                SensorDatumRollup.objects.filter(
+                    unique_sensor_name=unique_sensor_name,
+                    bucket_start__gte=SensorDatumRollup.get_bucket_start(oldest, SensorDatumRollup.DAILY)).delete()
+                total += self.backfill_series(unique_sensor_name, batch_size)
+
+        self.stdout.write(self.style.SUCCESS(f'Wrote {total} rollups for {len(unique_sensor_names)} series'))
+
+    def backfill_series(self, unique_sensor_name, batch_size):
+        # Rows arrive in time order, so each resolution only needs its current bucket held open
+        data = SensorDatum.objects.filter(unique_sensor_name=unique_sensor_name) \
+            .only('sensor_id', 'type_id', 'unique_sensor_name', 'timestamp', 'value') \
+            .order_by('timestamp') \
+            .iterator(chunk_size=batch_size)
+
+        open_rollups = {}
+        pending = []
+        written = 0
+        for datum in data:
+            for resolution, _ in SensorDatumRollup.RESOLUTION_CHOICES:
+                rollup = SensorDatumRollup.from_datum(datum, resolution)
+                current = open_rollups.get(resolution)
+                if current and current.bucket_start == rollup.bucket_start:
+                    current.merge(rollup)
+                else:
+                    if current:
+                        pending.append(current)
+                    open_rollups[resolution] = rollup
+
+            if len(pending) >= batch_size:
+                SensorDatumRollup.objects.bulk_create(pending)
+                written += len(pending)
+                pending = []
+
+        pending.extend(open_rollups.values())
+        SensorDatumRollup.objects.bulk_create(pending)
+
+        return written + len(pending)
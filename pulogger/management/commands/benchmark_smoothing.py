@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from time import perf_counter
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from pulogger.smoothing import get_smoothing_mask, SMOOTHING_STALE_TIME
+from pulogger.views import datetime_to_js_epoch, json_safe, parse_uri_datetime
+
+
+def legacy_smoothing(raw_data, threshold):
+    # The per-row outlier filter get_data_lists() used before it was vectorised, kept as the benchmark baseline
+    data = []
+    for datum in raw_data:
+        try:
+            previous_valid_timestamp = parse_uri_datetime(data[-1]['x'])
+            previous_valid_value = data[-1]['y']
+            is_outlier = abs(previous_valid_value - json_safe(datum['value'])) > threshold
+            previous_value_is_old = datum['timestamp'] - previous_valid_timestamp > SMOOTHING_STALE_TIME
+            is_not_outlier = (not is_outlier) or previous_value_is_old
+        except IndexError:
+            is_not_outlier = True
+
+        if is_not_outlier:
+            data.append({
+                'x': datetime_to_js_epoch(datum['timestamp']),
+                'y': json_safe(datum['value'])
+            })
+
+    return data
+
+
+class Command(BaseCommand):
+    help = 'Compares the vectorised chart smoothing filter against the original per-row loop'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000)
+        parser.add_argument('--threshold', type=float, default=1.0)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rows, threshold = options['rows'], options['threshold']
+
+        # A minute-resolution humidity-like random walk with occasional spikes and logging gaps
+        rng = np.random.RandomState(options['seed'])
+        timestamps = 1546300800 + np.cumsum(np.where(rng.rand(rows) < 0.001, 8 * 3600, 60))
+        values = np.round(np.clip(65 + np.cumsum(rng.normal(0, 0.1, rows)), 0, 99.99), 2)
+        spikes = rng.rand(rows) < 0.01
+        values[spikes] = np.round(np.clip(values[spikes] + rng.normal(0, 10, spikes.sum()), 0, 99.99), 2)
+
+        raw_data = [{'timestamp': datetime.fromtimestamp(timestamp, tz=timezone.utc), 'value': Decimal(str(value))}
+                    for timestamp, value in zip(timestamps.tolist(), values.tolist())]
+
+        start = perf_counter()
+        legacy = legacy_smoothing(raw_data, threshold)
+        legacy_seconds = perf_counter() - start
+
+        start = perf_counter()
+        keep = get_smoothing_mask(timestamps, values, threshold)
+        mask_seconds = perf_counter() - start
+        vectorised = [{'x': x, 'y': y} for x, y in zip((timestamps[keep] * 1000).tolist(), values[keep].tolist())]
+        vectorised_seconds = perf_counter() - start
+
+        if vectorised != legacy:
+            self.stderr.write(self.style.ERROR('Vectorised output differs from the legacy loop'))
+
+        self.stdout.write(f'{rows} rows, {len(legacy)} kept')
+        self.stdout.write(f'legacy loop:     {legacy_seconds:.3f}s')
+        self.stdout.write(f'vectorised mask: {mask_seconds:.3f}s ({legacy_seconds / mask_seconds:.1f}x)')
+        self.stdout.write(f'mask + points:   {vectorised_seconds:.3f}s ({legacy_seconds / vectorised_seconds:.1f}x)')
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from pulogger.alerts import sweep_no_data_alerts
+
+
+class Command(BaseCommand):
+    help = 'Fires or resolves no-data alert rules from each datalogger\'s last transmission. Intended to be run ' \
+           'every minute from cron; the other conditions are checked as readings are written.'
+
+    def handle(self, *args, **options):
+        notifications = sweep_no_data_alerts()
+        for notification in notifications:
+            self.stdout.write(f'{"Firing" if notification.is_firing else "Resolved"}: {notification.device_name} '
+                              f'{notification.sensor_name} {notification.rule}')
+        self.stdout.write(self.style.SUCCESS(f'{len(notifications)} no-data alerts changed state'))
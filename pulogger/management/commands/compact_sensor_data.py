@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from pulogger.retention import RETENTION_BATCH_SIZE, get_raw_data_max_age, run_retention
+
+
+class Command(BaseCommand):
+    help = 'Moves whole months of raw readings older than the retention age into gzip CSV archives, keeping their ' \
+           'rollups. Intended to be run periodically, e.g. nightly from cron.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age-days', type=int, default=get_raw_data_max_age().days,
+                            help='Age after which raw readings are archived (default PULOGGER_RAW_DATA_MAX_AGE_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=RETENTION_BATCH_SIZE,
+                            help='Number of rows read, rolled up and deleted per batch')
+
+    def handle(self, *args, **options):
+        total = run_retention(timedelta(days=options['max_age_days']), options['batch_size'], log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(f'Archived {total} readings'))
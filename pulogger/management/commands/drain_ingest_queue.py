@@ -0,0 +1,30 @@
+from time import sleep, time
+
+from django.core.management.base import BaseCommand
+
+from pulogger.ingest_queue import DRAIN_BATCH_SIZE, drain_queue, get_queue_stats
+
+
+class Command(BaseCommand):
+    help = 'Writes readings spooled by the submission views (PULOGGER_INGEST_MODE = \'queued\') into SensorDatum'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DRAIN_BATCH_SIZE,
+                            help='Maximum number of queued readings ingested per batch')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to wait before polling again once the queue is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Drain until the queue is empty, then exit')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time()
+            drained = drain_queue(options['batch_size'])
+            if drained:
+                stats = get_queue_stats()
+                self.stdout.write(f'Drained {drained} readings in {time() - started:.2f}s; queue depth '
+                                  f'{stats["depth"]}, drain lag {stats["drain_lag"]:.1f}s')
+            elif options['once']:
+                return
+            else:
+                sleep(options['interval'])
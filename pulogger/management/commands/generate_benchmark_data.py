@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from pulogger.benchmarks import generate_benchmark_data
+
+
+class Command(BaseCommand):
+    help = 'Fills the database with synthetic readings for run_benchmarks. Point DATABASES at a scratch SQLite ' \
+           'database first; the generated loggers are named bench-0, bench-1, ...'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loggers', type=int, default=2)
+        parser.add_argument('--sensors', type=int, default=2, help='Sensors per logger')
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--interval-minutes', type=int, default=5, help='Minutes between generated readings')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        total = generate_benchmark_data(options['loggers'], options['sensors'], options['days'],
+                                        options['interval_minutes'], options['seed'], log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(f'Generated {total} readings'))
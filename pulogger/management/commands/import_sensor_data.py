@@ -0,0 +1,44 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pulogger.bulk_import import IMPORT_CHUNK_SIZE, IMPORT_FORMATS, IMPORT_SUBMISSION_IP, BulkImportError, \
+    get_import_format, open_import_file, iter_csv_readings, iter_ndjson_readings, import_readings
+
+
+class Command(BaseCommand):
+    help = 'Imports a dump of readings a datalogger stored while offline, applying the same hysteresis rules as ' \
+           'submitdata and skipping readings already stored, so it can safely be run again if interrupted. Takes ' \
+           'CSV rows of timestamp,sensor_name,type,value (as exported) or lines in the submitBatch format, ' \
+           'optionally gzipped. Readings from before the device\'s latest one don\'t count towards time in range ' \
+           'until rebuild_daily_statistics is run.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('device_name')
+        parser.add_argument('path', help='File to import; .gz files are decompressed')
+        parser.add_argument('--format', choices=IMPORT_FORMATS,
+                            help='Format of the file (default from its extension)')
+        parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE,
+                            help='Number of readings checked and written per transaction')
+        parser.add_argument('--submission-ip', default=IMPORT_SUBMISSION_IP,
+                            help='Submission IP recorded for the imported readings')
+
+    def handle(self, *args, **options):
+        import_format = options['format'] or get_import_format(options['path'])
+        if import_format not in IMPORT_FORMATS:
+            raise CommandError(f'Unknown format {import_format}; pass --format')
+        iter_readings = iter_csv_readings if import_format == 'csv' else iter_ndjson_readings
+
+        started = perf_counter()
+        try:
+            with open_import_file(options['path']) as lines:
+                result = import_readings(options['device_name'], iter_readings(lines), options['submission_ip'],
+                                         options['chunk_size'], log=self.stdout.write)
+        except (OSError, BulkImportError) as err:
+            raise CommandError(getattr(err, 'message', err))
+        elapsed = perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Read {result.read} readings in {elapsed:.1f}s ({result.read / elapsed:.0f}/s): {result.imported} '
+            f'imported, {result.duplicates} already stored, {result.ignored} within the hysteresis band, '
+            f'{result.rejected} rejected'))
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from pulogger.models import SensorDatum, SensorDayStatistics
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the daily statistics from the SensorDatum history still in the database, e.g. after a ' \
+           'datum type\'s time-in-range band has changed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Number of readings read per batch')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        unique_sensor_names = SensorDatum.objects.values_list('unique_sensor_name', flat=True).distinct()
+
+        total = 0
+        for unique_sensor_name in unique_sensor_names:
+            data = SensorDatum.objects.filter(unique_sensor_name=unique_sensor_name) \
+                .select_related('type') \
+                .only('sensor_id', 'type', 'unique_sensor_name', 'timestamp', 'value') \
+                .order_by('timestamp')
+
+            previous_readings = {}
+            statistics = {}
+            batch = []
+            for datum in data.iterator(chunk_size=batch_size):
+                batch.append(datum)
+                if len(batch) >= batch_size:
+                    SensorDayStatistics.aggregate(batch, previous_readings, statistics)
+                    batch = []
+            SensorDayStatistics.aggregate(batch, previous_readings, statistics)
+
+            # Days already moved to the archive by compact_sensor_data have no raw rows left to rebuild from
+            first_day = min(day for _, day in statistics)
+            with transaction.atomic():
+                SensorDayStatistics.objects.filter(unique_sensor_name=unique_sensor_name, day__gte=first_day).delete()
+                SensorDayStatistics.objects.bulk_create(statistics.values())
+            total += len(statistics)
+
+        self.stdout.write(self.style.SUCCESS(f'Wrote {total} daily statistics for {len(unique_sensor_names)} series'))
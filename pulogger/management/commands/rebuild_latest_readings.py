@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+
+from pulogger.models import MAX_QUERY_PARAMETERS, SensorDatum, LatestReading
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the latest-reading table from the full SensorDatum history'
+
+    def handle(self, *args, **options):
+        latest_timestamps = dict(SensorDatum.objects.values_list('unique_sensor_name').annotate(latest=Max('timestamp'))
+                                 .order_by())
+
+        # Each group binds its series' names and latest timestamps, so rows at another series' latest timestamp can
+        # match too and are skipped
+        names = sorted(latest_timestamps)
+        group_size = MAX_QUERY_PARAMETERS // 2
+        latest_readings = {}
+        for idx in range(0, len(names), group_size):
+            group = names[idx:idx + group_size]
+            for datum in SensorDatum.objects.filter(unique_sensor_name__in=group,
+                                                    timestamp__in={latest_timestamps[name] for name in group}) \
+                    .order_by('id'):
+                if datum.timestamp == latest_timestamps[datum.unique_sensor_name]:
+                    latest_readings[datum.unique_sensor_name] = LatestReading(
+                        sensor_id=datum.sensor_id,
+                        type_id=datum.type_id,
+                        unique_sensor_name=datum.unique_sensor_name,
+                        timestamp=datum.timestamp,
+                        value=datum.value,
+                    )
+
+        with transaction.atomic():
+            LatestReading.objects.all().delete()
+            LatestReading.objects.bulk_create(latest_readings.values())
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {len(latest_readings)} latest readings'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from pulogger.ring_buffer import is_ring_buffer_enabled, map_ring_buffer, rebuild_ring_buffer
+
+
+class Command(BaseCommand):
+    help = 'Refills the recent readings ring buffer from SensorDatum, e.g. on deploy or after editing or deleting ' \
+           'recent data'
+
+    def handle(self, *args, **options):
+        if not is_ring_buffer_enabled():
+            raise CommandError('PULOGGER_RING_BUFFER_DIR is not set')
+
+        rebuild_ring_buffer()
+        series = sum(1 for slot in map_ring_buffer().slots if slot['unique_sensor_name'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt the ring buffer with {series} series'))
@@ -0,0 +1,27 @@
+from json import dumps as json_dumps
+
+from django.core.management.base import BaseCommand
+
+from pulogger.benchmarks import get_benchmark_device_name, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Times getHistory for day/week/month/year windows and submitdata throughput against the data from ' \
+           'generate_benchmark_data, writing the results as JSON so runs can be compared across changes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--device', default=get_benchmark_device_name(0))
+        parser.add_argument('--submit-requests', type=int, default=200)
+        parser.add_argument('--history-repeats', type=int, default=5)
+        parser.add_argument('--output', help='File to write the JSON results to (default stdout)')
+
+    def handle(self, *args, **options):
+        results = run_benchmarks(options['device'], options['submit_requests'], options['history_repeats'],
+                                 log=self.stderr.write)
+
+        output = json_dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as results_file:
+                results_file.write(output + '\n')
+        else:
+            self.stdout.write(output)
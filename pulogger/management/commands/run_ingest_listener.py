@@ -0,0 +1,28 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from pulogger.listener import LISTENER_PORT, LISTENER_FLUSH_INTERVAL, LISTENER_MAX_BATCH, LISTENER_MAX_PENDING, \
+    Listener
+
+
+class Command(BaseCommand):
+    help = 'Accepts readings in the line protocol described in pulogger/listener.py over UDP and TCP, writing them ' \
+           'in micro-batches. Runs until interrupted, then writes any readings still pending.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='0.0.0.0', help='Address to listen on')
+        parser.add_argument('--port', type=int, default=LISTENER_PORT, help='UDP and TCP port to listen on')
+        parser.add_argument('--flush-interval', type=float, default=LISTENER_FLUSH_INTERVAL,
+                            help='Seconds between writes of the readings received')
+        parser.add_argument('--max-batch', type=int, default=LISTENER_MAX_BATCH,
+                            help='Number of pending readings that starts a write before the interval is up')
+        parser.add_argument('--max-pending', type=int, default=LISTENER_MAX_PENDING,
+                            help='Number of pending readings beyond which lines are refused')
+        parser.add_argument('--quiet', action='store_true', help='Don\'t report each write')
+
+    def handle(self, *args, **options):
+        listener = Listener(options['flush_interval'], options['max_batch'], options['max_pending'],
+                            log=None if options['quiet'] else self.stdout.write)
+        asyncio.get_event_loop().run_until_complete(listener.serve(options['host'], options['port']))
+        self.stdout.write(self.style.SUCCESS('Stopped'))
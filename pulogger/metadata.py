@@ -0,0 +1,130 @@
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+
+from .smoothing import DEFAULT_SMOOTHING_THRESHOLDS
+
+DEFAULT_UPDATE_HYSTERESIS = {
+    'temperature': 0.2,
+    'humidity': 2.0,
+}
+from .models import Datalogger, Sensor, DatumType, SensorModelDatumType, AlertRule, MetadataVersion
+
+
+class SensorMetadata:
+    # Snapshot of the admin-managed tables, which change rarely compared to how often they're read by the views
+    def __init__(self):
+        # Read first, so a change made while the snapshot is built leaves it looking stale rather than current
+        self.version = MetadataVersion.get_version()
+        self.dataloggers = {datalogger.device_name: datalogger for datalogger in Datalogger.objects.all()}
+
+        self.sensors = {}
+        self.sensors_by_id = {}
+        self.sensors_by_device = {}
+        for sensor in Sensor.objects.select_related('datalogger', 'type'):
+            self.sensors[(sensor.datalogger.device_name, sensor.sensor_name)] = sensor
+            self.sensors_by_id[sensor.id] = sensor
+            self.sensors_by_device.setdefault(sensor.datalogger.device_name, []).append(sensor)
+
+        self.datum_types = {datum_type.id: datum_type for datum_type in DatumType.objects.all()}
+        self.datum_type_ids = {datum_type.description: datum_type.id for datum_type in self.datum_types.values()}
+        self.type_mappings = {type_id: datum_type.description for type_id, datum_type in self.datum_types.items()}
+
+        # (sensor model id, datum type description) -> DatumType the sensor model is able to record
+        self.model_datum_types = {(mdt.sensor_id, self.datum_types[mdt.datum_type_id].description):
+                                  self.datum_types[mdt.datum_type_id] for mdt in SensorModelDatumType.objects.all()}
+
+        # (sensor id, datum type id) -> enabled AlertRules applying to the series, so checking a reading costs only
+        # its own rules
+        self.alert_rules = {}
+        for rule in AlertRule.objects.filter(is_enabled=True).select_related('sensor', 'sensor_model', 'type'):
+            sensor_ids = [rule.sensor_id] if rule.sensor_id else \
+                [sensor.id for sensor in self.sensors_by_id.values() if sensor.type_id == rule.sensor_model_id]
+            for sensor_id in sensor_ids:
+                self.alert_rules.setdefault((sensor_id, rule.type_id), []).append(rule)
+
+    def get_sensor(self, device_name, sensor_name):
+        return self.sensors.get((device_name, sensor_name))
+
+    def get_sensor_by_id(self, sensor_id):
+        return self.sensors_by_id.get(sensor_id)
+
+    def get_alert_rules(self, sensor_id, type_id):
+        return self.alert_rules.get((sensor_id, type_id), [])
+
+    def get_no_data_alert_rules(self):
+        # [(rule, sensor)] for every enabled no-data rule and sensor it applies to
+        return [(rule, self.sensors_by_id[sensor_id]) for (sensor_id, _), rules in self.alert_rules.items()
+                for rule in rules if rule.condition == AlertRule.NO_DATA]
+
+    def get_datalogger(self, device_name):
+        return self.dataloggers.get(device_name)
+
+    def get_device_sensors(self, device_name):
+        return self.sensors_by_device.get(device_name, [])
+
+    def get_datum_type(self, sensor, description):
+        return self.model_datum_types.get((sensor.type_id, description))
+
+    def get_smoothing_threshold(self, type_id):
+        datum_type = self.datum_types[type_id]
+        if datum_type.smoothing_threshold is not None:
+            return datum_type.smoothing_threshold
+        return DEFAULT_SMOOTHING_THRESHOLDS.get(datum_type.description)
+
+    def get_update_hysteresis(self, type_id):
+        # Every type has one, so a newly added type can't fail ingest; 0 logs any change once the 50s lockout passes
+        datum_type = self.datum_types[type_id]
+        if datum_type.update_hysteresis is not None:
+            return datum_type.update_hysteresis
+        return DEFAULT_UPDATE_HYSTERESIS.get(datum_type.description, 0.0)
+
+    def get_type_mappings(self):
+        return self.type_mappings
+
+
+_metadata = None
+_metadata_checked_at = 0
+_metadata_lock = Lock()
+
+
+def get_metadata(check_version=True):
+    # The process's snapshot, rebuilt when the signal handlers in this process invalidate it, or when another
+    # process's change has bumped the MetadataVersion, which is checked at most every PULOGGER_METADATA_CHECK_SECONDS.
+    # check_version=False never queries the database once a snapshot exists.
+    global _metadata, _metadata_checked_at
+
+    metadata = _metadata
+    if metadata is not None and check_version \
+            and monotonic() - _metadata_checked_at >= settings.PULOGGER_METADATA_CHECK_SECONDS:
+        _metadata_checked_at = monotonic()
+        if MetadataVersion.get_version() != metadata.version:
+            metadata = refresh_metadata()
+
+    if metadata is None:
+        with _metadata_lock:
+            if _metadata is None:
+                _metadata = SensorMetadata()
+                _metadata_checked_at = monotonic()
+            metadata = _metadata
+
+    return metadata
+
+
+def refresh_metadata():
+    # Builds a new snapshot and swaps it in, so other threads keep using the old one meanwhile rather than waiting
+    global _metadata
+
+    metadata = SensorMetadata()
+    with _metadata_lock:
+        _metadata = metadata
+
+    return metadata
+
+
+def invalidate_metadata():
+    global _metadata
+
+    with _metadata_lock:
+        _metadata = None
@@ -0,0 +1,160 @@
+import threading
+from bisect import bisect_left
+from hmac import compare_digest
+from random import random
+from time import perf_counter
+
+from django.conf import settings
+
+# In-memory, per-process request metrics for RequestMetricsMiddleware, rendered in the Prometheus text format by
+# the metrics view. Each uWSGI worker keeps its own histograms, so a scrape reflects the worker that served it.
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+ROWS_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000)
+QUANTILES = (0.5, 0.95, 0.99)
+
+METRICS = {
+    # name: (help text, buckets)
+    'request_duration_seconds': ('Wall time spent handling the request', DURATION_BUCKETS),
+    'db_queries': ('Database queries made by the request', COUNT_BUCKETS),
+    'db_duration_seconds': ('Time spent in database queries by the request', DURATION_BUCKETS),
+    'response_bytes': ('Size of the response body', BYTES_BUCKETS),
+    'rows': ('Sensor data rows read (getHistory, exports) or written (submissions) by the request', ROWS_BUCKETS),
+}
+
+_histograms = {}
+_lock = threading.Lock()
+_local = threading.local()
+
+
+class Histogram:
+    # Fixed cumulative buckets as in a Prometheus histogram, so recording is O(log buckets) and memory is constant
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last slot is +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def get_quantile(self, quantile):
+        # Estimated by linear interpolation within the bucket holding the quantile, like histogram_quantile()
+        rank = quantile * self.count
+        cumulative = 0
+        for idx, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                if idx == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[idx - 1] if idx else 0
+                return lower + (self.buckets[idx] - lower) * (rank - cumulative) / count
+            cumulative += count
+
+        return 0
+
+
+class RequestSample:
+    # Per-request measurements; also installed as a database execute wrapper to count and time queries
+    def __init__(self):
+        self.started = perf_counter()
+        self.queries = 0
+        self.db_seconds = 0
+        self.rows = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_seconds += perf_counter() - started
+
+
+def is_sampled():
+    # PULOGGER_METRICS_SAMPLE_RATE of requests are measured; the rest pay only for this check
+    return random() < settings.PULOGGER_METRICS_SAMPLE_RATE
+
+
+def set_current_sample(sample):
+    _local.sample = sample
+
+
+def record_rows(count):
+    # Called by the data paths to attribute rows read or written to the request being measured, if any
+    sample = getattr(_local, 'sample', None)
+    if sample:
+        sample.rows = (sample.rows or 0) + count
+
+
+def observe(name, view, value):
+    with _lock:
+        histogram = _histograms.get((name, view))
+        if histogram is None:
+            histogram = _histograms[name, view] = Histogram(METRICS[name][1])
+        histogram.observe(value)
+
+
+def record_sample(sample, view, response_bytes):
+    observe('request_duration_seconds', view, perf_counter() - sample.started)
+    observe('db_queries', view, sample.queries)
+    observe('db_duration_seconds', view, sample.db_seconds)
+    observe('response_bytes', view, response_bytes)
+    if sample.rows is not None:
+        observe('rows', view, sample.rows)
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus(gauges=None):
+    # gauges: {name: (help text, value)} for point-in-time values reported alongside the histograms
+    with _lock:
+        histograms = {key: (list(histogram.counts), histogram.sum, histogram.count,
+                            [histogram.get_quantile(quantile) for quantile in QUANTILES])
+                      for key, histogram in _histograms.items()}
+
+    lines = []
+    for name, (help_text, buckets) in METRICS.items():
+        metric = f'pulogger_{name}'
+        lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} histogram']
+        for (histogram_name, view), (counts, total, count, _) in sorted(histograms.items()):
+            if histogram_name != name:
+                continue
+            cumulative = 0
+            for upper_bound, bucket_count in zip(buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append(f'{metric}_bucket{{view="{view}",le="{upper_bound}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{view="{view}"}} {format_value(total)}')
+            lines.append(f'{metric}_count{{view="{view}"}} {count}')
+
+        lines += [f'# HELP {metric}_quantile Estimated {help_text[0].lower()}{help_text[1:]}, by quantile',
+                  f'# TYPE {metric}_quantile gauge']
+        for (histogram_name, view), (_, _, _, quantiles) in sorted(histograms.items()):
+            if histogram_name == name:
+                lines += [f'{metric}_quantile{{view="{view}",quantile="{quantile}"}} {format_value(value)}'
+                          for quantile, value in zip(QUANTILES, quantiles)]
+
+    for name, (help_text, value) in (gauges or {}).items():
+        lines += [f'# HELP pulogger_{name} {help_text}', f'# TYPE pulogger_{name} gauge',
+                  f'pulogger_{name} {format_value(value)}']
+
+    return '\n'.join(lines) + '\n'
+
+
+def is_metrics_request_authorised(request):
+    # Staff sessions, or scrapers sending "Authorization: Bearer <PULOGGER_METRICS_TOKEN>"
+    token = settings.PULOGGER_METRICS_TOKEN
+    if token and compare_digest(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}'):
+        return True
+
+    return request.user.is_authenticated and request.user.is_staff
+
+
+def reset_metrics():
+    with _lock:
+        _histograms.clear()
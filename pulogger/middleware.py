@@ -0,0 +1,43 @@
+from django.db import connection
+
+from .metrics import RequestSample, is_sampled, record_sample, set_current_sample
+
+
+class RequestMetricsMiddleware:
+    # Records wall time, query count and time, response size and sensor data rows for a sample of requests,
+    # labelled by view name. Streamed responses are measured once their content has been sent.
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not is_sampled():
+            return self.get_response(request)
+
+        sample = RequestSample()
+        set_current_sample(sample)
+        try:
+            with connection.execute_wrapper(sample):
+                response = self.get_response(request)
+        finally:
+            set_current_sample(None)
+
+        view = request.resolver_match.view_name if request.resolver_match else 'unresolved'
+        if response.streaming:
+            response.streaming_content = self.iter_measured(response.streaming_content, sample, view)
+        else:
+            record_sample(sample, view, len(response.content))
+
+        return response
+
+    @staticmethod
+    def iter_measured(content, sample, view):
+        response_bytes = 0
+        set_current_sample(sample)
+        try:
+            with connection.execute_wrapper(sample):
+                for chunk in content:
+                    response_bytes += len(chunk)
+                    yield chunk
+        finally:
+            set_current_sample(None)
+            record_sample(sample, view, response_bytes)
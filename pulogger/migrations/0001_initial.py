@@ -0,0 +1,76 @@
+# Generated by Django 2.2.4 on 2026-10-18 00:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Datalogger',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_name', models.CharField(db_index=True, max_length=64)),
+                ('description', models.CharField(blank=True, db_index=True, max_length=64)),
+                ('passcode', models.CharField(max_length=6)),
+                ('sensor_count', models.SmallIntegerField(default=1)),
+                ('up_since', models.DateTimeField(blank=True, null=True, verbose_name='uninterrupted since')),
+                ('last_transmission', models.DateTimeField(blank=True, null=True, verbose_name='last transmission received')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DatumType',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('description', models.CharField(db_index=True, max_length=16)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Sensor',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sensor_name', models.CharField(db_index=True, max_length=16)),
+                ('description', models.CharField(blank=True, db_index=True, max_length=64)),
+                ('datalogger', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='pulogger.Datalogger')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SensorModel',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.CharField(db_index=True, max_length=16)),
+                ('description', models.CharField(blank=True, db_index=True, max_length=64)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SensorModelDatumType',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('datum_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='pulogger.DatumType')),
+                ('sensor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='pulogger.SensorModel')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SensorDatum',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unique_sensor_name', models.CharField(db_index=True, default='placeholder', max_length=32)),
+                ('submission_ip', models.GenericIPAddressField()),
+                ('timestamp', models.DateTimeField()),
+                ('value', models.DecimalField(decimal_places=2, max_digits=4)),
+                ('sensor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='pulogger.Sensor')),
+                ('type', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='pulogger.DatumType')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='sensor',
+            name='type',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='pulogger.SensorModel'),
+        ),
+    ]
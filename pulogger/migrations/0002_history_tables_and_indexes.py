@@ -0,0 +1,111 @@
+# Generated by Django 2.2.4 on 2026-10-18 00:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_sensordatum_datalogger(apps, schema_editor):
+    Sensor = apps.get_model('pulogger', 'Sensor')
+    SensorDatum = apps.get_model('pulogger', 'SensorDatum')
+
+    SensorDatum.objects.update(datalogger_id=models.Subquery(
+        Sensor.objects.filter(pk=models.OuterRef('sensor_id')).values('datalogger_id')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pulogger', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LatestReading',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unique_sensor_name', models.CharField(max_length=32, unique=True)),
+                ('timestamp', models.DateTimeField()),
+                ('value', models.DecimalField(decimal_places=2, max_digits=4)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SensorDatumRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unique_sensor_name', models.CharField(max_length=32)),
+                ('resolution', models.PositiveIntegerField(choices=[(300, '5 minutes'), (3600, 'hourly'), (86400, 'daily')])),
+                ('bucket_start', models.DateTimeField()),
+                ('minimum', models.DecimalField(decimal_places=2, max_digits=4)),
+                ('maximum', models.DecimalField(decimal_places=2, max_digits=4)),
+                ('mean', models.DecimalField(decimal_places=4, max_digits=6)),
+                ('count', models.PositiveIntegerField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='datumtype',
+            name='smoothing_threshold',
+            field=models.FloatField(blank=True, help_text='Leave blank to use the default for this type, if any', null=True, verbose_name='chart outlier smoothing threshold'),
+        ),
+        migrations.AddField(
+            model_name='sensordatum',
+            name='datalogger',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='pulogger.Datalogger'),
+        ),
+        migrations.RunPython(populate_sensordatum_datalogger, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='sensordatum',
+            name='datalogger',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='pulogger.Datalogger'),
+        ),
+        migrations.AddIndex(
+            model_name='sensordatum',
+            index=models.Index(fields=['unique_sensor_name', 'timestamp'], name='sensordatum_usn_timestamp'),
+        ),
+        migrations.AddIndex(
+            model_name='sensordatum',
+            index=models.Index(fields=['sensor', 'timestamp'], name='sensordatum_sensor_timestamp'),
+        ),
+        migrations.AddIndex(
+            model_name='sensordatum',
+            index=models.Index(fields=['datalogger', 'timestamp'], name='sensordatum_logger_timestamp'),
+        ),
+        # The single-column indexes are only dropped once the composite indexes leading with the same columns exist
+        migrations.AlterField(
+            model_name='sensordatum',
+            name='sensor',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='pulogger.Sensor'),
+        ),
+        migrations.AlterField(
+            model_name='sensordatum',
+            name='unique_sensor_name',
+            field=models.CharField(default='placeholder', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='sensordatumrollup',
+            name='sensor',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='pulogger.Sensor'),
+        ),
+        migrations.AddField(
+            model_name='sensordatumrollup',
+            name='type',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='pulogger.DatumType'),
+        ),
+        migrations.AddField(
+            model_name='latestreading',
+            name='sensor',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='pulogger.Sensor'),
+        ),
+        migrations.AddField(
+            model_name='latestreading',
+            name='type',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='pulogger.DatumType'),
+        ),
+        migrations.AddIndex(
+            model_name='sensordatumrollup',
+            index=models.Index(fields=['sensor', 'resolution', 'bucket_start'], name='rollup_sensor_bucket_start'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='sensordatumrollup',
+            unique_together={('unique_sensor_name', 'resolution', 'bucket_start')},
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 2.2.4 on 2026-10-18 01:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pulogger', '0002_history_tables_and_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datumtype',
+            name='range_maximum',
+            field=models.FloatField(blank=True, null=True, verbose_name='time-in-range band maximum'),
+        ),
+        migrations.AddField(
+            model_name='datumtype',
+            name='range_minimum',
+            field=models.FloatField(blank=True, help_text='Leave both bounds blank to not track time in range', null=True, verbose_name='time-in-range band minimum'),
+        ),
+        migrations.CreateModel(
+            name='SensorDayStatistics',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unique_sensor_name', models.CharField(max_length=32)),
+                ('day', models.DateField()),
+                ('minimum', models.DecimalField(decimal_places=2, max_digits=4, null=True)),
+                ('maximum', models.DecimalField(decimal_places=2, max_digits=4, null=True)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('sum', models.FloatField(default=0)),
+                ('sum_of_squares', models.FloatField(default=0)),
+                ('covered_seconds', models.FloatField(default=0)),
+                ('in_range_seconds', models.FloatField(default=0)),
+                ('sensor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='pulogger.Sensor')),
+                ('type', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='pulogger.DatumType')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='sensordaystatistics',
+            index=models.Index(fields=['sensor', 'day'], name='daystatistics_sensor_day'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='sensordaystatistics',
+            unique_together={('unique_sensor_name', 'day')},
+        ),
+    ]
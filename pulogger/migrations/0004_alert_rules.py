@@ -0,0 +1,42 @@
+# Generated by Django 2.2.4 on 2026-10-18 01:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pulogger', '0003_daily_statistics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertRule',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('condition', models.CharField(choices=[('above', 'above threshold'), ('below', 'below threshold'), ('rate_of_change', 'changing faster than threshold per hour'), ('no_data', 'no data for minutes')], max_length=16)),
+                ('threshold', models.FloatField(blank=True, help_text='Value for above and below; change per hour for rate of change', null=True)),
+                ('minutes', models.PositiveIntegerField(blank=True, help_text='Minutes without a transmission for no data', null=True)),
+                ('description', models.CharField(blank=True, max_length=64)),
+                ('is_enabled', models.BooleanField(default=True)),
+                ('sensor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='pulogger.Sensor')),
+                ('sensor_model', models.ForeignKey(blank=True, help_text='Set instead of sensor to apply the rule to every sensor of a model', null=True, on_delete=django.db.models.deletion.CASCADE, to='pulogger.SensorModel')),
+                ('type', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='pulogger.DatumType')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AlertState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('is_firing', models.BooleanField(default=False)),
+                ('changed_at', models.DateTimeField()),
+                ('value', models.DecimalField(decimal_places=2, help_text='Reading that changed the state', max_digits=4, null=True)),
+                ('rule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='pulogger.AlertRule')),
+                ('sensor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='pulogger.Sensor')),
+            ],
+            options={
+                'unique_together': {('rule', 'sensor')},
+            },
+        ),
+    ]
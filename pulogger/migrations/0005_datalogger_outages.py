@@ -0,0 +1,27 @@
+# Generated by Django 2.2.4 on 2026-10-18 01:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pulogger', '0004_alert_rules'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataloggerOutage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField(verbose_name='last transmission before the outage')),
+                ('ended_at', models.DateTimeField(verbose_name='first transmission after the outage')),
+                ('datalogger', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='pulogger.Datalogger')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='dataloggeroutage',
+            index=models.Index(fields=['datalogger', 'ended_at'], name='outage_logger_ended_at'),
+        ),
+    ]
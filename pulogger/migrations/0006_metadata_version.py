@@ -0,0 +1,25 @@
+# Generated by Django 2.2.4 on 2026-10-18 01:41
+
+from django.db import migrations, models
+
+
+def create_metadata_version(apps, schema_editor):
+    apps.get_model('pulogger', 'MetadataVersion').objects.create(version=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pulogger', '0005_datalogger_outages'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetadataVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_metadata_version, migrations.RunPython.noop),
+    ]
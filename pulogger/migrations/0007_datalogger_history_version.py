@@ -0,0 +1,18 @@
+# Generated by Django 2.2.4 on 2026-10-18 01:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pulogger', '0006_metadata_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datalogger',
+            name='history_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.4 on 2026-10-18 01:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pulogger', '0007_datalogger_history_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datalogger',
+            name='data_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.4 on 2026-10-18 02:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pulogger', '0008_datalogger_data_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datumtype',
+            name='update_hysteresis',
+            field=models.FloatField(blank=True, help_text='How far a reading must differ from the last one logged to be logged within 29m50s of it. Leave blank to use the default for this type, if any, else log any change', null=True, verbose_name='logging hysteresis'),
+        ),
+    ]
@@ -1,6 +1,22 @@
-from django.db import models
+from datetime import datetime, timedelta, timezone
+from operator import attrgetter
+
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.utils.timezone import now
+
+from .ring_buffer import append_to_ring_buffer
 
 PASSCODE_LENGTH = 6
+MAX_QUERY_PARAMETERS = 500  # comfortably under SQLite's default limit of 999 bound parameters
+SETTLED_DATA_AGE = timedelta(minutes=10)  # readings older than this when written count as backfilled
+
+def filter_in_groups(queryset, field, values):
+    # The rows whose field is any of the values, queried in groups small enough to bind the values as parameters
+    values = sorted(values)
+    return [row for idx in range(0, len(values), MAX_QUERY_PARAMETERS)
+            for row in queryset.filter(**{f'{field}__in': values[idx:idx + MAX_QUERY_PARAMETERS]})]
+
 
 def generate_passcode():
     # Generates a passcode that provides some minimal protection from people posting garbage data
@@ -18,6 +34,10 @@ class Datalogger(models.Model):
     sensor_count = models.SmallIntegerField(default=1)
     up_since = models.DateTimeField('uninterrupted since', null=True, blank=True)
     last_transmission = models.DateTimeField('last transmission received', null=True, blank=True)
+    # Bumped by every write of backfilled readings, which can change history the chart caches treat as final
+    history_version = models.PositiveIntegerField(default=0, editable=False)
+    # Bumped by every write of readings at all, for the chart's HTTP cache validators
+    data_version = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self):
         return '{} ({}) - {} sensors, up since {}, last xmit {}'.format(self.device_name, self.description,
@@ -50,6 +70,22 @@ class Sensor(models.Model):
 
 class DatumType(models.Model):
     description = models.CharField(db_index=True, max_length=16)
+    smoothing_threshold = models.FloatField('chart outlier smoothing threshold', null=True, blank=True,
+                                            help_text='Leave blank to use the default for this type, if any')
+    range_minimum = models.FloatField('time-in-range band minimum', null=True, blank=True,
+                                      help_text='Leave both bounds blank to not track time in range')
+    range_maximum = models.FloatField('time-in-range band maximum', null=True, blank=True)
+    update_hysteresis = models.FloatField('logging hysteresis', null=True, blank=True,
+                                          help_text='How far a reading must differ from the last one logged to be '
+                                                    'logged within 29m50s of it. Leave blank to use the default for '
+                                                    'this type, if any, else log any change')
+
+    def is_in_range(self, value):
+        return (self.range_minimum is None or value >= self.range_minimum) \
+            and (self.range_maximum is None or value <= self.range_maximum)
+
+    def has_range(self):
+        return self.range_minimum is not None or self.range_maximum is not None
 
     def __str__(self):
         return '{}'.format(self.description)
@@ -63,20 +99,493 @@ class SensorModelDatumType(models.Model):
         return '{} records {}'.format(self.sensor, self.datum_type)
 
 
+class MetadataVersion(models.Model):
+    # A single row bumped whenever an admin-managed table changes, so that every process (web workers, the queue
+    # drainer, the listener) can tell its metadata snapshot is stale, not just the one that made the change
+    version = models.PositiveIntegerField(default=0)
+
+    @classmethod
+    def get_version(cls):
+        return cls.objects.values_list('version', flat=True).first() or 0
+
+    @classmethod
+    def bump(cls):
+        if not cls.objects.update(version=models.F('version') + 1):
+            cls.objects.create(version=1)
+
+
 class SensorDatum(models.Model):
-    sensor = models.ForeignKey(Sensor, db_index=True, on_delete=models.CASCADE)
-    unique_sensor_name = models.CharField(db_index=True, max_length=32, default='placeholder')
+    # sensor, unique_sensor_name and datalogger are indexed by the composite indexes below, which lead with them
+    sensor = models.ForeignKey(Sensor, db_index=False, on_delete=models.CASCADE)
+    datalogger = models.ForeignKey(Datalogger, db_index=False, on_delete=models.CASCADE)  # denormalised from sensor
+    unique_sensor_name = models.CharField(max_length=32, default='placeholder')
     submission_ip = models.GenericIPAddressField()
     timestamp = models.DateTimeField()
     type = models.ForeignKey(DatumType, db_index=True, on_delete=models.PROTECT)
     value = models.DecimalField(max_digits=4, decimal_places=2)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['unique_sensor_name', 'timestamp'], name='sensordatum_usn_timestamp'),
+            models.Index(fields=['sensor', 'timestamp'], name='sensordatum_sensor_timestamp'),
+            models.Index(fields=['datalogger', 'timestamp'], name='sensordatum_logger_timestamp'),
+        ]
+
     def __str__(self):
         return '{}: {} ({}, {}, submitted at {} from {} )'.format(self.type.description, self.value,
                                                                   self.sensor.datalogger.device_name,
                                                                   self.sensor.sensor_name, self.timestamp,
                                                                   self.submission_ip)
 
+    @staticmethod
+    def build_unique_sensor_name(sensor_name, sensor_id, type_id):
+        return f'{sensor_name};{sensor_id};{type_id}'  # for fast retrieval in chart views
+
     def save(self, *args, **kwargs):
-        self.unique_sensor_name = f'{self.sensor.sensor_name};{self.sensor_id};{self.type_id}'  # for fast retrieval in chart views
-        super().save(*args, **kwargs)
+        self.unique_sensor_name = self.build_unique_sensor_name(self.sensor.sensor_name, self.sensor_id, self.type_id)
+        self.datalogger_id = self.sensor.datalogger_id
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self.record_derived([self])
+
+    @staticmethod
+    def record_derived(data):
+        # Brings the tables derived from SensorDatum up to date with newly written data, which bypasses save() when
+        # written with bulk_create; must run in the same transaction as the writes
+        SensorDayStatistics.record(data)  # reads the previous latest readings, so must come first
+        LatestReading.record(data)
+        SensorDatumRollup.record(data)
+        SensorDatum.record_data_versions(data)
+        transaction.on_commit(lambda: append_to_ring_buffer(data))
+
+    @staticmethod
+    def record_data_versions(data):
+        # One update for the whole write: every datalogger written to gets a new data_version, and those given
+        # backfilled readings a new history_version too
+        settled_before = now() - SETTLED_DATA_AGE
+        written = {datum.datalogger_id for datum in data}
+        backfilled = {datum.datalogger_id for datum in data if datum.timestamp < settled_before}
+        if not written:
+            return
+
+        versions = {'data_version': models.F('data_version') + 1}
+        if backfilled:
+            versions['history_version'] = models.Case(
+                models.When(id__in=backfilled, then=models.F('history_version') + 1),
+                default=models.F('history_version'))
+        Datalogger.objects.filter(id__in=written).update(**versions)
+
+
+class LatestReading(models.Model):
+    # Most recent accepted SensorDatum per sensor+type, kept current on write so that the hysteresis checks and
+    # current-conditions view never need to scan SensorDatum
+    sensor = models.ForeignKey(Sensor, on_delete=models.CASCADE)
+    type = models.ForeignKey(DatumType, on_delete=models.PROTECT)
+    unique_sensor_name = models.CharField(unique=True, max_length=32)
+    timestamp = models.DateTimeField()
+    value = models.DecimalField(max_digits=4, decimal_places=2)
+
+    def __str__(self):
+        return '{}: {} at {}'.format(self.unique_sensor_name, self.value, self.timestamp)
+
+    @classmethod
+    def record(cls, data):
+        # Upserts the newest of the given SensorDatum instances for each series; must run in the same transaction
+        # as the writes of those instances
+        newest = {}
+        for datum in data:
+            if datum.unique_sensor_name not in newest or datum.timestamp > newest[datum.unique_sensor_name].timestamp:
+                newest[datum.unique_sensor_name] = datum
+
+        if not newest:
+            return
+
+        with transaction.atomic():
+            existing = {reading.unique_sensor_name: reading for reading in
+                        cls.objects.select_for_update().filter(unique_sensor_name__in=newest.keys())}
+
+            stale = []
+            for name, reading in existing.items():
+                if newest[name].timestamp >= reading.timestamp:
+                    reading.timestamp = newest[name].timestamp
+                    reading.value = newest[name].value
+                    stale.append(reading)
+
+            if stale:
+                cls.objects.bulk_update(stale, ['timestamp', 'value'])
+
+            cls.objects.bulk_create([cls(sensor_id=datum.sensor_id, type_id=datum.type_id, unique_sensor_name=name,
+                                         timestamp=datum.timestamp, value=datum.value)
+                                     for name, datum in newest.items() if name not in existing])
+
+
+
+class SensorDatumRollup(models.Model):
+    # Pre-aggregated SensorDatum values per sensor+type per time bucket, so that long history ranges can be drawn
+    # without reading every raw row
+    FIVE_MINUTES = 300
+    HOURLY = 3600
+    DAILY = 86400
+    RESOLUTION_CHOICES = (
+        (FIVE_MINUTES, '5 minutes'),
+        (HOURLY, 'hourly'),
+        (DAILY, 'daily'),
+    )
+
+    sensor = models.ForeignKey(Sensor, on_delete=models.CASCADE)
+    type = models.ForeignKey(DatumType, on_delete=models.PROTECT)
+    unique_sensor_name = models.CharField(max_length=32)
+    resolution = models.PositiveIntegerField(choices=RESOLUTION_CHOICES)
+    bucket_start = models.DateTimeField()
+    minimum = models.DecimalField(max_digits=4, decimal_places=2)
+    maximum = models.DecimalField(max_digits=4, decimal_places=2)
+    mean = models.DecimalField(max_digits=6, decimal_places=4)
+    count = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('unique_sensor_name', 'resolution', 'bucket_start')
+        indexes = [
+            models.Index(fields=['sensor', 'resolution', 'bucket_start'], name='rollup_sensor_bucket_start'),
+        ]
+
+    def __str__(self):
+        return '{} ({}s from {}): mean {}, min {}, max {}, {} readings'.format(self.unique_sensor_name,
+                                                                              self.resolution, self.bucket_start,
+                                                                              self.mean, self.minimum,
+                                                                              self.maximum, self.count)
+
+    @staticmethod
+    def get_bucket_start(timestamp, resolution):
+        return datetime.fromtimestamp(timestamp.timestamp() // resolution * resolution, tz=timezone.utc)
+
+    @classmethod
+    def get_coarsest_resolution(cls, duration, min_points):
+        # Coarsest resolution still giving each trace at least min_points points over duration, or None for raw data
+        for resolution, _ in reversed(cls.RESOLUTION_CHOICES):
+            if duration.total_seconds() / resolution >= min_points:
+                return resolution
+        return None
+
+    @classmethod
+    def from_datum(cls, datum, resolution):
+        return cls(sensor_id=datum.sensor_id, type_id=datum.type_id, unique_sensor_name=datum.unique_sensor_name,
+                   resolution=resolution, bucket_start=cls.get_bucket_start(datum.timestamp, resolution),
+                   minimum=datum.value, maximum=datum.value, mean=datum.value, count=1)
+
+    def merge(self, other):
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        self.mean = (self.mean * self.count + other.mean * other.count) / (self.count + other.count)
+        self.count += other.count
+
+    @classmethod
+    def aggregate(cls, data):
+        # Folds SensorDatum instances into unsaved rollups keyed by (unique_sensor_name, resolution, bucket_start)
+        totals = {}
+        for datum in data:
+            epoch_seconds = datum.timestamp.timestamp()
+            for resolution, _ in cls.RESOLUTION_CHOICES:
+                key = (datum.unique_sensor_name, resolution, epoch_seconds // resolution * resolution)
+                total = totals.get(key)
+                if total is None:
+                    totals[key] = [datum, datum.value, datum.value, datum.value, 1]
+                else:
+                    total[1] = min(total[1], datum.value)
+                    total[2] = max(total[2], datum.value)
+                    total[3] += datum.value
+                    total[4] += 1
+
+        rollups = {}
+        for (unique_sensor_name, resolution, bucket_start), (datum, minimum, maximum, total, count) in totals.items():
+            bucket_start = datetime.fromtimestamp(bucket_start, tz=timezone.utc)
+            rollups[unique_sensor_name, resolution, bucket_start] = cls(
+                sensor_id=datum.sensor_id, type_id=datum.type_id, unique_sensor_name=unique_sensor_name,
+                resolution=resolution, bucket_start=bucket_start, minimum=minimum, maximum=maximum,
+                mean=total / count, count=count)
+
+        return rollups
+
+    @classmethod
+    def record(cls, data):
+        # Merges the given SensorDatum instances into their buckets at every resolution; must run in the same
+        # transaction as the writes of those instances
+        rollups = cls.aggregate(data)
+        if not rollups:
+            return
+
+        with transaction.atomic():
+            existing = filter_in_groups(
+                cls.objects.select_for_update().filter(unique_sensor_name__in={name for name, _, _ in rollups.keys()}),
+                'bucket_start', {bucket_start for _, _, bucket_start in rollups.keys()})
+
+            updated = []
+            for rollup in existing:
+                key = (rollup.unique_sensor_name, rollup.resolution, rollup.bucket_start)
+                if key in rollups:  # the lookup is by series and by bucket start, so may find other series' buckets
+                    rollup.merge(rollups.pop(key))
+                    updated.append(rollup)
+
+            if updated:
+                cls.objects.bulk_update(updated, ['minimum', 'maximum', 'mean', 'count'])
+
+            cls.objects.bulk_create(rollups.values())
+
+
+class SensorDayStatistics(models.Model):
+    # Summary statistics per sensor+type per UTC day, kept current on write, so that a range summary combines one
+    # row per day instead of scanning SensorDatum. For time in range, each reading is taken to hold until the next
+    # one (for at most MAX_READING_GAP, beyond which the logger is assumed to have been offline), and is compared
+    # against its type's band as configured when it was written.
+    MAX_READING_GAP = timedelta(hours=1)
+
+    sensor = models.ForeignKey(Sensor, on_delete=models.CASCADE)
+    type = models.ForeignKey(DatumType, on_delete=models.PROTECT)
+    unique_sensor_name = models.CharField(max_length=32)
+    day = models.DateField()
+    # Null until a reading is logged on the day, which may be after time has been carried over from the day before
+    minimum = models.DecimalField(max_digits=4, decimal_places=2, null=True)
+    maximum = models.DecimalField(max_digits=4, decimal_places=2, null=True)
+    count = models.PositiveIntegerField(default=0)
+    sum = models.FloatField(default=0)
+    sum_of_squares = models.FloatField(default=0)
+    covered_seconds = models.FloatField(default=0)
+    in_range_seconds = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ('unique_sensor_name', 'day')
+        indexes = [
+            models.Index(fields=['sensor', 'day'], name='daystatistics_sensor_day'),
+        ]
+
+    def __str__(self):
+        return '{} on {}: min {}, max {}, {} readings'.format(self.unique_sensor_name, self.day, self.minimum,
+                                                              self.maximum, self.count)
+
+    def merge(self, other):
+        self.minimum = min(value for value in (self.minimum, other.minimum) if value is not None) \
+            if self.minimum is not None or other.minimum is not None else None
+        self.maximum = max(value for value in (self.maximum, other.maximum) if value is not None) \
+            if self.maximum is not None or other.maximum is not None else None
+        self.count += other.count
+        self.sum += other.sum
+        self.sum_of_squares += other.sum_of_squares
+        self.covered_seconds += other.covered_seconds
+        self.in_range_seconds += other.in_range_seconds
+
+    def add_reading(self, value):
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+        self.count += 1
+        self.sum += float(value)
+        self.sum_of_squares += float(value) ** 2
+
+    @classmethod
+    def get_day_statistics(cls, statistics, datum, day):
+        key = (datum.unique_sensor_name, day)
+        if key not in statistics:
+            statistics[key] = cls(sensor_id=datum.sensor_id, type_id=datum.type_id,
+                                  unique_sensor_name=datum.unique_sensor_name, day=day)
+        return statistics[key]
+
+    @classmethod
+    def add_interval(cls, statistics, datum, interval_start, interval_end, is_in_range):
+        # Spreads the seconds from interval_start to interval_end over the UTC days they fall on
+        while interval_start < interval_end:
+            day = interval_start.astimezone(timezone.utc).date()
+            day_end = datetime(day.year, day.month, day.day, tzinfo=timezone.utc) + timedelta(days=1)
+            seconds = (min(interval_end, day_end) - interval_start).total_seconds()
+
+            day_statistics = cls.get_day_statistics(statistics, datum, day)
+            day_statistics.covered_seconds += seconds
+            if is_in_range:
+                day_statistics.in_range_seconds += seconds
+
+            interval_start = min(interval_end, day_end)
+
+    @classmethod
+    def aggregate(cls, data, previous_readings, statistics=None):
+        # Folds SensorDatum instances into unsaved statistics keyed by (unique_sensor_name, day). previous_readings
+        # holds {unique_sensor_name: (timestamp, value)} of the reading before the data, and is advanced in place.
+        statistics = {} if statistics is None else statistics
+        datum_types = {}
+        for datum in sorted(data, key=attrgetter('timestamp')):
+            day_statistics = cls.get_day_statistics(statistics, datum, datum.timestamp.astimezone(timezone.utc).date())
+            day_statistics.add_reading(datum.value)
+
+            previous_timestamp, previous_value = previous_readings.get(datum.unique_sensor_name, (None, None))
+            if previous_timestamp is not None and datum.timestamp <= previous_timestamp:
+                continue  # late data splits an interval already counted, so record() rebuilds its days instead
+
+            if previous_timestamp is not None:
+                datum_type = datum_types.setdefault(datum.type_id, datum.type)
+                cls.add_interval(statistics, datum, previous_timestamp,
+                                 min(datum.timestamp, previous_timestamp + cls.MAX_READING_GAP),
+                                 datum_type.has_range() and datum_type.is_in_range(float(previous_value)))
+            previous_readings[datum.unique_sensor_name] = (datum.timestamp, datum.value)
+
+        return statistics
+
+    @classmethod
+    def record(cls, data):
+        # Merges the given SensorDatum instances into their days' statistics; must run in the same transaction as
+        # the writes of those instances, and before LatestReading.record()
+        if not data:
+            return
+
+        with transaction.atomic():
+            previous_readings = {name: (timestamp, value) for name, timestamp, value in
+                                 LatestReading.objects.filter(unique_sensor_name__in={datum.unique_sensor_name
+                                                                                      for datum in data})
+                                     .values_list('unique_sensor_name', 'timestamp', 'value')}
+
+            # {unique_sensor_name: (a datum, earliest, latest)} of readings older than their series' latest
+            late = {}
+            for datum in data:
+                previous_timestamp, _ = previous_readings.get(datum.unique_sensor_name, (None, None))
+                if previous_timestamp is not None and datum.timestamp <= previous_timestamp:
+                    _, earliest, latest = late.get(datum.unique_sensor_name, (datum, datum.timestamp, datum.timestamp))
+                    late[datum.unique_sensor_name] = (datum, min(earliest, datum.timestamp),
+                                                      max(latest, datum.timestamp))
+
+            statistics = cls.aggregate(data, previous_readings)
+
+            existing = filter_in_groups(
+                cls.objects.select_for_update().filter(unique_sensor_name__in={name for name, _ in statistics.keys()}),
+                'day', {day for _, day in statistics.keys()})
+
+            updated = []
+            for day_statistics in existing:
+                key = (day_statistics.unique_sensor_name, day_statistics.day)
+                if key in statistics:  # the lookup is by series and by day, so may find other series' days
+                    day_statistics.merge(statistics.pop(key))
+                    updated.append(day_statistics)
+
+            if updated:
+                cls.objects.bulk_update(updated, ['minimum', 'maximum', 'count', 'sum', 'sum_of_squares',
+                                                  'covered_seconds', 'in_range_seconds'])
+
+            cls.objects.bulk_create(statistics.values())
+
+            # A late reading only changes the intervals up to MAX_READING_GAP either side of it
+            for datum, earliest, latest in late.values():
+                cls.rebuild_time_in_range(datum, (earliest - cls.MAX_READING_GAP).astimezone(timezone.utc).date(),
+                                          (latest + cls.MAX_READING_GAP).astimezone(timezone.utc).date())
+
+    @classmethod
+    def rebuild_time_in_range(cls, datum, first_day, last_day):
+        # Recounts the covered and in-range seconds of datum's series from first_day to last_day from its readings,
+        # which must include those just written. Days already moved to the archive by compact_sensor_data have no
+        # raw rows left to recount from, as for rebuild_daily_statistics.
+        window_start = datetime(first_day.year, first_day.month, first_day.day, tzinfo=timezone.utc)
+        window_end = datetime(last_day.year, last_day.month, last_day.day, tzinfo=timezone.utc) + timedelta(days=1)
+        readings = SensorDatum.objects.filter(unique_sensor_name=datum.unique_sensor_name,
+                                              timestamp__gte=window_start - cls.MAX_READING_GAP) \
+            .order_by('timestamp').values_list('timestamp', 'value')
+
+        # As aggregate() counts them: each reading holds until the next, so the series' latest isn't counted yet
+        statistics = {}
+        previous_timestamp, previous_value = None, None
+        for timestamp, value in readings.iterator():
+            if previous_timestamp is not None:
+                cls.add_interval(statistics, datum, previous_timestamp,
+                                 min(timestamp, previous_timestamp + cls.MAX_READING_GAP),
+                                 datum.type.has_range() and datum.type.is_in_range(float(previous_value)))
+            if timestamp >= window_end:
+                break
+            previous_timestamp, previous_value = timestamp, value
+
+        rebuilt = {day: day_statistics for (_, day), day_statistics in statistics.items()
+                   if first_day <= day <= last_day}
+        existing = list(cls.objects.select_for_update().filter(unique_sensor_name=datum.unique_sensor_name,
+                                                               day__gte=first_day, day__lte=last_day))
+        for day_statistics in existing:
+            recounted = rebuilt.pop(day_statistics.day, None)
+            day_statistics.covered_seconds = recounted.covered_seconds if recounted else 0
+            day_statistics.in_range_seconds = recounted.in_range_seconds if recounted else 0
+
+        cls.objects.bulk_update(existing, ['covered_seconds', 'in_range_seconds'])
+        cls.objects.bulk_create(rebuilt.values())
+
+
+class AlertRule(models.Model):
+    # A condition on one datum type of a sensor, or of every sensor of a model, checked as readings are written.
+    # No-data rules are instead checked against Datalogger.last_transmission by `manage.py check_alerts`.
+    ABOVE = 'above'
+    BELOW = 'below'
+    RATE_OF_CHANGE = 'rate_of_change'
+    NO_DATA = 'no_data'
+    CONDITION_CHOICES = (
+        (ABOVE, 'above threshold'),
+        (BELOW, 'below threshold'),
+        (RATE_OF_CHANGE, 'changing faster than threshold per hour'),
+        (NO_DATA, 'no data for minutes'),
+    )
+
+    sensor = models.ForeignKey(Sensor, null=True, blank=True, on_delete=models.CASCADE)
+    sensor_model = models.ForeignKey(SensorModel, null=True, blank=True, on_delete=models.CASCADE,
+                                     help_text='Set instead of sensor to apply the rule to every sensor of a model')
+    type = models.ForeignKey(DatumType, on_delete=models.PROTECT)
+    condition = models.CharField(max_length=16, choices=CONDITION_CHOICES)
+    threshold = models.FloatField(null=True, blank=True,
+                                  help_text='Value for above and below; change per hour for rate of change')
+    minutes = models.PositiveIntegerField(null=True, blank=True, help_text='Minutes without a transmission for no data')
+    description = models.CharField(max_length=64, blank=True)
+    is_enabled = models.BooleanField(default=True)
+
+    def __str__(self):
+        target = self.sensor.sensor_name if self.sensor_id else self.sensor_model
+        limit = f'{self.minutes} minutes' if self.condition == self.NO_DATA else self.threshold
+        return '{} {} {} {}{}'.format(target, self.type, self.get_condition_display(), limit,
+                                      f' ({self.description})' if self.description else '')
+
+    def clean(self):
+        if (self.sensor_id is None) == (self.sensor_model_id is None):
+            raise ValidationError('Set either a sensor or a sensor model.')
+        if self.condition == self.NO_DATA and self.minutes is None:
+            raise ValidationError('No-data rules need a number of minutes.')
+        if self.condition != self.NO_DATA and self.threshold is None:
+            raise ValidationError('This condition needs a threshold.')
+
+    def is_breached(self, value, timestamp, previous_value=None, previous_timestamp=None):
+        # Whether a reading, with the series' previous reading if any, meets the condition
+        if self.condition == self.ABOVE:
+            return float(value) > self.threshold
+        if self.condition == self.BELOW:
+            return float(value) < self.threshold
+        if self.condition == self.RATE_OF_CHANGE:
+            if previous_timestamp is None or timestamp <= previous_timestamp:
+                return False
+            hours = (timestamp - previous_timestamp).total_seconds() / 3600
+            return abs(float(value) - float(previous_value)) / hours > self.threshold
+        return False  # a reading is data
+
+
+class AlertState(models.Model):
+    # Whether a rule is currently firing for a sensor, so that only changes are notified. Rows are created the first
+    # time a rule fires for the sensor.
+    rule = models.ForeignKey(AlertRule, on_delete=models.CASCADE)
+    sensor = models.ForeignKey(Sensor, on_delete=models.CASCADE)
+    is_firing = models.BooleanField(default=False)
+    changed_at = models.DateTimeField()
+    value = models.DecimalField(max_digits=4, decimal_places=2, null=True, help_text='Reading that changed the state')
+
+    class Meta:
+        unique_together = ('rule', 'sensor')
+
+    def __str__(self):
+        return '{} for {}: {} since {}'.format(self.rule, self.sensor.sensor_name,
+                                               'firing' if self.is_firing else 'resolved', self.changed_at)
+
+
+class DataloggerOutage(models.Model):
+    # A gap of more than PULOGGER_OUTAGE_THRESHOLD_MINUTES between two of a datalogger's transmissions, recorded when
+    # the second arrives
+    datalogger = models.ForeignKey(Datalogger, on_delete=models.CASCADE)
+    started_at = models.DateTimeField('last transmission before the outage')
+    ended_at = models.DateTimeField('first transmission after the outage')
+
+    class Meta:
+        indexes = [models.Index(fields=['datalogger', 'ended_at'], name='outage_logger_ended_at')]
+
+    def __str__(self):
+        return '{} down from {} to {}'.format(self.datalogger.device_name, self.started_at, self.ended_at)
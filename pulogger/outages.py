@@ -0,0 +1,84 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Value
+from django.db.models.functions import Greatest
+from django.utils.timezone import now
+
+from .models import Datalogger, DataloggerOutage
+
+# Datalogger.last_transmission and up_since are kept current by every submission, and each gap of more than
+# PULOGGER_OUTAGE_THRESHOLD_MINUTES between transmissions is written to DataloggerOutage as the transmission ending it
+# arrives, so uptime over any range is a query on that small table rather than a scan of SensorDatum for gaps.
+
+
+def get_outage_threshold():
+    return timedelta(minutes=settings.PULOGGER_OUTAGE_THRESHOLD_MINUTES)
+
+
+def record_transmission(device_name, received_at):
+    # One queryset update unless the datalogger had been silent, so neither the common case nor an outage saves the
+    # model (which would invalidate the metadata cache). Readings drained late from the ingest queue can't move
+    # last_transmission backwards.
+    threshold = get_outage_threshold()
+    dataloggers = Datalogger.objects.filter(device_name=device_name)
+    latest = Greatest('last_transmission', Value(received_at, output_field=models.DateTimeField()))
+    if dataloggers.filter(last_transmission__gte=received_at - threshold).update(last_transmission=latest):
+        return
+
+    with transaction.atomic():
+        datalogger = dataloggers.select_for_update().only('id', 'last_transmission').first()
+        if datalogger is None:
+            return
+
+        last_transmission = datalogger.last_transmission
+        if last_transmission is not None and last_transmission >= received_at - threshold:
+            # A concurrent submission ended the outage first
+            dataloggers.filter(id=datalogger.id).update(last_transmission=latest)
+            return
+
+        if last_transmission is not None:
+            DataloggerOutage.objects.create(datalogger_id=datalogger.id, started_at=last_transmission,
+                                            ended_at=received_at)
+        dataloggers.filter(id=datalogger.id).update(up_since=received_at, last_transmission=received_at)
+
+
+def get_outages(datalogger_id, start, end, at=None):
+    # [(started_at, ended_at, is_ongoing)] for the datalogger's outages overlapping the range, in time order. A
+    # silence already past the threshold at `at` (default now) isn't in the table until the logger transmits again,
+    # so it's included as ongoing until `at`.
+    return get_dataloggers_outages([datalogger_id], start, end, at)[datalogger_id]
+
+
+def get_dataloggers_outages(datalogger_ids, start, end, at=None):
+    # {datalogger id: outages} as get_outages() gives them, for any number of dataloggers in two queries
+    outages = {datalogger_id: [] for datalogger_id in datalogger_ids}
+    for datalogger_id, started_at, ended_at in DataloggerOutage.objects \
+            .filter(datalogger_id__in=datalogger_ids, ended_at__gt=start, started_at__lt=end) \
+            .order_by('started_at').values_list('datalogger_id', 'started_at', 'ended_at'):
+        outages[datalogger_id].append((started_at, ended_at, False))
+
+    at = at or now()
+    for datalogger_id, last_transmission in Datalogger.objects.filter(id__in=datalogger_ids) \
+            .values_list('id', 'last_transmission'):
+        if last_transmission is not None and last_transmission < min(end, at - get_outage_threshold()):
+            outages[datalogger_id].append((last_transmission, at, True))
+
+    return outages
+
+
+def get_uptime(outages, start, end):
+    # Fraction of the range not covered by the outages, or None for an empty range
+    if end <= start:
+        return None
+
+    down_seconds = sum((min(ended_at, end) - max(started_at, start)).total_seconds()
+                       for started_at, ended_at, _ in outages if ended_at > start and started_at < end)
+    return 1 - down_seconds / (end - start).total_seconds()
+
+
+def get_gap_timestamps(outages, minimum_seconds=0):
+    # Epoch seconds midway through each outage longer than minimum_seconds, i.e. somewhere a chart line has to break
+    return [(started_at.timestamp() + ended_at.timestamp()) / 2 for started_at, ended_at, _ in outages
+            if (ended_at - started_at).total_seconds() > minimum_seconds]
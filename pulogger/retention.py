@@ -0,0 +1,202 @@
+import csv
+import gzip
+import os
+import shutil
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils.timezone import now
+
+from .encoding import TraceColumns, bucket_trace_columns
+from .models import Datalogger, SensorDatum, SensorDatumRollup
+
+ARCHIVE_COLUMNS = ('id', 'timestamp', 'sensor_id', 'type_id', 'unique_sensor_name', 'value', 'submission_ip')
+RETENTION_BATCH_SIZE = 5000
+
+
+def get_archive_dir():
+    return settings.PULOGGER_ARCHIVE_DIR
+
+
+def get_raw_data_max_age():
+    return timedelta(days=settings.PULOGGER_RAW_DATA_MAX_AGE_DAYS)
+
+
+def get_month_start(dt):
+    return datetime(dt.year, dt.month, 1, tzinfo=timezone.utc)
+
+
+def get_next_month_start(month_start):
+    return get_month_start(month_start + timedelta(days=32))
+
+
+def get_archive_path(datalogger_id, month_start):
+    return os.path.join(get_archive_dir(), str(datalogger_id), f'{month_start:%Y-%m}.csv.gz')
+
+
+def get_archivable_months(datalogger, cutoff):
+    # Whole calendar months of raw data ending before cutoff, oldest first
+    oldest = SensorDatum.objects.filter(datalogger=datalogger).order_by('timestamp') \
+        .values_list('timestamp', flat=True).first()
+
+    months = []
+    month_start = oldest and get_month_start(oldest)
+    while month_start and get_next_month_start(month_start) <= cutoff:
+        months.append(month_start)
+        month_start = get_next_month_start(month_start)
+
+    return months
+
+
+def iter_month_chunks(datalogger, month_start, month_end, chunk_size):
+    # Keyset pagination on (timestamp, id) over the (datalogger, timestamp) index
+    queryset = SensorDatum.objects.filter(datalogger=datalogger, timestamp__gte=month_start, timestamp__lt=month_end) \
+        .only(*ARCHIVE_COLUMNS) \
+        .order_by('timestamp', 'id')
+
+    chunk = list(queryset[:chunk_size])
+    while chunk:
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        chunk = list(queryset.filter(Q(timestamp__gt=chunk[-1].timestamp) | Q(timestamp=chunk[-1].timestamp,
+                                                                                 id__gt=chunk[-1].id))[:chunk_size])
+
+
+def get_archived_ids(path):
+    with gzip.open(path, 'rt', newline='') as archive:
+        return {int(row[0]) for row in csv.reader(archive) if row[0] != 'id'}
+
+
+def delete_archived_rows(archived_ids, batch_size):
+    for idx in range(0, len(archived_ids), batch_size):
+        with transaction.atomic():
+            SensorDatum.objects.filter(id__in=archived_ids[idx:idx + batch_size]).delete()
+
+
+def archive_month(datalogger, month_start, batch_size=RETENTION_BATCH_SIZE):
+    # Writes a month of a datalogger's raw data to its gzip CSV archive, rebuilds that month's rollups from it, then
+    # deletes the rows from SensorDatum in batches. Returns the number of rows archived.
+    month_end = get_next_month_start(month_start)
+    path = get_archive_path(datalogger.id, month_start)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Rows logged into a month that was already archived (e.g. a late import) are appended as another gzip member;
+    # their rollups were already merged when they were written. Rows the archive already holds, left behind by a run
+    # that stopped before deleting them, are only deleted, so rerunning after a crash doesn't archive them twice.
+    is_new_archive = not os.path.exists(path)
+    already_archived = set() if is_new_archive else get_archived_ids(path)
+
+    archived_ids = []
+    written = 0
+    rollups = {}
+    with gzip.open(path + '.tmp', 'wt', newline='') as archive:
+        writer = csv.writer(archive)
+        if is_new_archive:
+            writer.writerow(ARCHIVE_COLUMNS)
+
+        for chunk in iter_month_chunks(datalogger, month_start, month_end, batch_size):
+            new_rows = [datum for datum in chunk if datum.id not in already_archived]
+            writer.writerows((datum.id, datum.timestamp.isoformat(), datum.sensor_id, datum.type_id,
+                              datum.unique_sensor_name, datum.value, datum.submission_ip) for datum in new_rows)
+            written += len(new_rows)
+            archived_ids.extend(datum.id for datum in chunk)
+
+            if is_new_archive:
+                for key, rollup in SensorDatumRollup.aggregate(chunk).items():
+                    if key in rollups:
+                        rollups[key].merge(rollup)
+                    else:
+                        rollups[key] = rollup
+
+    if not archived_ids:
+        os.remove(path + '.tmp')
+        return 0
+
+    if is_new_archive:
+        with transaction.atomic():
+            SensorDatumRollup.objects.filter(sensor__datalogger=datalogger, bucket_start__gte=month_start,
+                                             bucket_start__lt=month_end).delete()
+            SensorDatumRollup.objects.bulk_create(rollups.values())
+        os.replace(path + '.tmp', path)
+    else:
+        if written:
+            # Into a copy, replaced in one step, so a crash can't leave a truncated member behind
+            shutil.copyfile(path, path + '.new')
+            with open(path + '.new', 'ab') as archive, open(path + '.tmp', 'rb') as new_member:
+                shutil.copyfileobj(new_member, archive)
+            os.replace(path + '.new', path)
+        os.remove(path + '.tmp')
+
+    delete_archived_rows(archived_ids, batch_size)
+
+    return len(archived_ids)
+
+
+def run_retention(max_age=None, batch_size=RETENTION_BATCH_SIZE, log=None):
+    # Archives and deletes every datalogger's raw data older than max_age; safe to run from cron or any scheduler
+    cutoff = now() - (max_age or get_raw_data_max_age())
+
+    total = 0
+    for datalogger in Datalogger.objects.all():
+        for month_start in get_archivable_months(datalogger, cutoff):
+            archived = archive_month(datalogger, month_start, batch_size)
+            total += archived
+            if log:
+                log(f'{datalogger.device_name} {month_start:%Y-%m}: archived {archived} readings')
+
+    return total
+
+
+def iter_archived_rows(datalogger, history_start, history_end):
+    # (timestamp, unique_sensor_name, type_id, value) of the datalogger's archived readings in the range
+    if datalogger is None:
+        return
+
+    month_start = get_month_start(history_start)
+    while month_start <= history_end:
+        path = get_archive_path(datalogger.id, month_start)
+        if os.path.exists(path):
+            with gzip.open(path, 'rt', newline='') as archive:
+                for row in csv.DictReader(archive, fieldnames=ARCHIVE_COLUMNS):
+                    if row['id'] == 'id':
+                        continue
+                    timestamp = datetime.fromisoformat(row['timestamp'])
+                    if history_start <= timestamp <= history_end:
+                        yield timestamp, row['unique_sensor_name'], int(row['type_id']), Decimal(row['value'])
+        month_start = get_next_month_start(month_start)
+
+
+def get_archived_trace_columns(datalogger, history_start, history_end, bucket_seconds):
+    # Archived readings bucketed like the database's
+    rows_by_trace = {}
+    for timestamp, unique_sensor_name, type_id, value in iter_archived_rows(datalogger, history_start, history_end):
+        rows_by_trace.setdefault((unique_sensor_name, type_id), []).append((timestamp.timestamp(), float(value)))
+
+    traces = []
+    for (unique_sensor_name, type_id), rows in sorted(rows_by_trace.items()):
+        timestamps, values = np.array(rows).T
+        timestamps = timestamps.astype(np.int64)
+        order = np.argsort(timestamps, kind='stable')
+        traces.append(bucket_trace_columns(unique_sensor_name, type_id, timestamps[order], values[order],
+                                           bucket_seconds))
+
+    return traces
+
+
+def merge_trace_columns(older_traces, newer_traces):
+    # Concatenates per-trace columns where every point of older_traces precedes those of newer_traces
+    merged = {trace.unique_sensor_name: trace for trace in older_traces}
+    for trace in newer_traces:
+        if trace.unique_sensor_name in merged:
+            older = merged[trace.unique_sensor_name]
+            trace = TraceColumns(trace.unique_sensor_name, trace.type_id,
+                                 np.concatenate((older.timestamps, trace.timestamps)),
+                                 np.concatenate((older.values, trace.values)))
+        merged[trace.unique_sensor_name] = trace
+
+    return [merged[unique_sensor_name] for unique_sensor_name in sorted(merged)]
@@ -0,0 +1,315 @@
+import fcntl
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from hashlib import md5
+from time import time
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+
+from .encoding import bucket_trace_columns
+
+# The last PULOGGER_RING_BUFFER_HOURS of accepted readings per sensor+type, in a memory-mapped file (on tmpfs in
+# production) that every worker process maps, so the default chart window never needs SensorDatum. Each series has
+# a fixed-size slot holding a circular array of its readings; covered_since records the time from which a slot is
+# known to be complete. Appends take an exclusive flock on the file and reads a shared one.
+# Slots are only ever added at the end of the file, up to PULOGGER_RING_BUFFER_MAX_SERIES, so the slots a process has
+# already mapped stay where they are when another grows it. A datalogger with a series that found no slot has its
+# reads fall back to the database, without affecting any other datalogger's.
+
+RING_BUFFER_MAGIC = b'DLRB'
+RING_BUFFER_VERSION = 2
+RING_BUFFER_MIN_SERIES = 64
+RING_BUFFER_CAPACITY = 4096  # readings per series; more than a day even at the 50s minimum logging interval
+RING_BUFFER_HEADER_SIZE = 4096
+RING_BUFFER_MAX_OVERFLOWED = 256  # dataloggers listed as missing a series; past this, every read falls back
+
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S4'),
+    ('version', '<u4'),
+    ('built_at', '<f8'),  # 0 until the buffer has been filled from the database
+    ('built_since', '<i8'),  # epoch seconds the build read from; series without a slot are complete since then
+    ('slot_count', '<u4'),  # slots in the file
+    ('overflowed_count', '<u4'),
+    ('overflowed', '<i4', (RING_BUFFER_MAX_OVERFLOWED,)),  # ids of dataloggers with a series that found no slot
+])
+SLOT_DTYPE = np.dtype([
+    ('unique_sensor_name', 'S32'),
+    ('datalogger_id', '<i4'),
+    ('type_id', '<i4'),
+    ('head', '<u4'),  # index the next reading is written to
+    ('count', '<u4'),
+    ('covered_since', '<i8'),
+    ('timestamps', '<i8', (RING_BUFFER_CAPACITY,)),
+    ('values', '<f8', (RING_BUFFER_CAPACITY,)),
+])
+
+_ring_buffers = {}  # path: RingBuffer
+_ring_buffers_lock = threading.Lock()
+
+
+def is_ring_buffer_enabled():
+    return bool(settings.PULOGGER_RING_BUFFER_DIR)
+
+
+def get_ring_buffer_path():
+    # One file per database, so e.g. a test run never shares the production buffer
+    database_name = str(connection.settings_dict['NAME'])
+    return os.path.join(settings.PULOGGER_RING_BUFFER_DIR,
+                        f'deadleavesclub-ring-buffer-{md5(database_name.encode()).hexdigest()[:12]}')
+
+
+class RingBuffer:
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self.thread_lock = threading.Lock()  # flock doesn't exclude threads sharing the file descriptor
+        with self.locked(exclusive=True):
+            if os.fstat(self.fd).st_size < RING_BUFFER_HEADER_SIZE:
+                os.ftruncate(self.fd, RING_BUFFER_HEADER_SIZE)
+            self.header = np.memmap(path, dtype=HEADER_DTYPE, mode='r+', shape=(1,))
+            if self.header[0]['magic'] != RING_BUFFER_MAGIC or self.header[0]['version'] != RING_BUFFER_VERSION:
+                # New, or a file from another layout; emptied of slots, so it reads as not built
+                os.ftruncate(self.fd, RING_BUFFER_HEADER_SIZE)
+                self.header[0] = np.zeros(1, dtype=HEADER_DTYPE)[0]
+                self.header[0]['magic'] = RING_BUFFER_MAGIC
+                self.header[0]['version'] = RING_BUFFER_VERSION
+
+            self.slots = None
+            self.map_slots()
+        self.slot_indexes = {}
+        self.slot_indexes_built_at = None
+
+    @contextmanager
+    def locked(self, exclusive):
+        with self.thread_lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def map_slots(self):
+        # Maps the slots again if another process has grown the file since; run under the lock
+        slot_count = int(self.header[0]['slot_count'])
+        if self.slots is None or len(self.slots) != slot_count:
+            self.slots = np.memmap(self.path, dtype=SLOT_DTYPE, mode='r+', offset=RING_BUFFER_HEADER_SIZE,
+                                   shape=(slot_count,)) if slot_count else np.zeros(0, dtype=SLOT_DTYPE)
+
+    def grow(self, slot_count):
+        # Extends the file to slot_count slots, up to PULOGGER_RING_BUFFER_MAX_SERIES, returning whether it grew
+        slot_count = min(slot_count, settings.PULOGGER_RING_BUFFER_MAX_SERIES)
+        if slot_count <= len(self.slots):
+            return False
+
+        os.ftruncate(self.fd, RING_BUFFER_HEADER_SIZE + SLOT_DTYPE.itemsize * slot_count)
+        self.header[0]['slot_count'] = slot_count
+        self.map_slots()
+        return True
+
+    def record_overflow(self, datalogger_id):
+        header = self.header[0]
+        overflowed_count = int(header['overflowed_count'])
+        if datalogger_id in header['overflowed'][:overflowed_count]:
+            return
+
+        if overflowed_count < RING_BUFFER_MAX_OVERFLOWED:
+            header['overflowed'][overflowed_count] = datalogger_id
+        header['overflowed_count'] = min(overflowed_count + 1, RING_BUFFER_MAX_OVERFLOWED + 1)
+
+    def is_overflowed(self, datalogger_id):
+        # Whether a series of the datalogger found no slot, leaving its readings in the buffer incomplete
+        overflowed_count = int(self.header[0]['overflowed_count'])
+        return overflowed_count > RING_BUFFER_MAX_OVERFLOWED \
+            or datalogger_id in self.header[0]['overflowed'][:overflowed_count]
+
+    def is_built(self):
+        header = self.header[0]
+        return header['magic'] == RING_BUFFER_MAGIC and header['version'] == RING_BUFFER_VERSION \
+            and header['built_at'] > 0
+
+    def get_slot_index(self, unique_sensor_name, datalogger_id=None, type_id=None):
+        # Index of the series' slot, allocating a free one if datalogger_id and type_id are given
+        if self.slot_indexes_built_at != self.header[0]['built_at']:
+            self.slot_indexes = {}
+            self.slot_indexes_built_at = self.header[0]['built_at']
+
+        if unique_sensor_name not in self.slot_indexes:
+            # Another process may have allocated it since this one last looked
+            names = self.slots['unique_sensor_name']
+            matches = np.flatnonzero(names == unique_sensor_name.encode())
+            if len(matches):
+                self.slot_indexes[unique_sensor_name] = int(matches[0])
+            elif datalogger_id is not None:
+                free = np.flatnonzero(names == b'')
+                if len(free):
+                    slot_index = int(free[0])
+                elif self.grow(max(2 * len(self.slots), RING_BUFFER_MIN_SERIES)):
+                    slot_index = len(names)
+                else:
+                    self.record_overflow(datalogger_id)
+                    return None
+                slot = self.slots[slot_index]
+                slot['unique_sensor_name'] = unique_sensor_name.encode()
+                slot['datalogger_id'] = datalogger_id
+                slot['type_id'] = type_id
+                slot['head'] = slot['count'] = 0
+                slot['covered_since'] = self.header[0]['built_since']
+                self.slot_indexes[unique_sensor_name] = slot_index
+
+        return self.slot_indexes.get(unique_sensor_name)
+
+    def get_ordered(self, slot):
+        order = (int(slot['head']) - int(slot['count']) + np.arange(slot['count'])) % RING_BUFFER_CAPACITY
+        return slot['timestamps'][order], slot['values'][order]
+
+    def append_unlocked(self, readings):
+        # readings: (unique_sensor_name, datalogger_id, type_id, epoch seconds, value)
+        for unique_sensor_name, datalogger_id, type_id, timestamp, value in readings:
+            slot_index = self.get_slot_index(unique_sensor_name, datalogger_id, type_id)
+            if slot_index is None:
+                continue
+            slot = self.slots[slot_index]
+            if timestamp < slot['covered_since']:
+                continue
+
+            count, head = int(slot['count']), int(slot['head'])
+            if count and timestamp <= slot['timestamps'][(head - 1) % RING_BUFFER_CAPACITY]:
+                # Out of order, e.g. imported data or a reading the build already read; rewrite the slot in order
+                timestamps, values = self.get_ordered(slot)
+                if timestamp in timestamps:
+                    continue
+                position = np.searchsorted(timestamps, timestamp)
+                timestamps = np.insert(timestamps, position, timestamp)
+                values = np.insert(values, position, value)
+                self.fill_slot(slot, timestamps, values)
+                continue
+
+            if count == RING_BUFFER_CAPACITY:
+                slot['covered_since'] = slot['timestamps'][head] + 1
+            slot['timestamps'][head] = timestamp
+            slot['values'][head] = value
+            slot['head'] = (head + 1) % RING_BUFFER_CAPACITY
+            slot['count'] = min(count + 1, RING_BUFFER_CAPACITY)
+
+    @staticmethod
+    def fill_slot(slot, timestamps, values):
+        if len(timestamps) > RING_BUFFER_CAPACITY:
+            slot['covered_since'] = timestamps[-RING_BUFFER_CAPACITY - 1] + 1
+            timestamps, values = timestamps[-RING_BUFFER_CAPACITY:], values[-RING_BUFFER_CAPACITY:]
+
+        slot['timestamps'][:len(timestamps)] = timestamps
+        slot['values'][:len(values)] = values
+        slot['count'] = len(timestamps)
+        slot['head'] = len(timestamps) % RING_BUFFER_CAPACITY
+
+    def append(self, readings):
+        with self.locked(exclusive=True):
+            self.map_slots()
+            if self.is_built():
+                self.append_unlocked(readings)
+
+    def rebuild(self, readings, built_since):
+        # readings: every reading since built_since, in time order per series
+        with self.locked(exclusive=True):
+            self.map_slots()
+            header = self.header[0]
+            header['built_at'] = 0
+            header['built_since'] = built_since
+            header['overflowed_count'] = 0
+            self.slots[:] = np.zeros(1, dtype=SLOT_DTYPE)[0]
+            self.slot_indexes_built_at = None
+
+            by_series = {}
+            for unique_sensor_name, datalogger_id, type_id, timestamp, value in readings:
+                by_series.setdefault((unique_sensor_name, datalogger_id, type_id), []).append((timestamp, value))
+
+            # Sized for the series there are now; new ones grow it as they appear
+            self.grow(max(len(by_series), RING_BUFFER_MIN_SERIES))
+
+            for (unique_sensor_name, datalogger_id, type_id), rows in by_series.items():
+                slot_index = self.get_slot_index(unique_sensor_name, datalogger_id, type_id)
+                if slot_index is not None:
+                    timestamps, values = np.array(rows, dtype=np.float64).T
+                    self.fill_slot(self.slots[slot_index], timestamps.astype(np.int64), values)
+
+            self.header[0]['built_at'] = time()
+            self.header.flush()
+
+    def read(self, datalogger_id, history_start, history_end):
+        # {unique_sensor_name: (type_id, timestamps, values)} of the datalogger's readings in the range, or None if
+        # the buffer can't vouch for having all of them
+        with self.locked(exclusive=False):
+            self.map_slots()
+            if not self.is_built() or self.header[0]['built_since'] > history_start \
+                    or self.is_overflowed(datalogger_id):
+                return None
+
+            series = {}
+            for slot in self.slots[self.slots['datalogger_id'] == datalogger_id]:
+                if not slot['unique_sensor_name']:
+                    continue
+                if slot['covered_since'] > history_start:
+                    return None
+                timestamps, values = self.get_ordered(slot)
+                in_range = (timestamps >= history_start) & (timestamps <= history_end)
+                series[slot['unique_sensor_name'].decode()] = (int(slot['type_id']), timestamps[in_range],
+                                                               values[in_range])
+
+        return series
+
+
+def map_ring_buffer():
+    # The process's mapping of the shared buffer file
+    path = get_ring_buffer_path()
+    with _ring_buffers_lock:
+        if path not in _ring_buffers:
+            _ring_buffers[path] = RingBuffer(path)
+
+        return _ring_buffers[path]
+
+
+def get_ring_buffer():
+    # The shared buffer, filled from the database first if no process has yet
+    ring_buffer = map_ring_buffer()
+    if not ring_buffer.is_built():
+        rebuild_ring_buffer(ring_buffer)
+
+    return ring_buffer
+
+
+def rebuild_ring_buffer(ring_buffer=None):
+    from .models import SensorDatum  # models imports this module to append on write
+
+    ring_buffer = ring_buffer or map_ring_buffer()
+    built_since = int(time() - timedelta(hours=settings.PULOGGER_RING_BUFFER_HOURS).total_seconds())
+    data = SensorDatum.objects.filter(timestamp__gte=datetime.fromtimestamp(built_since, tz=timezone.utc)) \
+        .order_by('timestamp', 'id') \
+        .values_list('unique_sensor_name', 'datalogger_id', 'type_id', 'timestamp', 'value')
+
+    ring_buffer.rebuild(((unique_sensor_name, datalogger_id, type_id, int(timestamp.timestamp()), float(value))
+                         for unique_sensor_name, datalogger_id, type_id, timestamp, value in data.iterator()),
+                        built_since)
+
+
+def append_to_ring_buffer(data):
+    # Adds newly committed SensorDatum instances to the buffer
+    if is_ring_buffer_enabled():
+        get_ring_buffer().append([(datum.unique_sensor_name, datum.datalogger_id, datum.type_id,
+                                   int(datum.timestamp.timestamp()), float(datum.value)) for datum in data])
+
+
+def get_ring_buffer_trace_columns(datalogger, history_start, history_end, bucket_seconds):
+    # The datalogger's bucketed traces for the range from the buffer, or None if it doesn't hold all of the range
+    if not is_ring_buffer_enabled() or datalogger is None:
+        return None
+
+    series = get_ring_buffer().read(datalogger.id, int(history_start.timestamp()), history_end.timestamp())
+    if series is None:
+        return None
+
+    return [bucket_trace_columns(unique_sensor_name, type_id, timestamps, values, bucket_seconds)
+            for unique_sensor_name, (type_id, timestamps, values) in sorted(series.items()) if len(timestamps)]
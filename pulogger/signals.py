@@ -0,0 +1,14 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .metadata import invalidate_metadata
+from .models import Datalogger, SensorModel, Sensor, DatumType, SensorModelDatumType, AlertRule, MetadataVersion
+
+METADATA_MODELS = (Datalogger, SensorModel, Sensor, DatumType, SensorModelDatumType, AlertRule)
+
+
+@receiver([post_save, post_delete])
+def invalidate_metadata_on_change(sender, **kwargs):
+    if sender in METADATA_MODELS:
+        invalidate_metadata()
+        MetadataVersion.bump()  # for every other process
@@ -0,0 +1,40 @@
+from datetime import timedelta
+
+import numpy as np
+
+SMOOTHING_STALE_TIME = timedelta(hours=6)
+DEFAULT_SMOOTHING_THRESHOLDS = {
+    'temperature': 0.2,
+    'humidity': 1.0,
+}
+
+
+def get_smoothing_mask(timestamps, values, threshold, stale_seconds=SMOOTHING_STALE_TIME.total_seconds()):
+    # Boolean mask of the points kept by the outlier filter: a point is dropped if it differs from the previous kept
+    # point by more than threshold, unless that kept point is older than stale_seconds.
+    #
+    # While every point is kept, "previous kept point" is just the previous point, so the adjacent differences are
+    # checked for the whole trace at once and the filter only steps point-by-point from each failing difference
+    # until a point is kept again.
+    keep = np.ones(len(values), dtype=bool)
+    if threshold is None or len(values) < 2:
+        return keep
+
+    adjacent_kept = (np.abs(np.diff(values)) <= threshold) | (np.diff(timestamps) > stale_seconds)
+    breaks = np.flatnonzero(~adjacent_kept) + 1
+
+    break_idx = 0
+    while break_idx < len(breaks):
+        last_kept = breaks[break_idx] - 1
+        idx = breaks[break_idx]
+        while idx < len(values):
+            if abs(values[idx] - values[last_kept]) <= threshold \
+                    or timestamps[idx] - timestamps[last_kept] > stale_seconds:
+                break
+            keep[idx] = False
+            idx += 1
+
+        # idx is kept (or past the end), so the adjacent checks hold again until the next break after it
+        break_idx = np.searchsorted(breaks, idx, side='right')
+
+    return keep
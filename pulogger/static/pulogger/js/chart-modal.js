@@ -10,7 +10,13 @@ $(document).ready(function () {
     });
 
     $(".data-export").click(function () {
-        exportData();
+        exportData($(this).attr("format"));
+    });
+
+    // Stop polling for a chart that's no longer shown
+    $("#measurement-history-modal").on("hidden.bs.modal", function () {
+        clearInterval(liveUpdateTimer);
+        liveUpdateTimer = null;
     });
 });
 
@@ -41,17 +47,17 @@ function setFormFieldLayout() {
     moveModalFormElementsToGroup("to");
 }
 
-function exportData() {
-    let modal = $("#measurementHistoryModal");
-    let context = {
-        deviceSn: "test",
-        exportFormat: $(this).attr("format"),
-    };
+function exportData(exportFormat) {
+    // Submit the filter form to the export URL so the browser streams the download straight to disk
+    let form = $("#modal-filter");
+    let url = `//${location.host}/pulogger/getHistory/?device=${$("#measurement-history-modal").attr("active-device")}`;
 
-    getHistoricalDeviceReadings(context, function (context, data) {
-        let filename = `pumidor_export_${context.deviceSn}_${context.deviceLocation}_${dateObjToUtcString(context.from)}_to_${dateObjToUtcString(context.to)}.csv`;
-        saveData(data, filename);
-    });
+    url += `&clientTzOffset=${new Date().getTimezoneOffset()}`;
+    url += `&format=${exportFormat}`;
+
+    form.attr("action", url);
+    form.attr("method", "POST");
+    form.submit();
 }
 
 function convert12hrTo24hr(hour, isPm) {
@@ -93,8 +99,9 @@ function getHistoricalDeviceReadings(context, callback) {
         url += `&format=${context.exportFormat}`;
     }
 
+    // GET, so the browser can revalidate unchanged history with the ETag instead of re-downloading it
     $.ajax({
-        type: form.attr("type"),
+        type: "GET",
         url: url,
         data: form.serialize(),
         success: function (responseData) {
@@ -115,6 +122,9 @@ function renderChart(context, dataJson) {
         const trace = dataJson[_trace];
         for (const _datum in trace.dataPoints) {
             let datum = trace.dataPoints[_datum];
+            if (datum.y === null) {  // a break in the line across an outage
+                continue;
+            }
             if (trace.dataPointsType === 'temperature') {
                 if (datum.y > maximumTemperature) {
                     maximumTemperature = datum.y
@@ -173,6 +183,73 @@ function renderChart(context, dataJson) {
     });
 
     chart.render();
+
+    return chart;
+}
+
+const liveUpdateIntervalMs = 60 * 1000;
+let liveUpdateTimer = null;
+
+// While the chart's range reaches the present, poll for readings newer than each trace's latest raw reading and
+// append them. The last point is a bucket's start, and the bucket may already average readings after it.
+function startLiveUpdates(context, chart) {
+    clearInterval(liveUpdateTimer);
+    liveUpdateTimer = null;
+    if (context.to <= new Date() || !$("#measurement-history-modal").is(":visible")) {
+        return;
+    }
+
+    let cursor = {};
+    let seriesByName = {};
+    chart.options.data.forEach(function (series) {
+        seriesByName[series.uniqueSensorName] = series;
+        if (series.lastTimestamp != null) {
+            cursor[series.uniqueSensorName] = series.lastTimestamp * 1000;
+        } else if (series.dataPoints.length) {
+            cursor[series.uniqueSensorName] = series.dataPoints[series.dataPoints.length - 1].x;
+        }
+    });
+
+    liveUpdateTimer = setInterval(function () {
+        let url = `//${location.host}/pulogger/getUpdates/?device=${context.deviceSn}`;
+        url += `&cursor=${encodeURIComponent(JSON.stringify(cursor))}`;
+
+        $.getJSON(url, function (updates) {
+            cursor = updates.cursor;
+            for (const uniqueSensorName in updates.traces) {
+                if (uniqueSensorName in seriesByName) {
+                    Array.prototype.push.apply(seriesByName[uniqueSensorName].dataPoints,
+                        updates.traces[uniqueSensorName].dataPoints);
+                }
+            }
+            chart.render();
+        });
+    }, liveUpdateIntervalMs);
+}
+
+// Expand the delta-encoded, fixed-point 'compact' history format into CanvasJS data series
+function decodeCompactTraces(compactTraces) {
+    return compactTraces.map(function (trace) {
+        let dataPoints = new Array(trace.dt.length);
+        let timestamp = trace.t0;
+        for (let idx = 0; idx < trace.dt.length; idx++) {
+            timestamp += trace.dt[idx];
+            dataPoints[idx] = {x: timestamp * 1000, y: trace.v[idx] / trace.scale};
+        }
+
+        // CanvasJS doesn't join a line across a null point; inserted from the last gap so earlier indexes hold
+        let gaps = trace.gaps || [];
+        for (let gapIdx = gaps.length - 1; gapIdx >= 0; gapIdx--) {
+            let idx = gaps[gapIdx];
+            dataPoints.splice(idx, 0, {x: (dataPoints[idx - 1].x + dataPoints[idx].x) / 2, y: null});
+        }
+
+        return Object.assign({}, trace.definition, {
+            uniqueSensorName: trace.unique_sensor_name,
+            lastTimestamp: trace.last_timestamp,
+            dataPoints: dataPoints
+        });
+    });
 }
 
 // Refresh modal and show, if necessary
@@ -192,18 +269,19 @@ function updateModalContents(deviceSn) {
 
     let context = {
         deviceSn: deviceSn,
+        exportFormat: "compact",
     };
 
     getHistoricalDeviceReadings(context, function (context, responseData) {
-        let dataJson = JSON.parse(responseData);
+        let dataJson = decodeCompactTraces(responseData);
         $(modal).find(".modal-title").text(`Measurement History: Device ${deviceSn}`);
 
         if ($(modal).is(":visible")) {
-            renderChart(context, dataJson);
+            startLiveUpdates(context, renderChart(context, dataJson));
         } else {
             //delay chart render until modal has been drawn, to enable CanvasJS stretch-to-fit
             $(modal).on('shown.bs.modal', function () {
-                renderChart(context, dataJson);
+                startLiveUpdates(context, renderChart(context, dataJson));
                 $(modal).off('shown.bs.modal');
             });
             $(modal).modal("show");
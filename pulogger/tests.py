@@ -1,3 +1,880 @@
-from django.test import TestCase
+import asyncio
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+import gzip
+import struct
+from io import StringIO
+from json import dumps as json_dumps, loads as json_loads
+from operator import itemgetter
+from tempfile import TemporaryDirectory
+from threading import Event
+from time import time
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import alerts, ingest_queue, metrics
+from .alerts import sweep_no_data_alerts
+from .bulk_import import ImportResult, import_readings, iter_csv_readings
+from .downsampling import get_history_bucket_values, largest_triangle_three_buckets
+from .encoding import COMPACT_BINARY_MAGIC, TraceColumns, bucket_trace_columns, encode_compact_binary, \
+    encode_compact_json, get_trace_columns, set_gap_indexes
+from .export import iter_csv_chunks, iter_sensor_data_chunks
+from .history_cache import HISTORY_CACHE_ALIAS, get_cached_trace_columns
+from .ingest import Reading, ingest_readings
+from .listener import Listener
+from .management.commands.benchmark_smoothing import legacy_smoothing
+from .metadata import get_metadata
+from .models import Datalogger, SensorModel, Sensor, DatumType, SensorModelDatumType, SensorDatum, SensorDatumRollup, \
+    SensorDayStatistics, AlertRule, AlertState, DataloggerOutage, MetadataVersion, LatestReading
+from .outages import get_gap_timestamps, get_outages, get_uptime
+from .retention import run_retention
+from .ring_buffer import RING_BUFFER_CAPACITY, RING_BUFFER_MIN_SERIES, RingBuffer
+from .smoothing import get_smoothing_mask
+
+
+class DataloggerTestCase(TestCase):
+    # A datalogger 'test' with a DHT22 sensor 's0' able to record DATUM_TYPE
+    DATUM_TYPE = 'temperature'
+    START = datetime(2020, 9, 13, 12, 0, tzinfo=timezone.utc)
+
+    def setUp(self):
+        self.datalogger = Datalogger.objects.create(device_name='test', passcode='ABC123')
+        self.sensor_model = SensorModel.objects.create(type='DHT22')
+        self.datum_type = DatumType.objects.create(description=self.DATUM_TYPE)
+        SensorModelDatumType.objects.create(sensor=self.sensor_model, datum_type=self.datum_type)
+        self.sensor = Sensor.objects.create(datalogger=self.datalogger, type=self.sensor_model, sensor_name='s0')
+
+    def at(self, minutes):
+        return self.START + timedelta(minutes=minutes)
+
+    def save_reading(self, timestamp, value):
+        # Through SensorDatum.save(), bypassing the submission rules
+        SensorDatum(sensor=self.sensor, type=self.datum_type, submission_ip='1.1.1.1', timestamp=timestamp,
+                    value=Decimal(value)).save()
+
+    def ingest(self, minutes, value):
+        # As if transmitted at the reading's time
+        ingest_readings('test', [Reading('s0', self.DATUM_TYPE, Decimal(value), self.at(minutes))], '1.1.1.1',
+                        received_at=self.at(minutes))
+
+
+class MetadataTests(DataloggerTestCase):
+    def test_admin_changes_invalidate_the_snapshot(self):
+        self.assertIsNone(get_metadata().get_sensor('test', 's1'))
+        sensor = Sensor.objects.create(datalogger=self.datalogger, type=self.sensor_model, sensor_name='s1')
+        self.assertEqual(get_metadata().get_sensor('test', 's1'), sensor)
+        sensor.delete()
+        self.assertIsNone(get_metadata().get_sensor('test', 's1'))
+
+    def test_changes_made_by_other_processes_are_picked_up(self):
+        get_metadata()
+        # As another process would see it: no signal here, only the bumped version
+        DatumType.objects.filter(id=self.datum_type.id).update(smoothing_threshold=0.5)
+        MetadataVersion.bump()
+
+        with override_settings(PULOGGER_METADATA_CHECK_SECONDS=3600):
+            self.assertEqual(get_metadata().get_smoothing_threshold(self.datum_type.id), 0.2)
+        with override_settings(PULOGGER_METADATA_CHECK_SECONDS=0):
+            self.assertEqual(get_metadata().get_smoothing_threshold(self.datum_type.id), 0.5)
+
+
+class LatestReadingTests(DataloggerTestCase):
+    def test_latest_reading_is_kept_on_write_and_rebuilt_from_history(self):
+        for minutes, value in ((0, 20), (60, 22), (30, 21)):  # the last arrives out of order
+            self.save_reading(self.at(minutes), value)
+        latest = list(LatestReading.objects.values_list('unique_sensor_name', 'timestamp', 'value'))
+        self.assertEqual([(timestamp, value) for _, timestamp, value in latest], [(self.at(60), Decimal(22))])
+
+        LatestReading.objects.all().delete()
+        call_command('rebuild_latest_readings', stdout=StringIO())
+        self.assertEqual(list(LatestReading.objects.values_list('unique_sensor_name', 'timestamp', 'value')), latest)
+
+
+class HistoryCacheTests(DataloggerTestCase):
+    # Times relative to a fixed "now", half-hour aligned so 5 minute rollups and 6 minute chart buckets line up
+    NOW = datetime(2020, 9, 13, 12, 0, tzinfo=timezone.utc)
+
+    def setUp(self):
+        super().setUp()
+        caches[HISTORY_CACHE_ALIAS].clear()
+        self.addCleanup(caches[HISTORY_CACHE_ALIAS].clear)
+        for patcher in (mock.patch('pulogger.models.now', lambda: self.NOW),
+                        mock.patch('pulogger.history_cache.time', lambda: self.NOW.timestamp())):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get_trace(self, hours, points=10):
+        # The (epoch seconds, value) points of the last `hours`; for an hour, 5 minute rollups in 6 minute buckets
+        traces = get_cached_trace_columns('test', self.NOW - timedelta(hours=hours), self.NOW, points)
+        return [(int(timestamp), value) for timestamp, value in zip(traces[0].timestamps, traces[0].values)]
+
+    def test_backfilled_readings_show_in_buckets_already_cached(self):
+        self.save_reading(self.NOW - timedelta(hours=5), 20)
+        self.save_reading(self.NOW - timedelta(hours=1), 22)
+        self.assertEqual(len(self.get_trace(6)), 2)
+
+        self.save_reading(self.NOW - timedelta(hours=3), 21)  # e.g. an SD card import
+        self.assertEqual(len(self.get_trace(6)), 3)
+
+    def test_rollup_bucket_still_filling_is_not_cached(self):
+        self.save_reading(self.NOW - timedelta(minutes=7), 20)
+        self.assertEqual(self.get_trace(1)[-1][1], 20)
+
+        # Into the same 5 minute rollup, recently enough not to count as a backfill
+        self.save_reading(self.NOW - timedelta(minutes=6, seconds=40), 22)
+        self.assertEqual(self.get_trace(1)[-1][1], 21)
+
+
+class GetHistoryTests(DataloggerTestCase):
+    def setUp(self):
+        super().setUp()
+        # Cached buckets are keyed by device name and history version, which each test starts again from
+        caches[HISTORY_CACHE_ALIAS].clear()
+        self.addCleanup(caches[HISTORY_CACHE_ALIAS].clear)
+
+    def get_history(self, date='2020-09-13', to_date=None, headers=None, view='pulogger:gethistory', **params):
+        # 11am on the date to 1pm on to_date (default the same day), with the client at UTC
+        return self.client.get(reverse(view), dict({
+            'device': 'test', 'clientTzOffset': 0, 'from_date': date, 'from_hours': 11, 'from_minutes': 0,
+            'from_is_pm': False, 'to_date': to_date or date, 'to_hours': 1, 'to_minutes': 0, 'to_is_pm': True},
+            **params), **(headers or {}))
+
+    def test_streamed_chart_matches_non_streamed(self):
+        # Over three days, so smoothed, with an outlier to smooth away and an outage to break the line at
+        for idx in range(150):
+            self.save_reading(self.at(-30 * idx), 40 if idx == 75 else 20 + idx % 7)
+        DataloggerOutage.objects.create(datalogger=self.datalogger, started_at=self.at(-3000), ended_at=self.at(-2000))
+
+        for params in ({}, {'points': 40}, {'points': 20, 'downsampling': 'lttb'}):
+            history = self.get_history('2020-09-10', '2020-09-13', **params).content
+            with mock.patch('pulogger.views.STREAM_CHUNK_POINTS', 7):  # so traces span several chunks
+                streamed = self.get_history('2020-09-10', '2020-09-13', stream='true', **params)
+                self.assertEqual(b''.join(streamed.streaming_content), history)
+            self.assertIn(b'"y": null', history)
+
+    def test_live_updates_carry_on_from_the_latest_raw_reading(self):
+        for minutes in (0, 2, 4):
+            self.save_reading(self.at(minutes), 20 + minutes)
+        trace, = self.get_history(format='compact', points=2).json()
+        self.assertEqual(trace['t0'] + sum(trace['dt']), self.at(0).timestamp())  # the last hour's bucket
+        self.assertEqual(trace['last_timestamp'], self.at(4).timestamp())
+
+        def get_updates(cursor_timestamp):
+            cursor = json_dumps({trace['unique_sensor_name']: cursor_timestamp * 1000})
+            return self.client.get(reverse('pulogger:getupdates'), {'device': 'test', 'cursor': cursor}).json()
+
+        self.assertEqual(get_updates(trace['last_timestamp'])['traces'], {})
+        self.save_reading(self.at(6), 26)
+        updates = get_updates(trace['last_timestamp'])
+        self.assertEqual(updates['traces'][trace['unique_sensor_name']]['dataPoints'],
+                         [{'x': self.at(6).timestamp() * 1000, 'y': 26.0}])
+        self.assertEqual(updates['cursor'], {trace['unique_sensor_name']: self.at(6).timestamp() * 1000})
+
+        for cursor in ('{"x": 1e30}', '{"x": -1e18}', '[1]', '{"x": "soon"}'):
+            response = self.client.get(reverse('pulogger:getupdates'), {'device': 'test', 'cursor': cursor})
+            self.assertEqual(response.status_code, 400)
+
+    def test_fleet_history_matches_each_devices_history_in_a_fixed_number_of_queries(self):
+        device_names = ['test']
+        for idx in range(1, 4):
+            datalogger = Datalogger.objects.create(device_name=f'logger{idx}', passcode='ABC123')
+            sensor = Sensor.objects.create(datalogger=datalogger, type=self.sensor_model, sensor_name='s0')
+            for minutes in range(-30, 30, 7):
+                SensorDatum(sensor=sensor, type=self.datum_type, submission_ip='1.1.1.1', timestamp=self.at(minutes),
+                            value=Decimal(20 + idx + minutes % 3)).save()
+            device_names.append(datalogger.device_name)
+        for minutes in range(-30, 30, 5):
+            self.save_reading(self.at(minutes), 20 + minutes % 4)
+        DataloggerOutage.objects.create(datalogger=self.datalogger, started_at=self.at(-20), ended_at=self.at(0))
+
+        def get_fleet_history(device_names):
+            # Uncached, so every device's buckets are queried
+            caches[HISTORY_CACHE_ALIAS].clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.get_history(view='pulogger:getfleethistory', devices=','.join(device_names), points=7)
+            return response.json(), len(queries)
+
+        get_fleet_history(device_names)  # loads the metadata cache
+        fleet_history, query_count = get_fleet_history(device_names)
+        for device_name in device_names:
+            caches[HISTORY_CACHE_ALIAS].clear()
+            self.assertEqual(fleet_history[device_name],
+                             self.get_history(device=device_name, format='compact', points=7).json())
+        self.assertTrue(fleet_history['test'][0]['gaps'])
+        # With only the last device's buckets cached by now, the others' are read from before its
+        self.assertEqual(self.get_history(view='pulogger:getfleethistory', devices=','.join(device_names),
+                                          points=7).json(), fleet_history)
+        self.assertEqual(get_fleet_history(['test'])[1], query_count)
+
+    def test_fleet_history_is_keyed_by_each_requested_device(self):
+        for minutes in (0, 10, 20):
+            self.save_reading(self.at(minutes), 20 + minutes)
+
+        fleet_history = self.get_history(view='pulogger:getfleethistory', devices='test,,missing').json()
+        self.assertEqual(list(fleet_history), ['test', 'missing'])
+        self.assertEqual(fleet_history['missing'], [])
+        trace, = fleet_history['test']
+        self.assertEqual((trace['sensor_name'], trace['type'], trace['v']), ('s0', 'temperature', [2000, 3000, 4000]))
+        self.assertEqual(trace['last_timestamp'], self.at(20).timestamp())
+
+        self.assertEqual(self.get_history(view='pulogger:getfleethistory', devices='test', format='csv').content,
+                         b'invalid request format')
+
+    def test_points_limit_the_chart_with_either_downsampler(self):
+        for idx in range(60):
+            self.save_reading(self.at(2 * idx - 60), 20 + idx % 5)
+
+        self.assertEqual(len(json_loads(self.get_history().content)[0]['dataPoints']), 60)
+        for params in ({'points': 10}, {'points': 10, 'downsampling': 'lttb'}):
+            data_points = json_loads(self.get_history(**params).content)[0]['dataPoints']
+            self.assertLessEqual(len(data_points), 10)
+            self.assertEqual(data_points[0]['x'], self.at(-60).timestamp() * 1000)
+
+    def test_csv_export_pages_through_readings_sharing_a_timestamp(self):
+        other_sensor = Sensor.objects.create(datalogger=self.datalogger, type=self.sensor_model, sensor_name='s1')
+        for minutes in range(7):
+            self.save_reading(self.at(minutes), 20 + minutes)
+            SensorDatum(sensor=other_sensor, type=self.datum_type, submission_ip='1.1.1.1', timestamp=self.at(minutes),
+                        value=Decimal(10 + minutes)).save()
+
+        chunks = list(iter_sensor_data_chunks(self.datalogger, self.at(0), self.at(60), chunk_size=3))
+        self.assertEqual([len(chunk) for chunk in chunks], [3, 3, 3, 3, 2])
+        self.assertEqual([row[0] for chunk in chunks for row in chunk],
+                         list(SensorDatum.objects.order_by('timestamp', 'id').values_list('id', flat=True)))
+
+        response = self.get_history(format='csv')
+        self.assertTrue(response['Content-Disposition'].endswith('.csv"'))
+        export = b''.join(response.streaming_content)
+        self.assertEqual(export.splitlines()[:3], [b'timestamp,sensor_name,type,value',
+                                                   b'2020-09-13T12:00:00+00:00,s0,temperature,20.00',
+                                                   b'2020-09-13T12:00:00+00:00,s1,temperature,10.00'])
+        self.assertEqual(len(export.splitlines()), 15)
+
+        response = self.get_history(format='csv_gzip')
+        self.assertTrue(response['Content-Disposition'].endswith('.csv.gz"'))
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), export)
+
+    def test_unchanged_history_is_not_modified(self):
+        self.save_reading(self.at(0), 20)
+        etag = self.get_history()['ETag']
+        response = self.get_history(headers={'HTTP_IF_NONE_MATCH': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual((response['ETag'], response['Cache-Control']), (etag, 'public, max-age=300'))
+
+    def test_metadata_change_changes_etag(self):
+        self.save_reading(self.at(0), 20)
+        etag = self.get_history()['ETag']
+
+        self.datum_type.smoothing_threshold = 0.5
+        self.datum_type.save()
+        response = self.get_history(headers={'HTTP_IF_NONE_MATCH': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_backfill_into_historical_window_changes_etag(self):
+        self.save_reading(self.at(0), 20)
+        etag = self.get_history()['ETag']
+
+        self.save_reading(self.at(30), 21)
+        response = self.get_history(headers={'HTTP_IF_NONE_MATCH': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_historical_window_is_only_reused_briefly(self):
+        response = self.get_history()
+        self.assertEqual(response['Cache-Control'], 'public, max-age=300')
+        self.assertNotIn('Last-Modified', response)
+
+        response = self.get_history(date=datetime.now(tz=timezone.utc).date().isoformat())
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+
+
+class DownsamplingTests(DataloggerTestCase):
+    def test_database_buckets_match_in_memory_bucketing(self):
+        for idx in range(37):  # within the hour
+            self.save_reading(self.START + timedelta(seconds=97 * idx), 20 + idx % 5)
+
+        bucketed, = get_trace_columns(get_history_bucket_values('test', self.at(0), self.at(60), None, 600))
+        raw = SensorDatum.objects.order_by('timestamp')
+        expected = bucket_trace_columns(bucketed.unique_sensor_name, bucketed.type_id,
+                                        np.array([int(datum.timestamp.timestamp()) for datum in raw]),
+                                        np.array([float(datum.value) for datum in raw]), 600)
+
+        self.assertEqual(bucketed.timestamps.tolist(), expected.timestamps.tolist())
+        np.testing.assert_allclose(bucketed.values, expected.values)
+
+    def test_lttb_keeps_the_ends_and_the_peak(self):
+        data = [{'x': x, 'y': 20 + x % 7 / 10} for x in range(100)]
+        data[50]['y'] = 40
+
+        sampled = largest_triangle_three_buckets(data, 10)
+        self.assertEqual(len(sampled), 10)
+        self.assertIs(sampled[0], data[0])
+        self.assertIs(sampled[-1], data[-1])
+        self.assertIn(data[50], sampled)
+        self.assertEqual(sorted(sampled, key=itemgetter('x')), sampled)
+
+
+class CompactEncodingTests(TestCase):
+    def setUp(self):
+        self.trace = TraceColumns('s0;1;2', 2, np.array([1600000000, 1600000060, 1600003600, 1600090000]),
+                                  np.array([20.5, -3.25, 99.99, 0.01]))
+        self.trace.gap_indexes = np.array([2])
+
+    def test_compact_json_round_trips(self):
+        compact, = json_loads(encode_compact_json([self.trace], {2: 'temperature'},
+                                                  lambda sensor_name, datum_type: {'name': sensor_name}))
+
+        self.assertEqual((compact['unique_sensor_name'], compact['type']), ('s0;1;2', 'temperature'))
+        self.assertEqual(compact['gaps'], [2])
+        self.assertEqual((compact['t0'] + np.cumsum(compact['dt'])).tolist(), self.trace.timestamps.tolist())
+        np.testing.assert_allclose(np.array(compact['v']) / compact['scale'], self.trace.values)
+
+    def test_compact_binary_round_trips(self):
+        encoded = encode_compact_binary([self.trace], {2: 'temperature'})
+
+        self.assertEqual(encoded[:4], COMPACT_BINARY_MAGIC)
+        trace_count, scale = struct.unpack_from('<HH', encoded, 4)
+        offset = 8
+        names = []
+        for _ in range(2):
+            length, = struct.unpack_from('<H', encoded, offset)
+            names.append(encoded[offset + 2:offset + 2 + length].decode())
+            offset += 2 + length
+        t0, count = struct.unpack_from('<qI', encoded, offset)
+        offset += 12
+        deltas = np.frombuffer(encoded, dtype='<i4', count=count, offset=offset)
+        values = np.frombuffer(encoded, dtype='<i4', count=count, offset=offset + 4 * count)
+
+        self.assertEqual((trace_count, names, len(encoded)), (1, ['s0', 'temperature'], offset + 8 * count))
+        self.assertEqual((t0 + np.cumsum(deltas)).tolist(), self.trace.timestamps.tolist())
+        np.testing.assert_allclose(values / scale, self.trace.values)
+
+
+class SmoothingTests(TestCase):
+    def test_mask_keeps_the_points_the_per_row_filter_kept(self):
+        # Minute readings with spikes, runs of spikes and gaps past the stale time
+        rng = np.random.RandomState(0)
+        timestamps = 1600000000 + np.cumsum(np.where(rng.rand(5000) < 0.002, 7 * 3600, 60))
+        values = np.round(20 + np.cumsum(rng.normal(0, 0.05, 5000)), 2)
+        spikes = rng.rand(5000) < 0.05
+        values[spikes] += np.round(rng.normal(0, 3, spikes.sum()), 2)
+
+        raw_data = [{'timestamp': datetime.fromtimestamp(timestamp, tz=timezone.utc), 'value': Decimal(str(value))}
+                    for timestamp, value in zip(timestamps.tolist(), values.tolist())]
+        keep = get_smoothing_mask(timestamps, values, 0.2)
+
+        self.assertLess(keep.sum(), len(keep))
+        self.assertEqual((timestamps[keep] * 1000).tolist(),
+                         [datum['x'] for datum in legacy_smoothing(raw_data, 0.2)])
+        self.assertTrue(get_smoothing_mask(timestamps, values, None).all())
+
+
+class RollupTests(DataloggerTestCase):
+    def write_batch(self, sensor, samples):
+        # samples: (minutes, value), written together as a submission writes them
+        data = [SensorDatum(sensor=sensor, type=self.datum_type, submission_ip='1.1.1.1', timestamp=self.at(minutes),
+                            value=Decimal(value)) for minutes, value in samples]
+        for datum in data:
+            datum.datalogger_id = sensor.datalogger_id
+            datum.unique_sensor_name = SensorDatum.build_unique_sensor_name(sensor.sensor_name, sensor.id,
+                                                                            self.datum_type.id)
+        with transaction.atomic():
+            SensorDatum.objects.bulk_create(data)
+            SensorDatum.record_derived(data)
+
+    def get_rollups(self):
+        return list(SensorDatumRollup.objects.order_by('unique_sensor_name', 'resolution', 'bucket_start')
+                    .values_list('unique_sensor_name', 'resolution', 'bucket_start', 'minimum', 'maximum', 'mean',
+                                 'count'))
+
+    def test_writes_merge_into_their_buckets_at_every_resolution(self):
+        other_sensor = Sensor.objects.create(datalogger=self.datalogger, type=self.sensor_model, sensor_name='s1')
+        self.write_batch(self.sensor, [(0, 20), (1, 22), (6, 30)])
+        self.write_batch(other_sensor, [(0, 10)])  # the same bucket starts, in another series
+        self.write_batch(self.sensor, [(2, 27), (61, 25)])
+
+        five_minutes = SensorDatumRollup.objects.get(sensor=self.sensor, resolution=SensorDatumRollup.FIVE_MINUTES,
+                                                     bucket_start=self.at(0))
+        self.assertEqual((five_minutes.minimum, five_minutes.maximum, five_minutes.mean, five_minutes.count),
+                         (20, 27, 23, 3))
+        hourly = SensorDatumRollup.objects.get(sensor=self.sensor, resolution=SensorDatumRollup.HOURLY,
+                                               bucket_start=self.at(0))
+        self.assertEqual((hourly.minimum, hourly.maximum, hourly.mean, hourly.count), (20, 30, Decimal('24.75'), 4))
+        daily = SensorDatumRollup.objects.get(sensor=self.sensor, resolution=SensorDatumRollup.DAILY)
+        self.assertEqual((daily.mean, daily.count), (Decimal('24.8'), 5))
+        self.assertEqual(SensorDatumRollup.objects.get(sensor=other_sensor, resolution=SensorDatumRollup.DAILY).count,
+                         1)
+
+        # Rebuilding from the raw rows gives the same rollups as were kept up to date write by write
+        rollups = self.get_rollups()
+        call_command('backfill_rollups', stdout=StringIO())
+        self.assertEqual(self.get_rollups(), rollups)
+
+
+@skipUnless(connection.vendor in ('sqlite', 'mysql'), 'EXPLAIN output is only checked for SQLite and MySQL')
+class SensorDatumIndexTests(DataloggerTestCase):
+    # The hot query shapes should each be served by their composite index rather than a table scan
+    def setUp(self):
+        super().setUp()
+        for idx in range(50):
+            self.save_reading(datetime(2020, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=idx), '20.00')
+
+    def assertUsesIndex(self, queryset, index_name):
+        self.assertIn(index_name, queryset.explain())
+
+    def test_most_recent_reading_uses_unique_sensor_name_timestamp_index(self):
+        unique_sensor_name = SensorDatum.build_unique_sensor_name('s0', self.sensor.id, self.datum_type.id)
+        self.assertUsesIndex(SensorDatum.objects.filter(unique_sensor_name=unique_sensor_name).order_by('-timestamp'),
+                             'sensordatum_usn_timestamp')
+
+    def test_sensor_history_uses_sensor_timestamp_index(self):
+        self.assertUsesIndex(SensorDatum.objects.filter(sensor=self.sensor,
+                                                        timestamp__gte=datetime(2020, 1, 1, tzinfo=timezone.utc)),
+                             'sensordatum_sensor_timestamp')
+
+    def test_device_history_uses_datalogger_timestamp_index_without_join(self):
+        queryset = SensorDatum.objects.filter(datalogger=self.datalogger,
+                                              timestamp__gte=datetime(2020, 1, 1, tzinfo=timezone.utc),
+                                              timestamp__lte=datetime(2020, 1, 2, tzinfo=timezone.utc))
+        self.assertUsesIndex(queryset, 'sensordatum_logger_timestamp')
+        self.assertNotIn('JOIN', str(queryset.query))
+
+    def test_denormalised_datalogger_is_set_on_save(self):
+        self.assertFalse(SensorDatum.objects.exclude(datalogger=self.datalogger).exists())
+
+
+class RetentionTests(DataloggerTestCase):
+    # Archiving a month must not change what history and exports return for it
+    def setUp(self):
+        super().setUp()
+        archive_dir = TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        settings_override = override_settings(PULOGGER_ARCHIVE_DIR=archive_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        start = datetime(2020, 1, 31, 12, tzinfo=timezone.utc)
+        for idx in range(48):
+            self.save_reading(start + timedelta(minutes=30 * idx), 20 + idx % 5)
+
+    def get_export(self):
+        return ''.join(iter_csv_chunks('test', datetime(2020, 1, 1, tzinfo=timezone.utc),
+                                       datetime(2020, 3, 1, tzinfo=timezone.utc)))
+
+    def test_archived_readings_are_exported_and_rollups_kept(self):
+        export = self.get_export()
+        rollups = sorted(SensorDatumRollup.objects.values_list('resolution', 'bucket_start', 'count'))
+
+        self.assertEqual(run_retention(datetime.now(timezone.utc) - datetime(2020, 2, 1, tzinfo=timezone.utc)), 24)
+        self.assertEqual(SensorDatum.objects.filter(timestamp__lt=datetime(2020, 2, 1, tzinfo=timezone.utc)).count(), 0)
+        self.assertEqual(self.get_export(), export)
+        self.assertEqual(sorted(SensorDatumRollup.objects.values_list('resolution', 'bucket_start', 'count')), rollups)
+
+    def test_rerun_after_a_crash_before_the_deletes_archives_nothing_twice(self):
+        export = self.get_export()
+        max_age = datetime.now(timezone.utc) - datetime(2020, 2, 1, tzinfo=timezone.utc)
+        with mock.patch('pulogger.retention.delete_archived_rows', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                run_retention(max_age)
+
+        self.assertEqual(run_retention(max_age), 24)
+        self.assertEqual(self.get_export(), export)
+
+
+class IngestTests(DataloggerTestCase):
+    def setUp(self):
+        super().setUp()
+        for sensor_name in ('s1', 's2'):
+            Sensor.objects.create(datalogger=self.datalogger, type=self.sensor_model, sensor_name=sensor_name)
+        get_metadata()
+
+    def ingest_series(self, sensor_name, samples):
+        # samples: (minutes, value), all in one submission
+        return ingest_readings('test', [Reading(sensor_name, 'temperature', Decimal(value), self.at(minutes))
+                                        for minutes, value in samples], '1.1.1.1')
+
+    def test_query_count_does_not_grow_with_the_submission(self):
+        self.ingest_series('s0', [(0, 20)])  # so both submissions below find the logger transmitting
+
+        with CaptureQueriesContext(connection) as one_reading:
+            self.ingest_series('s1', [(0, 20)])
+        with CaptureQueriesContext(connection) as many_readings:
+            self.assertTrue(all(result.success for result in
+                                self.ingest_series('s2', [(30 * idx, 20 + idx) for idx in range(20)])))
+        self.assertEqual(len(many_readings), len(one_reading))
+
+    def test_hysteresis_is_per_type_with_a_default_for_types_without_one(self):
+        pressure = DatumType.objects.create(description='pressure')
+        SensorModelDatumType.objects.create(sensor=self.sensor_model, datum_type=pressure)
+
+        def ingest_pressure(samples):
+            return [result.success for result in ingest_readings('test', [
+                Reading('s0', 'pressure', Decimal(value), self.at(minutes)) for minutes, value in samples], '1.1.1.1')]
+
+        self.assertEqual(ingest_pressure([(0, '50.0'), (1, '50.5'), (2, '50.5')]), [True, True, False])
+        DatumType.objects.filter(id=pressure.id).update(update_hysteresis=1)
+        MetadataVersion.bump()
+        with override_settings(PULOGGER_METADATA_CHECK_SECONDS=0):
+            self.assertEqual(ingest_pressure([(3, '51.0'), (4, '51.6')]), [False, True])
+
+    def test_one_submission_applies_hysteresis_as_separate_ones_would(self):
+        # Accepted, similar within the lockout, different after 50s, different within 50s, similar after 29m50s
+        samples = [(0, '20.0'), (0.5, '20.1'), (1, '21.0'), (1.5, '25.0'), (31, '21.05')]
+
+        batched = self.ingest_series('s1', samples)
+        separate = [result for sample in samples for result in self.ingest_series('s2', [sample])]
+
+        self.assertEqual([result.success for result in batched], [True, False, True, False, True])
+        self.assertEqual([result.success for result in separate], [result.success for result in batched])
+
+
+class SubmitBatchTests(DataloggerTestCase):
+    def submit(self, *samples):
+        body = ''.join(f'{{"timestamp": {timestamp}, "sensors": ["s0"], "types": {types}, "values": [{value}]}}\n'
+                       for timestamp, types, value in samples)
+        return self.client.post(reverse('pulogger:submitbatch') + '?device=test', data=body,
+                                content_type='application/x-ndjson')
+
+    def test_buffered_samples_are_logged_in_time_order_with_hysteresis(self):
+        response = self.submit((1600003600, '["temperature"]', 22), (1600000000, '["temperature"]', 21),
+                               (1600000060, '["temperature"]', 21))
+
+        self.assertEqual(response.content, b'2 1')
+        self.assertEqual(list(SensorDatum.objects.order_by('timestamp').values_list('value', flat=True)),
+                         [Decimal(21), Decimal(22)])
+
+    def test_malformed_line_rejects_the_whole_submission(self):
+        for malformed in ((1600000060, '[]', 21), (1600000060, '["temperature"]', 'NaN'),
+                          (1600000060, '["temperature"]', '-Infinity')):
+            response = self.submit((1600000000, '["temperature"]', 21), malformed)
+
+            self.assertEqual((response.status_code, response.content), (400, b'malformed line 2'))
+            self.assertFalse(SensorDatum.objects.exists())
+
+
+class BulkImportTests(DataloggerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.save_reading(self.at(0), 21)
+
+    def test_dump_is_filtered_like_live_submissions_and_can_be_imported_again(self):
+        dump = ['timestamp,sensor_name,type,value',
+                '2020-09-13T11:59:00+00:00,s0,temperature,20.9',  # new
+                '1599998400,s0,temperature,21',  # already stored
+                '1599998460,s0,temperature,21.1',  # within the hysteresis band of the stored reading
+                '1599998520,s0,temperature,123.45',  # invalid
+                '1599998580,s1,temperature,21',  # no such sensor
+                'not a reading',
+                '1600000200,s0,temperature,21.1']  # after the lockout
+
+        self.assertEqual(import_readings('test', iter_csv_readings(dump), chunk_size=4),
+                         ImportResult(read=7, imported=2, duplicates=1, ignored=1, rejected=3))
+        self.assertEqual(import_readings('test', iter_csv_readings(dump), chunk_size=4),
+                         ImportResult(read=7, imported=0, duplicates=3, ignored=1, rejected=3))
+        self.assertEqual(SensorDatumRollup.objects.get(resolution=SensorDatumRollup.DAILY).count, 3)
+
+
+class IngestQueueTests(DataloggerTestCase):
+    def setUp(self):
+        super().setUp()
+        queue_dir = TemporaryDirectory()
+        self.addCleanup(queue_dir.cleanup)
+        settings_override = override_settings(PULOGGER_INGEST_MODE='queued',
+                                              PULOGGER_INGEST_QUEUE_PATH=f'{queue_dir.name}/queue.sqlite3')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(lambda: ingest_queue._local.__dict__.pop('connection').close())
+
+    def test_queued_readings_are_written_by_the_drainer(self):
+        timestamp = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        results = ingest_queue.submit_readings('test', [Reading('s0', 'temperature', Decimal(21), timestamp),
+                                                        Reading('s1', 'temperature', Decimal(21), timestamp)],
+                                               '1.1.1.1')
+
+        self.assertEqual([result.success for result in results], [True, False])
+        self.assertFalse(SensorDatum.objects.exists())
+        self.assertEqual(ingest_queue.get_queue_stats()['depth'], 1)
+
+        self.assertEqual(ingest_queue.drain_queue(), 1)
+        self.assertEqual(SensorDatum.objects.get().timestamp, timestamp)
+        self.assertEqual(ingest_queue.get_queue_stats()['depth'], 0)
+
+    def test_each_queued_submission_counts_as_a_transmission(self):
+        for minutes in (0, 5, 35):
+            ingest_queue.submit_readings('test', [Reading('s0', 'temperature', Decimal(20 + minutes),
+                                                          self.at(minutes))], '1.1.1.1')
+        with ingest_queue.get_queue_connection() as queue:
+            # As if each had been received at its reading's time
+            queue.execute('UPDATE queued_reading SET enqueued_at = timestamp')
+
+        ingest_queue.drain_queue()
+        self.assertEqual(list(DataloggerOutage.objects.values_list('started_at', 'ended_at')),
+                         [(self.at(5), self.at(35))])
+
+    def test_a_submission_failing_to_ingest_is_parked_without_blocking_the_rest(self):
+        for minutes, submission_ip in ((0, '6.6.6.6'), (0, '1.1.1.1')):
+            ingest_queue.submit_readings('test', [Reading('s0', 'temperature', Decimal(20), self.at(minutes))],
+                                         submission_ip)
+
+        def ingest_failing_one(device_name, readings, submission_ip, received_at=None):
+            if submission_ip == '6.6.6.6':
+                raise KeyError('pressure')
+            return ingest_readings(device_name, readings, submission_ip, received_at)
+
+        with mock.patch('pulogger.ingest_queue.ingest_readings', ingest_failing_one), \
+                self.assertLogs('pulogger.ingest_queue', 'ERROR'):
+            self.assertEqual(ingest_queue.drain_queue(), 2)
+        self.assertEqual(SensorDatum.objects.get().submission_ip, '1.1.1.1')
+        stats = ingest_queue.get_queue_stats()
+        self.assertEqual((stats['depth'], stats['parked']), (0, 1))
+
+    @override_settings(PULOGGER_METRICS_TOKEN='secret')
+    def test_status_is_authorised_and_reports_direct_mode(self):
+        url = reverse('pulogger:ingestqueuestatus')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer secret').json()['depth'], 0)
+        with override_settings(PULOGGER_INGEST_MODE='direct', PULOGGER_INGEST_QUEUE_PATH='/nonexistent/queue'):
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer secret').json(), {'enabled': False})
+
+
+@override_settings(PULOGGER_METRICS_SAMPLE_RATE=1.0, PULOGGER_METRICS_TOKEN='secret')
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        metrics.reset_metrics()
+        self.addCleanup(metrics.reset_metrics)
+
+    def test_histogram_quantiles_interpolate_within_buckets(self):
+        histogram = metrics.Histogram((1, 2, 4))
+        for value in (0.5, 1.5, 1.5, 3):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.counts, [1, 2, 1, 0])
+        self.assertEqual(histogram.get_quantile(0.5), 1.5)
+
+    def test_metrics_endpoint_requires_token_and_reports_requests(self):
+        self.client.get(reverse('pulogger:requestservertime'))
+
+        self.assertEqual(self.client.get(reverse('pulogger:metrics')).status_code, 403)
+        response = self.client.get(reverse('pulogger:metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertIn('pulogger_request_duration_seconds_count{view="pulogger:requestservertime"} 1',
+                      response.content.decode())
+
+
+class FleetOverviewTests(TestCase):
+    def test_overview_query_count_does_not_grow_with_the_fleet(self):
+        sensor_model = SensorModel.objects.create(type='DHT22')
+        datum_type = DatumType.objects.create(description='temperature')
+        SensorModelDatumType.objects.create(sensor=sensor_model, datum_type=datum_type)
+        for idx in range(5):
+            datalogger = Datalogger.objects.create(device_name=f'logger{idx}', passcode='ABC123')
+            sensor = Sensor.objects.create(datalogger=datalogger, type=sensor_model, sensor_name='s0')
+            SensorDatum(sensor=sensor, type=datum_type, submission_ip='1.1.1.1', value=Decimal(20 + idx),
+                        timestamp=datetime(2020, 1, 1, tzinfo=timezone.utc)).save()
+        self.client.get(reverse('pulogger:fleetoverview'))  # loads the metadata cache
+
+        with self.assertNumQueries(2):
+            overview = self.client.get(reverse('pulogger:fleetoverview')).json()
+
+        self.assertEqual([(datalogger['device_name'], datalogger['latest'][0]['y']) for datalogger in overview],
+                         [(f'logger{idx}', 20 + idx) for idx in range(5)])
+
+
+class SensorDayStatisticsTests(DataloggerTestCase):
+    DATUM_TYPE = 'humidity'
+
+    def test_statistics_and_time_in_range_are_split_across_days(self):
+        self.datum_type.range_minimum, self.datum_type.range_maximum = 62, 70
+        self.datum_type.save()
+
+        # 65 (in range) from 23:30 until 68 (in range) at 00:15, then 75 (out of range) from 00:45 until 01:00
+        for timestamp, value in ((datetime(2020, 1, 1, 23, 30), 65), (datetime(2020, 1, 2, 0, 15), 68),
+                                 (datetime(2020, 1, 2, 0, 45), 75), (datetime(2020, 1, 2, 1, 0), 66)):
+            self.save_reading(timestamp.replace(tzinfo=timezone.utc), value)
+
+        first_day, second_day = SensorDayStatistics.objects.order_by('day')
+        self.assertEqual((first_day.count, first_day.covered_seconds, first_day.in_range_seconds), (1, 1800, 1800))
+        self.assertEqual((second_day.count, second_day.minimum, second_day.maximum, second_day.sum),
+                         (3, Decimal(66), Decimal(75), 209))
+        self.assertEqual((second_day.covered_seconds, second_day.in_range_seconds), (3600, 2700))
+
+    def test_late_readings_are_counted_in_time_in_range(self):
+        self.datum_type.range_minimum, self.datum_type.range_maximum = 62, 70
+        self.datum_type.save()
+        for timestamp, value in ((datetime(2020, 1, 1, 23, 30), 65), (datetime(2020, 1, 2, 0, 15), 68),
+                                 (datetime(2020, 1, 2, 0, 45), 75), (datetime(2020, 1, 2, 1, 0), 66)):
+            self.save_reading(timestamp.replace(tzinfo=timezone.utc), value)
+
+        # Out of range from 23:45, into the next day, and from 00:35, splitting an in-range interval
+        self.save_reading(datetime(2020, 1, 1, 23, 45, tzinfo=timezone.utc), 75)
+        self.save_reading(datetime(2020, 1, 2, 0, 35, tzinfo=timezone.utc), 80)
+
+        def get_statistics():
+            return list(SensorDayStatistics.objects.order_by('day')
+                        .values_list('day', 'count', 'covered_seconds', 'in_range_seconds'))
+
+        statistics = get_statistics()
+        self.assertEqual([(count, covered, in_range) for _, count, covered, in_range in statistics],
+                         [(2, 1800, 900), (4, 3600, 1200)])
+        call_command('rebuild_daily_statistics', stdout=StringIO())
+        self.assertEqual(get_statistics(), statistics)
+
+
+class RingBufferTests(TestCase):
+    def setUp(self):
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.ring_buffer = RingBuffer(f'{directory.name}/ring-buffer')
+        self.ring_buffer.rebuild([('s0;1;1', 1, 1, 1000, 20.0), ('s0;1;1', 1, 1, 1100, 21.0)], built_since=900)
+
+    def test_readings_are_kept_in_order_without_duplicates(self):
+        self.ring_buffer.append([('s0;1;1', 1, 1, 1200, 22.0), ('s0;1;1', 1, 1, 1050, 20.5),
+                                 ('s0;1;1', 1, 1, 1100, 21.0), ('s1;1;1', 1, 1, 1150, 18.0)])
+
+        series = self.ring_buffer.read(1, 900, 1200)
+        self.assertEqual(series['s0;1;1'][1].tolist(), [1000, 1050, 1100, 1200])
+        self.assertEqual(series['s0;1;1'][2].tolist(), [20.0, 20.5, 21.0, 22.0])
+        self.assertEqual(series['s1;1;1'][1].tolist(), [1150])
+        self.assertIsNone(self.ring_buffer.read(1, 800, 1200))  # before the buffer was built from
+
+    def test_evicted_readings_are_no_longer_covered(self):
+        self.ring_buffer.append([('s0;1;1', 1, 1, 2000 + idx, 20.0) for idx in range(RING_BUFFER_CAPACITY)])
+
+        self.assertIsNone(self.ring_buffer.read(1, 1050, 9999))  # 1000 and 1100 were evicted
+        self.assertEqual(len(self.ring_buffer.read(1, 1101, 9999)['s0;1;1'][1]), RING_BUFFER_CAPACITY)
+
+    def test_grows_for_new_series_seen_by_other_processes(self):
+        other_process = RingBuffer(self.ring_buffer.path)
+        self.ring_buffer.append([(f's{idx};2;1', 2, 1, 1000, 20.0) for idx in range(RING_BUFFER_MIN_SERIES * 3)])
+
+        self.assertEqual(len(other_process.read(2, 900, 1200)), RING_BUFFER_MIN_SERIES * 3)
+        self.assertEqual(len(other_process.read(1, 900, 1200)['s0;1;1'][1]), 2)
+
+    @override_settings(PULOGGER_RING_BUFFER_MAX_SERIES=RING_BUFFER_MIN_SERIES)
+    def test_only_a_datalogger_with_a_series_past_the_limit_falls_back(self):
+        self.ring_buffer.append([(f's{idx};2;1', 2, 1, 1000, 20.0) for idx in range(RING_BUFFER_MIN_SERIES)])
+
+        self.assertIsNone(self.ring_buffer.read(2, 900, 1200))
+        self.assertEqual(len(self.ring_buffer.read(1, 900, 1200)['s0;1;1'][1]), 2)
+
+
+class AlertTests(DataloggerTestCase):
+    DATUM_TYPE = 'humidity'
+
+    def test_threshold_rule_fires_and_resolves_as_readings_arrive(self):
+        rule = AlertRule.objects.create(sensor=self.sensor, type=self.datum_type, condition=AlertRule.ABOVE,
+                                        threshold=70)
+
+        self.ingest(0, 65)
+        self.assertFalse(AlertState.objects.exists())
+        self.ingest(10, 75)
+        self.assertTrue(AlertState.objects.get(rule=rule, sensor=self.sensor).is_firing)
+        self.ingest(20, 66)
+        self.assertFalse(AlertState.objects.get(rule=rule, sensor=self.sensor).is_firing)
+
+    def test_no_data_rule_follows_last_transmission(self):
+        rule = AlertRule.objects.create(sensor_model=self.sensor.type, type=self.datum_type,
+                                        condition=AlertRule.NO_DATA, minutes=30)
+        self.ingest(0, 65)
+
+        self.assertEqual(sweep_no_data_alerts(datetime(2020, 9, 13, 12, 20, tzinfo=timezone.utc)), [])
+        self.assertEqual(len(sweep_no_data_alerts(datetime(2020, 9, 13, 12, 40, tzinfo=timezone.utc))), 1)
+        self.assertTrue(AlertState.objects.get(rule=rule, sensor=self.sensor).is_firing)
+
+        self.ingest(45, 66)
+        self.assertFalse(AlertState.objects.get(rule=rule, sensor=self.sensor).is_firing)
+        self.assertEqual(sweep_no_data_alerts(datetime(2020, 9, 13, 12, 50, tzinfo=timezone.utc)), [])
+
+    @override_settings(PULOGGER_ALERT_NOTIFIERS=['pulogger.alerts.WebhookNotifier'])
+    def test_slow_webhook_does_not_hold_up_ingest(self):
+        AlertRule.objects.create(sensor=self.sensor, type=self.datum_type, condition=AlertRule.ABOVE, threshold=70)
+        webhook_called, webhook_released = Event(), Event()
+
+        def slow_urlopen(request, timeout):
+            webhook_called.set()
+            webhook_released.wait(alerts.WEBHOOK_TIMEOUT)
+            return mock.MagicMock()
+
+        # TestCase never commits, so on_commit callbacks are run straight away
+        with mock.patch('pulogger.alerts.urlopen', slow_urlopen), \
+                mock.patch('django.db.transaction.on_commit', lambda callback: callback()):
+            started = time()
+            self.ingest(0, 75)
+            self.assertLess(time() - started, 1)
+            self.assertTrue(webhook_called.wait(1))
+            webhook_released.set()
+            alerts._notification_queue.join()
+
+
+class ListenerTests(DataloggerTestCase):
+    def test_lines_are_checked_then_written_in_a_batch(self):
+        listener = Listener()
+        get_metadata()
+        with override_settings(PULOGGER_METADATA_CHECK_SECONDS=0), self.assertNumQueries(0):
+            # Even when the snapshot is due a version check, which is left to the worker thread
+            self.assertEqual(listener.handle_line(b'test ABC123 1600000000 s0,temperature,21.5 s9,temperature,1',
+                                                  '1.1.1.1'), 'ok 1 1')
+        self.assertEqual(listener.handle_line(b'test WRONG 1600000060 s0,temperature,22', '1.1.1.1'),
+                         'error unknown device or wrong passcode')
+        self.assertEqual(listener.handle_line(b'test ABC123 soon s0,temperature,22', '1.1.1.1'),
+                         'error malformed timestamp or reading')
+        self.assertEqual(listener.handle_line(b'test ABC123 1600000060 s0,temperature,nan', '1.1.1.1'),
+                         'error malformed timestamp or reading')
+        self.assertFalse(SensorDatum.objects.exists())
+
+        self.assertEqual(listener.write(listener.take_pending()), (1, {}))
+        datum = SensorDatum.objects.get()
+        self.assertEqual((datum.value, datum.submission_ip), (Decimal('21.5'), '1.1.1.1'))
+
+    def test_a_submission_failing_to_write_is_dropped_unless_the_database_is_unavailable(self):
+        listener = Listener()
+
+        def ingest_failing_one(device_name, readings, submission_ip, received_at):
+            if submission_ip == '2.2.2.2':
+                raise ValueError('unexpected')
+            return ingest_readings(device_name, readings, submission_ip, received_at)
+
+        listener.handle_line(b'test ABC123 1600000000 s0,temperature,21.5', '1.1.1.1')
+        listener.handle_line(b'test ABC123 1600000000 s0,humidity,60', '2.2.2.2')
+        with mock.patch('pulogger.listener.ingest_readings', ingest_failing_one), \
+                self.assertLogs('pulogger.listener', 'ERROR'):
+            self.assertEqual(listener.write(listener.take_pending()), (1, {}))
+        self.assertEqual(SensorDatum.objects.get().submission_ip, '1.1.1.1')
+
+        # Whereas readings the database couldn't be reached for are kept, ahead of any received since
+        listener.handle_line(b'test ABC123 1600000060 s0,temperature,22', '1.1.1.1')
+        with mock.patch('pulogger.listener.ingest_readings', side_effect=OperationalError), \
+                self.assertLogs('pulogger.listener', 'ERROR'):
+            asyncio.run(listener.flush())
+        listener.handle_line(b'test ABC123 1600000120 s0,temperature,22.5', '1.1.1.1')
+        readings, _ = listener.pending['test', '1.1.1.1']
+        self.assertEqual([reading.value for reading in readings], [Decimal('22'), Decimal('22.5')])
+        self.assertEqual(listener.pending_count, 2)
+
+
+class OutageTests(DataloggerTestCase):
+    def test_gaps_between_transmissions_are_recorded_as_outages(self):
+        for minutes in (0, 5, 35, 40):
+            self.ingest(minutes, 20 + minutes)
+
+        datalogger = Datalogger.objects.get()
+        self.assertEqual((datalogger.up_since, datalogger.last_transmission), (self.at(35), self.at(40)))
+        outage = DataloggerOutage.objects.get()
+        self.assertEqual((outage.started_at, outage.ended_at), (self.at(5), self.at(35)))
+
+        # Silent again since 12:40, so by 13:00 that's an ongoing outage too
+        outages = get_outages(datalogger.id, self.at(0), self.at(60), at=self.at(60))
+        self.assertEqual(outages, [(self.at(5), self.at(35), False), (self.at(40), self.at(60), True)])
+        self.assertAlmostEqual(get_uptime(outages, self.at(0), self.at(60)), 10 / 60)
+
+        trace = TraceColumns('s0;1;1', 1, np.array([self.at(minutes).timestamp() for minutes in (0, 5, 35, 40)]),
+                             np.array([20., 25, 55, 60]))
+        set_gap_indexes(trace, get_gap_timestamps(outages))
+        self.assertEqual(list(trace.gap_indexes), [2])
@@ -23,7 +23,16 @@ app_name = 'pulogger'
 urlpatterns = [
     path('newview/', views.newview, name='newview'),
     path('getHistory/', views.get_history, name='gethistory'),
+    path('getUpdates/', views.get_updates, name='getupdates'),
+    path('getFleetHistory/', views.get_fleet_history, name='getfleethistory'),
+    path('fleetOverview/', views.get_fleet_overview, name='fleetoverview'),
+    path('getSummary/', views.get_summary, name='getsummary'),
+    path('getUptime/', views.get_uptime_report, name='getuptime'),
+    path('currentConditions/', views.current_conditions, name='currentconditions'),
     path('requestServerTime/', views.request_server_time, name='requestservertime'),
     path('submitdata/', views.submit_data, name='submitdata'),
+    path('submitBatch/', views.submit_batch, name='submitbatch'),
+    path('ingestQueueStatus/', views.ingest_queue_status, name='ingestqueuestatus'),
+    path('metrics', views.metrics, name='metrics'),
     # path('', views.index, name='index')
 ]
\ No newline at end of file
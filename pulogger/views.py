@@ -1,19 +1,34 @@
-from django.core.exceptions import ValidationError, ObjectDoesNotExist
 from django.shortcuts import render, get_object_or_404
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.db.models import Q, Min, Max, Sum
 
 from datetime import datetime, timedelta, timezone
-from math import floor, ceil
+from hashlib import md5
+from math import floor, ceil, sqrt
 from decimal import Decimal
-from json import dumps as json_dumps
+from json import dumps as json_dumps, loads as json_loads
+from functools import reduce
+from itertools import chain
+from operator import or_
 
 from pulogger.forms import DatetimeRangePicker
-from .models import Datalogger, SensorModel, Sensor, DatumType, SensorModelDatumType, SensorDatum
-
-
-class DataTypeMismatchError(Exception):
-    def __init__(self, message):
-        self.message = message
+from .models import Datalogger, SensorModel, Sensor, DatumType, SensorModelDatumType, SensorDatum, \
+    LatestReading, SensorDayStatistics
+from .ingest import Reading, MalformedSubmissionError, parse_batch_submission, decompress_submission
+from .ingest_queue import IngestQueueFullError, submit_readings, get_queue_stats, is_queued_ingest_enabled
+from .metrics import is_metrics_request_authorised, render_prometheus
+from .metadata import get_metadata
+from .encoding import smooth_trace_columns, encode_compact_json, encode_compact_binary, get_compact_traces, \
+    set_gap_indexes
+from .export import iter_csv_chunks, iter_gzipped
+from .downsampling import get_points_per_trace, largest_triangle_three_buckets, \
+    LTTB_OVERSAMPLING, get_history_resolution
+from .history_cache import get_cached_trace_columns, get_devices_cached_trace_columns
+from .outages import get_outages, get_dataloggers_outages, get_uptime, get_gap_timestamps
 
 
 def parse_uri_datetime(ms_since_epoch):
@@ -67,98 +82,83 @@ def get_filter_end_time(request):
     return filter_end_time
 
 
-# def prepare_data_as_csv(readings):
-#     column_headings = get_column_headings(readings)
-#     csv_header = ','.join(column_headings) + '\n'
-#     csv_data = '\n'.join(reading_to_csv_row(reading, column_headings) for reading in readings)
-#
-#     return csv_header + csv_data
-
+def get_canvasjs_trace_definition(sensor_name, datum_type):
+    if datum_type == 'temperature':
+        line_color = 'IndianRed'
+        axis_y_type = 'primary'
+        x_value_format_string = 'YYYY-MM-DD HH:mm:ss'
+        y_value_format_string = '#.#°C'
+    elif datum_type == 'humidity':
+        line_color = 'CadetBlue'
+        axis_y_type = 'secondary'
+        x_value_format_string = 'YYYY-MM-DD HH:mm:ss'
+        y_value_format_string = "#'%'"
+    else:
+        line_color = 'Black'
+        axis_y_type = 'primary'
+        x_value_format_string = 'YYYY-MM-DD HH:mm:ss'
+        y_value_format_string = '#'
 
-# def reading_to_csv_row(reading, columns):
-#     return ','.join(str(reading[column]) for column in columns)
+    return {
+        "type": "line",
+        "color": line_color,
+        "axisYType": axis_y_type,
+        "name": f'{sensor_name} ({datum_type})',
+        "showInLegend": True,
+        "markerSize": 0,
+        "xValueFormatString": x_value_format_string,
+        "yValueFormatString": y_value_format_string,
+        "xValueType": "dateTime",
+        "dataPointsType": datum_type,
+    }
 
 
 def prepare_data_for_canvasjs(trace_data):
     trace_pyjsons = []
 
     for trace in trace_data:
-
-        if trace['type'] == 'temperature':
-            line_color = 'IndianRed'
-            axis_y_type = 'primary'
-            x_value_format_string = 'YYYY-MM-DD HH:mm:ss'
-            y_value_format_string = '#.#°C'
-        elif trace['type'] == 'humidity':
-            line_color = 'CadetBlue'
-            axis_y_type = 'secondary'
-            x_value_format_string = 'YYYY-MM-DD HH:mm:ss'
-            y_value_format_string = "#'%'"
-        else:
-            line_color = 'Black'
-            axis_y_type = 'primary'
-            x_value_format_string = 'YYYY-MM-DD HH:mm:ss'
-            y_value_format_string = '#'
-
         # Add the trace definition
-        trace_pyjsons.append({
-            "type": "line",
-            "color": line_color,
-            "axisYType": axis_y_type,
-            "name": f'{trace["sensor_name"]} ({trace["type"]})',
-            "showInLegend": True,
-            "markerSize": 0,
-            "xValueFormatString": x_value_format_string,
-            "yValueFormatString": y_value_format_string,
-            "xValueType": "dateTime",
-            "dataPointsType": trace['type'],
-            "dataPoints": trace['data']
-        })
+        trace_pyjson = get_canvasjs_trace_definition(trace['sensor_name'], trace['type'])
+        trace_pyjson['dataPoints'] = trace['data']
+        trace_pyjsons.append(trace_pyjson)
 
     trace_json = json_dumps(trace_pyjsons)
 
     return trace_json
 
 
-def get_data_lists(raw_data, smoothing=False):
-    def is_not_outlier(datum, data_lists_by_sensorid):
-
-        if not smoothing:
-            return True
-
-        datum_stale_time = timedelta(hours=6)
-        thresholds = {
-            'temperature': 0.2,
-            'humidity': 1.0,
-        }
-
-        try:
-            previous_valid_timestamp = parse_uri_datetime(
-                data_lists_by_sensorid[datum['unique_sensor_name']]['data'][-1]['x'])
-            previous_valid_value = data_lists_by_sensorid[datum['unique_sensor_name']]['data'][-1]['y']
-            is_outlier = abs(previous_valid_value - json_safe(datum['value'])) > thresholds[
-                get_type_mappings()[datum['type_id']]]
-            previous_value_is_old = datum['timestamp'] - previous_valid_timestamp > datum_stale_time
-            return (not is_outlier) or previous_value_is_old
-        except IndexError:
-            return True
-
-    data_lists = []
-    data_lists_by_sensorid = {}
-
-    for datum in raw_data:
-        if datum['unique_sensor_name'] not in data_lists_by_sensorid:
-            data_lists.append(
-                get_structured_data_object(datum, get_type_mappings()))
-            data_lists_by_sensorid.update({datum['unique_sensor_name']: data_lists[-1]})
-
-        if is_not_outlier(datum, data_lists_by_sensorid):
-            data_lists_by_sensorid[datum['unique_sensor_name']]['data'].append({  # todo: turn datalist into a class
-                'x': datetime_to_js_epoch(datum['timestamp']),
-                'y': json_safe(datum['value'])
-            })
+def stream_data_for_canvasjs(trace_data):
+    # Emits the same JSON as prepare_data_for_canvasjs() from the same traces, a chunk of points at a time, so the
+    # response starts before the traces are read and only the current trace's points are held in memory
+    yield '['
+    for trace_idx, trace in enumerate(trace_data):
+        trace_definition = json_dumps(get_canvasjs_trace_definition(trace['sensor_name'], trace['type']))
+        yield ('' if trace_idx == 0 else ', ') + trace_definition[:-1] + ', "dataPoints": ['
+        for chunk_start in range(0, len(trace['data']), STREAM_CHUNK_POINTS):
+            chunk = json_dumps(trace['data'][chunk_start:chunk_start + STREAM_CHUNK_POINTS])
+            yield ('' if chunk_start == 0 else ', ') + chunk[1:-1]
+        yield ']}'
+    yield ']'
+
+
+STREAM_CHUNK_POINTS = 1000
+
 
-    return data_lists
+def get_data_list(trace, metadata, smoothing=False, lttb_points=None, gap_timestamps_ms=()):
+    # One trace's canvas_js points, as both the streamed and non-streamed responses send them
+    if smoothing:
+        smooth_trace_columns(trace, metadata.get_smoothing_threshold(trace.type_id))
+
+    data_points = [{'x': x, 'y': y} for x, y in zip((trace.timestamps * 1000).tolist(), trace.values.tolist())]
+    if lttb_points:
+        data_points = largest_triangle_three_buckets(data_points, lttb_points)
+    insert_gap_points(data_points, gap_timestamps_ms)
+
+    return {
+        'sensor_name': trace.sensor_name,
+        'type': metadata.get_type_mappings()[trace.type_id],
+        'data': data_points,
+    }
 
 
 def json_safe(object):
@@ -170,70 +170,367 @@ def json_safe(object):
 
 
 def get_type_mappings():
-    return ('none', 'temperature', 'humidity')  # todo: generate type mappings dynamically
-
-
-def get_structured_data_object(datum, type_mappings):
-    return {
-        'sensor_name': datum['unique_sensor_name'].split(';')[0],
-        'type': type_mappings[datum['type_id']],
-        'data': []
-    }
+    return get_metadata().get_type_mappings()
 
 
-def get_history(request):  # todo: move all the get_data_lists() logic to the models where it belongs
-    device_name = request.GET['device']
+def get_history_range(request):
+    # The UTC (start, end) picked in the chart modal's DatetimeRangePicker, given in the client's local time
     client_tz_offset = request.GET['clientTzOffset']
 
-    datetime_range = DatetimeRangePicker(request.POST)
+    datetime_range = DatetimeRangePicker(request.POST if request.method == 'POST' else request.GET)
     datetime_range.is_valid()
     datetime_range = datetime_range.get_datetime_range()
 
-    history_start = datetime_range['from'] + timedelta(minutes=int(client_tz_offset))
-    history_end = datetime_range['to'] + timedelta(minutes=int(client_tz_offset))
-    history_duration = history_end - history_start
+    history_start = (datetime_range['from'] + timedelta(minutes=int(client_tz_offset))).replace(tzinfo=timezone.utc)
+    history_end = (datetime_range['to'] + timedelta(minutes=int(client_tz_offset))).replace(tzinfo=timezone.utc)
+
+    return history_start, history_end
 
+
+def get_history(request):  # todo: move all the get_data_list() logic to the models where it belongs
+    device_name = request.GET['device']
+    history_start, history_end = get_history_range(request)
+
+    # Any write to the device, backfills included, or change to the metadata gives every window a new ETag, so
+    # browsers and proxies always revalidate; windows ending well before now only change on a backfill, so they're
+    # also reused unchecked briefly
+    is_historical = history_end < datetime.now(tz=timezone.utc) - HISTORICAL_WINDOW_MARGIN
+    data_version = Datalogger.objects.filter(device_name=device_name).values_list('data_version', flat=True).first()
+    etag = get_history_etag(request, data_version, get_metadata().version)
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = render_history(request, device_name, history_start, history_end)
+
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        if is_historical:
+            patch_cache_control(response, public=True, max_age=HISTORICAL_WINDOW_MAX_AGE)
+        else:
+            patch_cache_control(response, no_cache=True)
+
+    return response
+
+
+HISTORICAL_WINDOW_MARGIN = timedelta(days=1)
+HISTORICAL_WINDOW_MAX_AGE = 60 * 5
+
+
+def get_history_etag(request, data_version, metadata_version):
+    # Identical requests only give different output once the device's data has been written to again, or its
+    # sensors, types, smoothing thresholds and the like changed
+    request_key = '&'.join(f'{key}={value}' for key, value in sorted(chain(request.GET.items(), request.POST.items()))
+                           if key != 'csrfmiddlewaretoken')
+    return quote_etag(md5(f'{data_version}|{metadata_version}|{request_key}'.encode()).hexdigest())
+
+
+def render_history(request, device_name, history_start, history_end):
+    history_duration = history_end - history_start
     requested_format = 'canvas_js' if 'format' not in request.GET else request.GET['format']
 
-    # Downsample the queryset to avoid long fetch and page-load times
-    downsampled_queryset = downsample(
-        SensorDatum.objects.filter(sensor__datalogger__device_name=device_name,
-                                   timestamp__gte=history_start,
-                                   timestamp__lte=history_end)
-    ).order_by('timestamp', 'sensor_id', 'type_id')
+    points = get_points_per_trace(request)
+    use_lttb = request.GET.get('downsampling') == 'lttb'
+
+    if use_lttb:
+        points_fetched = points * LTTB_OVERSAMPLING
+    else:
+        points_fetched = points
 
-    if requested_format == 'csv':
-        # response_str = prepare_data_as_csv(get_data_lists(raw_data))
-        return HttpResponse('CSV Export Temporarily Deprecated')
+    if requested_format in ('csv', 'csv_gzip'):
+        return get_csv_export_response(device_name, history_start, history_end, requested_format == 'csv_gzip')
     elif requested_format == 'canvas_js':
+        # Streamed or not, the traces are read, snapped to bucket boundaries, smoothed, downsampled and broken at
+        # outages the same way, so the two responses are identical
         smoothing = True if history_duration > timedelta(days=3) else False
-        return HttpResponse(prepare_data_for_canvasjs(get_data_lists(downsampled_queryset.values(), smoothing)))
+
+        def iter_data_lists():
+            # Nothing is read until the first trace is wanted, which for a streamed response is once it has started
+            metadata = get_metadata()
+            traces = get_cached_trace_columns(device_name, history_start, history_end, points_fetched)
+            gap_timestamps_ms = [floor(gap_timestamp * 1000) for gap_timestamp in
+                                 get_history_gap_timestamps(device_name, history_start, history_end, points_fetched)]
+            for trace in traces:
+                yield get_data_list(trace, metadata, smoothing, points if use_lttb else None, gap_timestamps_ms)
+
+        if request.GET.get('stream') == 'true':
+            return StreamingHttpResponse(stream_data_for_canvasjs(iter_data_lists()))
+        return HttpResponse(prepare_data_for_canvasjs(iter_data_lists()))
+    elif requested_format in ('compact', 'compact_binary'):
+        type_mappings = get_type_mappings()
+        # Read before the traces, so a reading written in between is sent again by getUpdates rather than never
+        last_timestamps = get_last_timestamps(device_name, history_end) if requested_format == 'compact' else {}
+        traces = get_cached_trace_columns(device_name, history_start, history_end, points_fetched)
+        gap_timestamps = get_history_gap_timestamps(device_name, history_start, history_end, points_fetched) \
+            if requested_format == 'compact' else []
+        prepare_compact_traces(traces, history_duration, gap_timestamps, last_timestamps)
+
+        if requested_format == 'compact':
+            return HttpResponse(encode_compact_json(traces, type_mappings, get_canvasjs_trace_definition),
+                                content_type='application/json')
+        return HttpResponse(encode_compact_binary(traces, type_mappings), content_type='application/octet-stream')
     else:
         return HttpResponse('invalid request format')
 
 
-def request_server_time(request):
-    return HttpResponse(str(datetime.utcnow().timestamp()).split('.')[0])
+def prepare_compact_traces(traces, history_duration, gap_timestamps, last_timestamps):
+    # Smooths a device's traces over ranges of more than 3 days and marks where outages break them and where live
+    # updates carry on from, the same for getHistory and getFleetHistory
+    metadata = get_metadata()
+    for trace in traces:
+        if history_duration > timedelta(days=3):
+            smooth_trace_columns(trace, metadata.get_smoothing_threshold(trace.type_id))
+        set_gap_indexes(trace, gap_timestamps)
+        trace.last_timestamp = last_timestamps.get(trace.unique_sensor_name)
 
 
-def utc_to_local(utc_dt):
-    return utc_dt.replace(tzinfo=timezone.utc).astimezone(tz=None)
+def get_last_timestamps(device_name, history_end):
+    # {unique_sensor_name: epoch seconds} of each trace's latest raw reading, if within the range. A chart's last
+    # point is the start of a bucket that may average later readings too, so getUpdates carries on from this instead.
+    return get_devices_last_timestamps([device_name], history_end)[device_name]
+
+
+def get_devices_last_timestamps(device_names, history_end):
+    # {device name: last timestamps} for several devices in one query
+    metadata = get_metadata()
+    device_by_sensor_id = {sensor.id: device_name for device_name in device_names
+                           for sensor in metadata.get_device_sensors(device_name)}
+    last_timestamps = {device_name: {} for device_name in device_names}
+    for sensor_id, unique_sensor_name, timestamp in LatestReading.objects \
+            .filter(sensor_id__in=device_by_sensor_id, timestamp__lte=history_end) \
+            .values_list('sensor_id', 'unique_sensor_name', 'timestamp'):
+        last_timestamps[device_by_sensor_id[sensor_id]][unique_sensor_name] = int(timestamp.timestamp())
+
+    return last_timestamps
+
+
+def get_history_gap_timestamps(device_name, history_start, history_end, points):
+    # Where the device's outages in the range break its chart lines; outages within a single bucket don't show
+    return get_devices_history_gap_timestamps([device_name], history_start, history_end, points)[device_name]
+
 
+def get_devices_history_gap_timestamps(device_names, history_start, history_end, points):
+    # {device name: gap timestamps} for several devices, with their outages read together
+    metadata = get_metadata()
+    _, bucket_seconds = get_history_resolution(history_end - history_start, points)
+    dataloggers = {device_name: metadata.get_datalogger(device_name) for device_name in device_names}
+    outages = get_dataloggers_outages([datalogger.id for datalogger in dataloggers.values() if datalogger],
+                                      history_start, history_end)
 
-UPPER_DATA_COUNT_LIMIT = 2000
+    return {device_name: get_gap_timestamps(outages[datalogger.id], bucket_seconds) if datalogger else []
+            for device_name, datalogger in dataloggers.items()}
 
 
-def get_filter_usec_threshold(bulk_queryset):
-    bulk_data_count = bulk_queryset.count()
-    if bulk_data_count > UPPER_DATA_COUNT_LIMIT:
-        return UPPER_DATA_COUNT_LIMIT / bulk_data_count * 999999
+def insert_gap_points(data_points, gap_timestamps_ms):
+    # CanvasJS doesn't join a line across a null point. The points are in time order, so each gap's position is
+    # binary searched for rather than found by comparing every point.
+    for gap_x in sorted(gap_timestamps_ms, reverse=True):
+        low, high = 0, len(data_points)
+        while low < high:
+            middle = (low + high) // 2
+            if data_points[middle]['x'] < gap_x:
+                low = middle + 1
+            else:
+                high = middle
+        if 0 < low < len(data_points):
+            data_points.insert(low, {'x': gap_x, 'y': None})
+
+
+def get_csv_export_response(device_name, history_start, history_end, gzipped):
+    # Full-resolution export of every logged reading in the range, streamed in keyset-paginated chunks
+    filename = f'pumidor_export_{device_name}_{history_start:%Y-%m-%dT%H_%M_%SZ}_to_' \
+               f'{history_end:%Y-%m-%dT%H_%M_%SZ}.csv'
+    csv_chunks = iter_csv_chunks(device_name, history_start, history_end)
+
+    if gzipped:
+        response = StreamingHttpResponse(iter_gzipped(csv_chunks), content_type='application/gzip')
+        filename += '.gz'
     else:
-        return 999999
+        response = StreamingHttpResponse(csv_chunks, content_type='text/csv')
+
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
 
+def current_conditions(request):
+    device_name = request.GET['device']
+    type_mappings = get_type_mappings()
+
+    latest_readings = LatestReading.objects.filter(sensor__in=get_metadata().get_device_sensors(device_name)) \
+        .order_by('unique_sensor_name').values('unique_sensor_name', 'type_id', 'timestamp', 'value')
+
+    return HttpResponse(json_dumps([{
+        'sensor_name': reading['unique_sensor_name'].split(';')[0],
+        'type': type_mappings[reading['type_id']],
+        'x': datetime_to_js_epoch(reading['timestamp']),
+        'y': json_safe(reading['value']),
+    } for reading in latest_readings]), content_type='application/json')
+
+
+def get_fleet_history(request):
+    # Compact traces of several devices over the same range, e.g. ?devices=pumidor,garage, keyed by device name,
+    # each the same as getHistory's for it. The queries are shared by all the devices rather than made per device.
+    device_names = [device_name for device_name in request.GET['devices'].split(',') if device_name]
+    history_start, history_end = get_history_range(request)
+    if request.GET.get('format', 'compact') != 'compact':
+        return HttpResponse('invalid request format')
+
+    points = get_points_per_trace(request)
+    last_timestamps = get_devices_last_timestamps(device_names, history_end)
+    traces_by_device = get_devices_cached_trace_columns(device_names, history_start, history_end, points)
+    gap_timestamps = get_devices_history_gap_timestamps(device_names, history_start, history_end, points)
+
+    type_mappings = get_type_mappings()
+    response = {}
+    for device_name, traces in traces_by_device.items():
+        prepare_compact_traces(traces, history_end - history_start, gap_timestamps[device_name],
+                               last_timestamps[device_name])
+        response[device_name] = get_compact_traces(traces, type_mappings, get_canvasjs_trace_definition)
+
+    return HttpResponse(json_dumps(response), content_type='application/json')
+
+
+def get_fleet_overview(request):
+    # Every datalogger's status and latest readings in two queries, however many loggers there are
+    type_mappings = get_type_mappings()
+
+    dataloggers = {datalogger['id']: dict(datalogger, latest=[]) for datalogger in Datalogger.objects.order_by(
+        'device_name').values('id', 'device_name', 'description', 'sensor_count', 'up_since', 'last_transmission')}
+
+    latest_readings = LatestReading.objects.order_by('unique_sensor_name') \
+        .values_list('sensor__datalogger_id', 'unique_sensor_name', 'type_id', 'timestamp', 'value')
+    for datalogger_id, unique_sensor_name, type_id, timestamp, value in latest_readings:
+        dataloggers[datalogger_id]['latest'].append({
+            'sensor_name': unique_sensor_name.split(';')[0],
+            'type': type_mappings[type_id],
+            'x': datetime_to_js_epoch(timestamp),
+            'y': json_safe(value),
+        })
 
-def downsample(bulk_queryset):
-    usec_threshold = get_filter_usec_threshold(bulk_queryset)
-    return bulk_queryset.extra(where=["microsecond(timestamp) <= '{}'".format(usec_threshold)])
+    return HttpResponse(json_dumps([{
+        'device_name': datalogger['device_name'],
+        'description': datalogger['description'],
+        'sensor_count': datalogger['sensor_count'],
+        'up_since': datalogger['up_since'] and datetime_to_js_epoch(datalogger['up_since']),
+        'last_transmission': datalogger['last_transmission'] and datetime_to_js_epoch(datalogger['last_transmission']),
+        'latest': datalogger['latest'],
+    } for datalogger in dataloggers.values()]), content_type='application/json')
+
+
+def get_summary(request):
+    # Min/max/mean/standard deviation and time in range per trace over whole UTC days, from the daily statistics
+    device_name = request.GET['device']
+    history_start, history_end = get_history_range(request)
+    metadata = get_metadata()
+
+    day_statistics = SensorDayStatistics.objects.filter(sensor__in=metadata.get_device_sensors(device_name),
+                                                        day__gte=history_start.date(),
+                                                        day__lte=history_end.date()) \
+        .values('unique_sensor_name', 'type_id') \
+        .annotate(minimum=Min('minimum'), maximum=Max('maximum'), count=Sum('count'), sum=Sum('sum'),
+                  sum_of_squares=Sum('sum_of_squares'), covered_seconds=Sum('covered_seconds'),
+                  in_range_seconds=Sum('in_range_seconds'), first_day=Min('day'), last_day=Max('day')) \
+        .order_by('unique_sensor_name')
+
+    summaries = []
+    for statistics in day_statistics:
+        datum_type = metadata.datum_types[statistics['type_id']]
+        count = statistics['count']
+        mean = statistics['sum'] / count if count else None
+        has_time_in_range = datum_type.has_range() and statistics['covered_seconds']
+
+        summaries.append({
+            'sensor_name': statistics['unique_sensor_name'].split(';')[0],
+            'type': datum_type.description,
+            'from_day': statistics['first_day'].isoformat(),
+            'to_day': statistics['last_day'].isoformat(),
+            'count': count,
+            'minimum': json_safe(statistics['minimum']),
+            'maximum': json_safe(statistics['maximum']),
+            'mean': mean,
+            'standard_deviation': sqrt(max(0, statistics['sum_of_squares'] / count - mean ** 2)) if count else None,
+            'range': [datum_type.range_minimum, datum_type.range_maximum] if datum_type.has_range() else None,
+            'time_in_range': statistics['in_range_seconds'] / statistics['covered_seconds']
+            if has_time_in_range else None,
+        })
+
+    return HttpResponse(json_dumps(summaries), content_type='application/json')
+
+
+def get_uptime_report(request):
+    # Uptime and outages over the range from the outage table, without reading any SensorDatum
+    device_name = request.GET['device']
+    history_start, history_end = get_history_range(request)
+    datalogger = get_object_or_404(Datalogger, device_name=device_name)
+
+    outages = get_outages(datalogger.id, history_start, history_end)
+    # Time yet to come isn't counted as up
+    uptime = get_uptime(outages, history_start, min(history_end, datetime.now(tz=timezone.utc)))
+
+    return HttpResponse(json_dumps({
+        'device_name': device_name,
+        'from': datetime_to_js_epoch(history_start),
+        'to': datetime_to_js_epoch(history_end),
+        'up_since': datalogger.up_since and datetime_to_js_epoch(datalogger.up_since),
+        'last_transmission': datalogger.last_transmission and datetime_to_js_epoch(datalogger.last_transmission),
+        'uptime_percent': None if uptime is None else round(uptime * 100, 3),
+        'outages': [{
+            'from': datetime_to_js_epoch(started_at),
+            'to': datetime_to_js_epoch(ended_at),
+            'ongoing': is_ongoing,
+        } for started_at, ended_at, is_ongoing in outages],
+    }), content_type='application/json')
+
+
+LIVE_UPDATE_DEFAULT_WINDOW = timedelta(minutes=5)
+LIVE_UPDATE_MAX_POINTS = 1000
+
+
+def get_updates(request):
+    # Readings newer than the client's per-trace cursor ({unique_sensor_name: js epoch}), for charts left open
+    device_name = request.GET['device']
+    type_mappings = get_type_mappings()
+    try:
+        cursor = {name: parse_uri_datetime(since) for name, since in
+                  json_loads(request.GET.get('cursor', '{}')).items()}
+    except (ValueError, TypeError, AttributeError, OverflowError, OSError):
+        return HttpResponse('invalid cursor', status=400)
+    default_since = datetime.now(tz=timezone.utc) - LIVE_UPDATE_DEFAULT_WINDOW
+
+    # The latest-reading table tells us which traces have anything new, without touching SensorDatum
+    updated_traces = [Q(unique_sensor_name=name, timestamp__gt=cursor.get(name, default_since)) for name, latest in
+                      LatestReading.objects.filter(sensor__in=get_metadata().get_device_sensors(device_name))
+                          .values_list('unique_sensor_name', 'timestamp')
+                      if latest > cursor.get(name, default_since)]
+
+    traces = {}
+    if updated_traces:
+        new_data = SensorDatum.objects.filter(reduce(or_, updated_traces)).order_by('timestamp') \
+                       .values_list('unique_sensor_name', 'type_id', 'timestamp', 'value')[:LIVE_UPDATE_MAX_POINTS]
+
+        for unique_sensor_name, type_id, timestamp, value in new_data:
+            if unique_sensor_name not in traces:
+                traces[unique_sensor_name] = {
+                    'name': f'{unique_sensor_name.split(";")[0]} ({type_mappings[type_id]})',
+                    'dataPoints': [],
+                }
+            traces[unique_sensor_name]['dataPoints'].append({
+                'x': datetime_to_js_epoch(timestamp),
+                'y': json_safe(value)
+            })
+            cursor[unique_sensor_name] = timestamp
+
+    return HttpResponse(json_dumps({
+        'traces': traces,
+        'cursor': {name: datetime_to_js_epoch(since) for name, since in cursor.items()},
+    }), content_type='application/json')
+
+
+def request_server_time(request):
+    return HttpResponse(str(datetime.utcnow().timestamp()).split('.')[0])
+
+
+def utc_to_local(utc_dt):
+    return utc_dt.replace(tzinfo=timezone.utc).astimezone(tz=None)
 
 
 def get_chart_trace_name(sensor_name, datum_type):
@@ -265,88 +562,90 @@ def newview(request):
     return render(request, 'pulogger/new_view.html', context)
 
 
-similar_value_update_lockout = timedelta(minutes=29, seconds=50)
-different_value_update_lockout = timedelta(seconds=50)
-data_update_hysteresis = {
-    'temperature': 0.2,
-    'humidity': 2.0,
-}
+INGEST_QUEUE_FULL_RETRY_AFTER = 60
+
+
+def get_queue_full_response():
+    # The drainer has fallen behind; loggers keep their readings buffered and retry later
+    response = HttpResponse('ingest queue full', content_type='text/plain', status=503)
+    response['Retry-After'] = INGEST_QUEUE_FULL_RETRY_AFTER
+    return response
 
 
-def submit_data(request):  # todo: refactor this fat-ass view
+def ingest_queue_status(request):
+    # Authorised like the metrics; in direct mode there's no spool to report on (or to create by opening it)
+    if not is_metrics_request_authorised(request):
+        return HttpResponse('forbidden', content_type='text/plain', status=403)
+    if not is_queued_ingest_enabled():
+        return HttpResponse(json_dumps({'enabled': False}), content_type='application/json')
+
+    return HttpResponse(json_dumps(dict(get_queue_stats(), enabled=True)), content_type='application/json')
+
+
+def metrics(request):
+    if not is_metrics_request_authorised(request):
+        return HttpResponse('forbidden', content_type='text/plain', status=403)
+
+    gauges = {}
+    if is_queued_ingest_enabled():
+        queue_stats = get_queue_stats()
+        gauges['ingest_queue_depth'] = ('Readings waiting in the ingest queue', queue_stats['depth'])
+        gauges['ingest_queue_drain_lag_seconds'] = ('Age of the oldest reading in the ingest queue',
+                                                    queue_stats['drain_lag'])
+
+    return HttpResponse(render_prometheus(gauges), content_type='text/plain; version=0.0.4')
+
+
+def submit_data(request):
     device = request.GET['device']
     sensor_names = request.GET['sensors'].split(',')
     datum_types = request.GET['types'].split(',')
     datum_values = request.GET['values'].split(',')
     timestamp = datetime.utcfromtimestamp(int(request.GET['timestamp'])).replace(tzinfo=timezone(timedelta()))
-    data = ({'sensor_name': sensor_names[idx], 'type': datum_types[idx], 'value': Decimal(datum_values[idx])} for idx in
-            range(0, len(sensor_names)))
+    readings = (Reading(sensor_names[idx], datum_types[idx], Decimal(datum_values[idx]), timestamp) for idx in
+                range(0, len(sensor_names)))
     submission_ip = "1.1.1.1"  # placeholder
 
+    try:
+        results = submit_readings(device, readings, submission_ip)
+    except IngestQueueFullError:
+        return get_queue_full_response()
+
     context = {
-        'success': True,
-        'response': ''
+        'success': all(result.success for result in results),
+        'response': ''.join(f'{result.message}<br>' for result in results)
     }
 
-    for datum in data:
-        try:
-            sensor = Sensor.objects.get(
-                sensor_name=datum['sensor_name'],
-                datalogger__device_name=device
-            )
-
-            # Get the datumtype id so we can generate the full 'sensor_name;sensor_id_;type_id' string
-            datum_type = SensorModelDatumType.objects.filter(sensor__type=sensor.type.type,
-                                                             datum_type__description=datum['type']).first()
-
-            # Check that a valid sensor exists for the parameters provided, else throw exception
-            if not datum_type:
-                raise DataTypeMismatchError('Sensor type {} cannot measure {}.'.format(sensor.type.type, datum['type']))
-
-            # Get the (indexed, unique) full-form sensor name and most recent reading
-            unique_sensor_name = f'{sensor.sensor_name};{sensor.id};{datum_type.id}'
-            most_recent_reading = SensorDatum.objects.filter(unique_sensor_name=unique_sensor_name).order_by(
-                '-timestamp').first()
-
-            # if the difference from last logged value exceeds hysteresis, or last log happened sufficiently long ago
-            if not most_recent_reading \
-                    or abs(datum['value'] - most_recent_reading.value) > data_update_hysteresis[datum['type']] \
-                    and timestamp > (
-                    most_recent_reading.timestamp + different_value_update_lockout) \
-                    or timestamp > (
-                    most_recent_reading.timestamp + similar_value_update_lockout):
-                # log the datum
-                new_datum = SensorDatum(
-                    submission_ip=submission_ip,
-                    timestamp=timestamp,
-                    value=datum['value'],
-                    sensor_id=sensor.pk,
-                    type_id=DatumType.objects.get(description=datum['type']).pk,
-                )
-
-                new_datum.full_clean()
-                new_datum.save()
-
-                context['response'] += f'Successfully logged {str(new_datum)}<br>'
-            else:
-                context['success'] = False
-                context['response'] += 'Datum ignored: Value similar to recently-logged previous datum.<br>'
+    return render(request, 'pulogger/submitDatumResponse.html', context)
 
-        except ValidationError:
-            context['success'] = False
-            context['response'] += 'Error: Submitted datum failed validation.<br>'
 
-        except ObjectDoesNotExist:
-            context['success'] = False
-            context['response'] += 'Error: No such device, or no such sensor named {} attached to device.<br>'.format(
-                datum[
-                    "sensor_name"])
+@csrf_exempt
+@require_POST
+def submit_batch(request):
+    # Compact upload for dataloggers on metered links: any number of buffered samples in one (optionally gzipped)
+    # NDJSON body, answered with a plain-text "<logged> <not logged>" count rather than an HTML page
+    device = request.GET['device']
+    if get_metadata().get_datalogger(device) is None:
+        return HttpResponse('unknown device', content_type='text/plain', status=404)
+
+    try:
+        body = request.body
+        if request.META.get('HTTP_CONTENT_ENCODING') == 'gzip':
+            body = decompress_submission(body)
+        readings = parse_batch_submission(body.decode())
+    except UnicodeDecodeError:
+        return HttpResponse('invalid encoding', content_type='text/plain', status=400)
+    except MalformedSubmissionError as err:
+        return HttpResponse(err.message, content_type='text/plain', status=400)
 
-        except DataTypeMismatchError as err:
-            context['success'] = False
-            context['response'] += f'{err.message}<br>'
+    submission_ip = "1.1.1.1"  # placeholder
+    try:
+        results = submit_readings(device, readings, submission_ip)
+    except IngestQueueFullError:
+        return get_queue_full_response()
 
-    return render(request, 'pulogger/submitDatumResponse.html', context)
+    logged = sum(result.success for result in results)
+    return HttpResponse(f'{logged} {len(results) - logged}', content_type='text/plain')
 
 
 def index(request):